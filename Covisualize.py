@@ -1,10 +1,6 @@
-import numpy as np
-import pandas as pd
 import streamlit as st
 
-import altair as alt
-
-from utils import site_data_abstraction
+from utils import dataset_holder
 from utils import data_fetcher
 from utils import processing_utils
 from utils import graphing
@@ -53,29 +49,16 @@ state = session_state.get(
     country=None,
     states=None,
     county=None,
+    county_state=None,
     overlay_metric=streamlit_ui.default_overlay_metric,
     overlay_threshold=streamlit_ui.default_overlay_threshold,
     overlay=False,
+    days_since_threshold=False,
     chart=None,
     log=False,
 )
 
 
-def get_hours_from_epoch():
-    return int(time.time() // (60 * 60))
-
-
-@st.cache
-def load_data(curr_time):
-    data = site_data_abstraction.Data()
-    dropdown_options = data_fetcher.get_dropdown_options(data)
-
-    return (data, dropdown_options)
-
-
-# We need to grab the curr time as a way to smartly cache
-curr_time = get_hours_from_epoch()
-
 streamlit_ui.add_header_and_title(st)
 
 if st.checkbox("Show instructions"):
@@ -84,8 +67,29 @@ if st.checkbox("Show instructions"):
 if st.checkbox("Show Entity to Metrics mapping"):
     streamlit_ui.load_entity_to_metrics_mapping(st)
 
-if state.data is None:
-    state.data, state.dropdown_options = load_data(curr_time)
+# The data is built once per process and refreshed in the background: a
+# session picks up the new generation on its next run
+data = dataset_holder.SHARED_DATA.get()
+if state.data is None or state.data.generation != data.generation:
+    if state.data is not None:
+        # Rebuild the widgets from the filtered picks below
+        state.key = state.key + 1
+
+    state.data = data
+    state.dropdown_options = data_fetcher.get_dropdown_options(data)
+
+    # Entities gone from the new generation can no longer be picked
+    entities = state.dropdown_options[processing_utils.ENTITY_COL]
+    for key, entity_col in [
+        ("country", processing_utils.COUNTRY_COL),
+        ("states", processing_utils.STATE_COL),
+        ("county", processing_utils.COUNTY_COL),
+    ]:
+        picked = getattr(state, key)
+        if picked is not None:
+            setattr(
+                state, key, [name for name in picked if name in entities[entity_col]]
+            )
 
 ### Build a placeholder cell ###
 st.markdown("""## Graph ## """)
@@ -105,6 +109,8 @@ countries_selector = st.sidebar.empty()
 
 states_selector = st.sidebar.empty()
 
+county_state_selector = st.sidebar.empty()
+
 counties_selector = st.sidebar.empty()
 
 log_box = st.sidebar.empty()
@@ -114,6 +120,7 @@ st.sidebar.markdown("""### Overlay (optional):""")
 overlay_box = st.sidebar.empty()
 overlay_metric_selector = st.sidebar.empty()
 overlay_threshold_box = st.sidebar.empty()
+days_since_threshold_box = st.sidebar.empty()
 
 plot_button = st.sidebar.button("Plot")
 
@@ -126,12 +133,14 @@ if reset_button:
     state.country = streamlit_ui.default_country
     state.county = streamlit_ui.default_county
     state.states = streamlit_ui.default_states
+    state.county_state = streamlit_ui.default_county_state
     state.metrics = streamlit_ui.default_metrics
     state.overlay_metric = streamlit_ui.default_overlay_metric
     state.overlay_threshold = streamlit_ui.default_overlay_threshold
 
     state.chart = None
     state.overlay = False
+    state.days_since_threshold = False
 
 
 if state.metrics is None:
@@ -146,6 +155,9 @@ if state.states is None:
 if state.county is None:
     state.county = streamlit_ui.default_county
 
+if state.county_state is None:
+    state.county_state = streamlit_ui.default_county_state
+
 ### Actually implement the selector menus
 metrics = metrics_selector.multiselect(
     "Type(s) of data to plot",
@@ -168,9 +180,21 @@ states = states_selector.multiselect(
     key=state.key,
 )
 
+# Counties are picked by state: only the counties of the picked states and
+# of the browsed state are sent, not all of them on every run
+county_states = [streamlit_ui.default_county_state] + data_fetcher.get_county_states(
+    state.data
+)
+county_state = county_state_selector.selectbox(
+    "Browse the counties of:",
+    county_states,
+    index=streamlit_ui.get_default_index(state.county_state, county_states),
+    key=state.key,
+)
+
 counties = counties_selector.multiselect(
     "US Counties:",
-    state.dropdown_options[processing_utils.ENTITY_COL][processing_utils.COUNTY_COL],
+    data_fetcher.get_county_options(state.data, states + [county_state], state.county),
     default=state.county,
     key=state.key,
 )
@@ -194,6 +218,9 @@ state.county = counties
 prev_states = state.states
 state.states = states
 
+prev_county_state = state.county_state
+state.county_state = county_state
+
 
 if metrics != prev_metrics:
     raise RerunException(RerunData(widget_state=None))
@@ -210,6 +237,9 @@ if counties != prev_counties:
 if states != prev_states:
     raise RerunException(RerunData(widget_state=None))
 
+if county_state != prev_county_state:
+    raise RerunException(RerunData(widget_state=None))
+
 if overlay_checkbox:
     overlay_metric = overlay_metric_selector.selectbox(
         label="Overlay Metric:",
@@ -221,13 +251,21 @@ if overlay_checkbox:
     overlay_threshold = overlay_threshold_box.number_input(
         label="Overlay Threshold:", key=state.key, value=state.overlay_threshold
     )
+
+    days_since_threshold = days_since_threshold_box.checkbox(
+        "Plot against days since the threshold",
+        key=state.key,
+        value=state.days_since_threshold,
+    )
 else:
     overlay_metric = None
     overlay_threshold = None
+    days_since_threshold = False
 
 prev_overlay_metric = state.overlay_metric
 prev_overlay_threshold = state.overlay_threshold
 prev_overlay = state.overlay
+prev_days_since_threshold = state.days_since_threshold
 prev_log = state.log
 
 state.overlay_metric = (
@@ -243,6 +281,7 @@ state.overlay_threshold = (
     else streamlit_ui.default_overlay_threshold
 )
 state.overlay = overlay_checkbox
+state.days_since_threshold = days_since_threshold
 state.log = log_checkbox
 
 
@@ -257,6 +296,9 @@ if prev_overlay_threshold != state.overlay_threshold:
 if prev_overlay != state.overlay:
     raise RerunException(RerunData(widget_state=None))
 
+if prev_days_since_threshold != state.days_since_threshold:
+    raise RerunException(RerunData(widget_state=None))
+
 if prev_log != state.log:
     raise RerunException(RerunData(widget_state=None))
 
@@ -280,6 +322,7 @@ if plot_button:
         overlay_checkbox,
         overlay_metric,
         overlay_threshold,
+        days_since_threshold,
     )
 
     successfully_updated_chart = False
@@ -300,7 +343,10 @@ if plot_button:
                 (
                     all_dataframes,
                     all_plots,
-                ) = data_fetcher.fetch_streamlit_raw_data_display(displayable_data)
+                ) = data_fetcher.fetch_streamlit_raw_data_display(
+                    displayable_data,
+                    data_fetcher.get_summary_stats(state.data, request),
+                )
 
                 state.chart = chart
 
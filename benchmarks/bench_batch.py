@@ -0,0 +1,96 @@
+"""
+Batch query benchmark.
+
+Times a batch of random requests on a county-sized frame and the state frame
+built from it, answered one by one by CovidData.get_displayable_data and all
+at once by CovidData.process_many, and checks that both give the same
+results. Overlay requests are answered one by one in both cases, so they are
+left out unless --overlays is given.
+
+Usage (from the repository root):
+    python benchmarks/bench_batch.py [--counties 3200] [--days 120]
+        [--requests 200] [--overlays] [--workers 1]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from bench_tensor_store import METRICS, STATES, make_frames  # noqa: E402
+from utils.covid_dataset import CovidData  # noqa: E402
+from utils.processing_utils import CONFIRMED_COL, COUNTY_COL, STATE_COL  # noqa: E402
+
+
+def make_requests(counties, count, overlays=False, seed=0):
+    rng = random.Random(seed)
+    requests = []
+
+    for _ in range(count):
+        filter_dict = {
+            STATE_COL: ["State {}".format(i) for i in rng.sample(range(STATES), 3)],
+            COUNTY_COL: [
+                "County {} (State)".format(i)
+                for i in rng.sample(range(counties), rng.randint(1, 10))
+            ],
+        }
+        # Some requests read every state, like the summary table does
+        if rng.random() < 0.1:
+            filter_dict[STATE_COL] = ["ALL"]
+        threshold = rng.choice([None, 100]) if overlays else None
+
+        requests.append(
+            dict(
+                entities=[STATE_COL, COUNTY_COL],
+                measurements=rng.sample(METRICS, 2),
+                filter_dict=filter_dict,
+                threshold_value=threshold,
+                threshold_metric=CONFIRMED_COL if threshold is not None else None,
+            )
+        )
+
+    return requests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counties", type=int, default=3200)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--overlays", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    frames = make_frames(args.counties, args.days)
+    print("County frame: {} rows".format(len(frames[1])))
+    data = CovidData(frames)
+    requests = make_requests(args.counties, args.requests, overlays=args.overlays)
+
+    start = time.perf_counter()
+    expected = [data.get_displayable_data(**request) for request in requests]
+    single_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = data.process_many(requests, workers=args.workers)
+    batch_s = time.perf_counter() - start
+
+    for expected_dict, result_dict in zip(expected, results):
+        assert list(expected_dict) == list(result_dict)
+        for metric in expected_dict:
+            pd.testing.assert_frame_equal(
+                result_dict[metric], expected_dict[metric], check_exact=True
+            )
+
+    print("one by one: {:.3f}s".format(single_s))
+    print("batch: {:.3f}s".format(batch_s))
+    print("speedup: {:.1f}x".format(single_s / batch_s))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Derived-metric benchmark.
+
+Times the daily increase and percent change columns of a county-sized frame,
+computed by processing_utils.add_derived_metrics and by the previous
+implementation (one sort and one groupby per column, per metric), and checks
+that both give the same frame.
+
+Usage (from the repository root):
+    python benchmarks/bench_derived_metrics.py [--counties 3200] [--days 120]
+        [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from utils import processing_utils  # noqa: E402
+from utils.processing_utils import (  # noqa: E402
+    CONFIRMED_COL,
+    COUNTY_COL,
+    DATE_COL,
+    DEATHS_COL,
+    DELTA_COL_SUFFIX,
+    DELTA_PERCENT_COL_SUFFIX,
+)
+
+METRIC_COLS = [CONFIRMED_COL, DEATHS_COL]
+
+
+def legacy_add_rolling_diff(df, sort_cols, diff_group_cols, agg_cols):
+    sorted_df = df.sort_values(by=sort_cols)
+    for agg_col_name in agg_cols:
+        delta_col_name = agg_col_name + DELTA_COL_SUFFIX
+        sorted_df[delta_col_name] = (
+            sorted_df.groupby(diff_group_cols)[agg_col_name]
+            .diff()
+            .fillna(sorted_df[agg_col_name], inplace=False)
+        )
+
+    return sorted_df
+
+
+def legacy_add_percent_change(df, sort_cols, diff_group_cols, agg_cols):
+    sorted_df = df.sort_values(by=sort_cols)
+    for agg_col_name in agg_cols:
+        delta_col_name = agg_col_name + DELTA_PERCENT_COL_SUFFIX
+        sorted_df[delta_col_name] = sorted_df.groupby(diff_group_cols)[
+            agg_col_name
+        ].pct_change()
+        sorted_df[delta_col_name] = (
+            sorted_df[delta_col_name]
+            .replace([np.inf, -np.inf], np.nan)
+            .fillna(0, inplace=False)
+        )
+        sorted_df[delta_col_name] = (sorted_df[delta_col_name] * 100).round(1)
+
+    return sorted_df
+
+
+def legacy_county_metrics(df):
+    df = legacy_add_rolling_diff(df, [DATE_COL, COUNTY_COL], [COUNTY_COL], METRIC_COLS)
+    return legacy_add_percent_change(
+        df, [DATE_COL, COUNTY_COL], [COUNTY_COL], METRIC_COLS
+    )
+
+
+def county_metrics(df):
+    return processing_utils.add_derived_metrics(
+        df,
+        sort_cols=[DATE_COL, COUNTY_COL],
+        diff_group_cols=[COUNTY_COL],
+        delta_cols=METRIC_COLS,
+        percent_cols=METRIC_COLS,
+    )
+
+
+def make_county_frame(counties, days, seed=0):
+    """
+    A long county table shaped like the JHU one: one row per county and day,
+    with cumulative counts, in the order the JHU melt produces.
+    """
+    rng = np.random.RandomState(seed)
+    names = np.array(["County {} (State)".format(i) for i in range(counties)])
+    day_range = pd.date_range("2020-01-22", periods=days)
+
+    confirmed = rng.poisson(3, size=(days, counties)).cumsum(axis=0)
+    deaths = rng.poisson(0.2, size=(days, counties)).cumsum(axis=0)
+
+    return pd.DataFrame(
+        {
+            COUNTY_COL: np.tile(names, days),
+            DATE_COL: np.repeat(day_range.values, counties),
+            CONFIRMED_COL: confirmed.reshape(-1),
+            DEATHS_COL: deaths.reshape(-1),
+        }
+    )
+
+
+def time_function(function, df, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function(df)
+        samples.append(time.perf_counter() - start)
+
+    return statistics.median(samples), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counties", type=int, default=3200)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    df = make_county_frame(args.counties, args.days)
+    print("County frame: {} rows".format(len(df)))
+
+    legacy_s, expected = time_function(legacy_county_metrics, df, args.runs)
+    engine_s, result = time_function(county_metrics, df, args.runs)
+
+    pd.testing.assert_frame_equal(result, expected)
+
+    print("legacy add_rolling_diff + add_percent_change: {:.3f}s".format(legacy_s))
+    print("add_derived_metrics: {:.3f}s".format(engine_s))
+    print("speedup: {:.1f}x".format(legacy_s / engine_s))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+County picker benchmark.
+
+Builds an entity catalog shaped like the app's (US states labelled
+"State (United States)", counties labelled "County (State)") and compares,
+per script run, the county options sent to the browser by the flat picker
+(every county) and by the hierarchical one (the picked counties and the
+counties of the picked and browsed states): the bytes of the options as
+encoded in the widget's protobuf message, and the time to build and encode
+them.
+
+The websocket and the browser are not part of the timings: the payload size
+is what they scale with.
+
+Usage (from the repository root):
+    python benchmarks/bench_selectors.py [--counties 3300] [--states 55]
+        [--runs 1000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from utils import data_fetcher  # noqa: E402
+from utils.entity_catalog import build_entity_catalog  # noqa: E402
+from utils.processing_utils import COUNTRY_COL, COUNTY_COL, STATE_COL  # noqa: E402
+
+
+class CatalogData:
+    def __init__(self, entity_catalog):
+        self.entity_catalog = entity_catalog
+
+
+def make_data(counties, states, seed=0):
+    rng = random.Random(seed)
+    state_names = ["State {}".format(i) for i in range(states)]
+    # A few states hold many counties, like Texas and Georgia
+    weights = [rng.paretovariate(1.5) for _ in state_names]
+    county_states = rng.choices(state_names, weights=weights, k=counties)
+
+    frames = [
+        pd.DataFrame({COUNTRY_COL: ["United States", "Canada"]}),
+        pd.DataFrame(
+            {STATE_COL: ["{} (United States)".format(name) for name in state_names]}
+        ),
+        pd.DataFrame(
+            {
+                COUNTY_COL: [
+                    "County {} ({})".format(i, state)
+                    for i, state in enumerate(county_states)
+                ]
+            }
+        ),
+    ]
+
+    return CatalogData(build_entity_catalog(frames))
+
+
+def get_options_bytes(options):
+    # Each option is a length-delimited string field: a tag byte, the
+    # varint length and the UTF-8 bytes
+    size = 0
+    for option in options:
+        length = len(option.encode("utf-8"))
+        size += 1 + len(encode_varint(length)) + length
+
+    return size
+
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def get_flat_options(data, browsed, picked):
+    return [data.entity_catalog.entities[COUNTY_COL]]
+
+
+def get_hierarchical_options(data, browsed, picked):
+    # The browsing picker is sent too
+    county_states = data_fetcher.get_county_states(data)
+    return [county_states, data_fetcher.get_county_options(data, browsed, picked)]
+
+
+def time_runs(get_options, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        sum(get_options_bytes(options) for options in get_options())
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counties", type=int, default=3300)
+    parser.add_argument("--states", type=int, default=55)
+    parser.add_argument("--runs", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    data = make_data(args.counties, args.states)
+    catalog = data.entity_catalog
+    county_states = data_fetcher.get_county_states(data)
+    picked = catalog.entities[COUNTY_COL][:5]
+
+    state_sizes = sorted(
+        len(catalog.get_children(STATE_COL, state)) for state in county_states
+    )
+    median_state = next(
+        state
+        for state in county_states
+        if len(catalog.get_children(STATE_COL, state))
+        == state_sizes[len(state_sizes) // 2]
+    )
+    largest_state = max(
+        county_states, key=lambda state: len(catalog.get_children(STATE_COL, state))
+    )
+
+    print(
+        "{} counties in {} states, 5 counties picked".format(
+            len(catalog.entities[COUNTY_COL]), len(county_states)
+        )
+    )
+    for name, get_options, browsed in [
+        ("flat picker", get_flat_options, []),
+        ("hierarchical, no state browsed", get_hierarchical_options, []),
+        ("hierarchical, median state", get_hierarchical_options, [median_state]),
+        ("hierarchical, largest state", get_hierarchical_options, [largest_state]),
+    ]:
+        options = get_options(data, browsed, picked)
+        print(
+            "{}: {} options, {:.1f} KB per run, {:.3f}ms to build".format(
+                name,
+                sum(len(widget_options) for widget_options in options),
+                sum(get_options_bytes(widget_options) for widget_options in options)
+                / 1024,
+                time_runs(lambda: get_options(data, browsed, picked), args.runs),
+            )
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Tensor store benchmark.
+
+Times CovidData.get_displayable_data on a county-sized frame and the state
+frame built from it, answered by the pandas path and by the tensor store,
+for the same random requests (with and without a threshold overlay), and
+checks that both give the same results.
+
+Usage (from the repository root):
+    python benchmarks/bench_tensor_store.py [--counties 3200] [--days 120]
+        [--requests 50]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from bench_derived_metrics import county_metrics, make_county_frame  # noqa: E402
+from utils.covid_dataset import CovidData  # noqa: E402
+from utils.processing_utils import (  # noqa: E402
+    CONFIRMED_COL,
+    COUNTY_COL,
+    DATE_COL,
+    DEATHS_COL,
+    DELTA_COL_SUFFIX,
+    DELTA_PERCENT_COL_SUFFIX,
+    STATE_COL,
+)
+
+STATES = 50
+
+METRICS = [
+    CONFIRMED_COL,
+    DEATHS_COL,
+    CONFIRMED_COL + DELTA_COL_SUFFIX,
+    CONFIRMED_COL + DELTA_PERCENT_COL_SUFFIX,
+]
+
+
+def make_frames(counties, days):
+    county_df = county_metrics(make_county_frame(counties, days))
+    county_df[STATE_COL] = [
+        "State {}".format(int(name.split()[1]) % STATES)
+        for name in county_df[COUNTY_COL]
+    ]
+
+    state_df = (
+        county_df.groupby([DATE_COL, STATE_COL])[[CONFIRMED_COL, DEATHS_COL]]
+        .sum()
+        .reset_index()
+    )
+
+    return [state_df, county_df]
+
+
+def make_requests(counties, count, seed=0):
+    rng = random.Random(seed)
+    requests = []
+
+    for _ in range(count):
+        filter_dict = {
+            STATE_COL: ["State {}".format(i) for i in rng.sample(range(STATES), 3)],
+            COUNTY_COL: [
+                "County {} (State)".format(i)
+                for i in rng.sample(range(counties), rng.randint(1, 10))
+            ],
+        }
+        threshold = rng.choice([None, 100])
+
+        requests.append(
+            dict(
+                entities=[STATE_COL, COUNTY_COL],
+                measurements=rng.sample(METRICS, 2),
+                filter_dict=filter_dict,
+                threshold_value=threshold,
+                threshold_metric=CONFIRMED_COL if threshold is not None else None,
+            )
+        )
+
+    return requests
+
+
+def time_requests(data, requests):
+    results = []
+    start = time.perf_counter()
+    for request in requests:
+        results.append(data.get_displayable_data(**request))
+
+    return time.perf_counter() - start, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counties", type=int, default=3200)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    frames = make_frames(args.counties, args.days)
+    print("County frame: {} rows".format(len(frames[1])))
+
+    start = time.perf_counter()
+    pandas_data = CovidData([df.copy() for df in frames])
+    print("pandas set up: {:.3f}s".format(time.perf_counter() - start))
+
+    start = time.perf_counter()
+    tensor_data = CovidData([df.copy() for df in frames], tensor=True)
+    print("tensor set up: {:.3f}s".format(time.perf_counter() - start))
+
+    tensor_bytes = sum(
+        tensor.values.nbytes + tensor.present.nbytes
+        for tensor in tensor_data.tensor_store.tensors
+    )
+    print("tensor memory: {:.1f} MB".format(tensor_bytes / 1024 / 1024))
+
+    requests = make_requests(args.counties, args.requests)
+    pandas_s, expected = time_requests(pandas_data, requests)
+    tensor_s, results = time_requests(tensor_data, requests)
+
+    for expected_dict, result_dict in zip(expected, results):
+        assert list(expected_dict) == list(result_dict)
+        for metric in expected_dict:
+            pd.testing.assert_frame_equal(
+                result_dict[metric], expected_dict[metric], check_exact=True
+            )
+
+    print("pandas path: {:.1f}ms per request".format(pandas_s / len(requests) * 1000))
+    print("tensor store: {:.1f}ms per request".format(tensor_s / len(requests) * 1000))
+    print("speedup: {:.1f}x".format(pandas_s / tensor_s))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Startup import benchmark.
+
+Imports each target module in a fresh interpreter with `python -X importtime`,
+reports the modules that cost the most, and exits with an error when a target
+goes over its budget.
+
+Usage (from the repository root):
+    python benchmarks/import_budget.py [--runs 5] [--top 10] [--scale 1.0]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Cumulative import time allowed for each module, in milliseconds. None of
+# these may import kaggle, requests, altair or streamlit.
+BUDGETS_MS = {
+    "utils.processing_utils": 800,
+    "utils.covid_dataset": 800,
+    "utils.data_fetcher": 800,
+    "utils.api_utils": 900,
+    "utils.site_data_abstraction": 1000,
+}
+
+FORBIDDEN_MODULES = ["kaggle", "requests", "altair", "streamlit"]
+
+
+def parse_importtime(stderr):
+    """
+    Returns {module: (self_us, cumulative_us)} from `-X importtime` output.
+    """
+    modules = {}
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+
+    return modules
+
+
+def time_import(module):
+    # -E and -s keep the user's environment and site-packages customizations
+    # out of the measurement
+    result = subprocess.run(
+        [sys.executable, "-E", "-s", "-X", "importtime", "-c", "import " + module],
+        cwd=ROOT_DIR,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return parse_importtime(result.stderr)
+
+
+def measure(module, runs):
+    # The first run compiles bytecode and warms the filesystem cache
+    time_import(module)
+    samples = [time_import(module) for _ in range(runs)]
+
+    totals = [sample[module][1] for sample in samples]
+    median_run = samples[totals.index(sorted(totals)[len(totals) // 2])]
+
+    return statistics.median(totals) / 1000.0, median_run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiply every budget, for slower machines",
+    )
+    args = parser.parse_args(argv)
+
+    failures = []
+
+    for module, budget_ms in BUDGETS_MS.items():
+        total_ms, breakdown = measure(module, args.runs)
+        budget_ms = budget_ms * args.scale
+        status = "ok" if total_ms <= budget_ms else "OVER BUDGET"
+
+        print(
+            "{}: {:.1f} ms (budget {:.0f} ms) {}".format(
+                module, total_ms, budget_ms, status
+            )
+        )
+
+        top = sorted(breakdown.items(), key=lambda item: -item[1][1])
+        for name, (self_us, cumulative_us) in top[: args.top]:
+            print(
+                "    {:>9.1f} ms cumulative {:>9.1f} ms self  {}".format(
+                    cumulative_us / 1000.0, self_us / 1000.0, name
+                )
+            )
+
+        if total_ms > budget_ms:
+            failures.append(module)
+
+        for name in FORBIDDEN_MODULES:
+            if name in breakdown:
+                print("    imports {} at startup".format(name))
+                failures.append(module)
+
+    if failures:
+        print("Import budget exceeded by: " + ", ".join(sorted(set(failures))))
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from utils import io_utils
+from utils import processing_utils
+
+DATES = ["3/1/20", "3/2/20", "3/3/20", "3/4/20", "3/5/20"]
+
+LOCATIONS = [
+    # UID, Admin2, Province_State
+    (1, "Albany", "New York"),
+    (2, "Kings", "New York"),
+    (3, "Unassigned", "New York"),
+    (4, None, "Guam"),
+]
+
+
+def make_jhu_frames(dates, deaths_offset=0):
+    deaths = []
+    confirmed = []
+
+    for i, (uid, admin2, state) in enumerate(LOCATIONS):
+        ids = {
+            "UID": uid,
+            "iso2": "US",
+            "iso3": "USA",
+            "code3": 840,
+            "FIPS": 1000 + uid,
+            "Admin2": admin2,
+            "Province_State": state,
+            "Country_Region": "US",
+            "Lat": 0.0,
+            "Long_": 0.0,
+            "Combined_Key": "{}, {}, US".format(admin2, state),
+        }
+        confirmed_row = dict(ids)
+        deaths_row = dict(ids, Population=1000)
+
+        for d, date in enumerate(dates):
+            confirmed_row[date] = (i + 1) * d * d
+            deaths_row[date] = i * d + deaths_offset
+
+        confirmed.append(confirmed_row)
+        deaths.append(deaths_row)
+
+    return pd.DataFrame(deaths), pd.DataFrame(confirmed)
+
+
+class CountyJhuTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patch = mock.patch.object(io_utils, "CACHE_DIR", self.tmp_dir)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def build(self, dates, overwrite=False, deaths_offset=0):
+        deaths, confirmed = make_jhu_frames(dates, deaths_offset=deaths_offset)
+        return processing_utils.post_process_county_df_jhu(
+            deaths, confirmed, overwrite=overwrite
+        )
+
+    def assert_same_table(self, left, right):
+        pd.testing.assert_frame_equal(
+            left.reset_index(drop=True).astype(str),
+            right.reset_index(drop=True).astype(str),
+        )
+
+    def test_incremental_matches_full_build(self):
+        self.build(DATES[:3])
+
+        with mock.patch.object(
+            processing_utils,
+            "melt_county_df_jhu",
+            wraps=processing_utils.melt_county_df_jhu,
+        ) as melt:
+            incremental = self.build(DATES)
+
+        # Only the watermark date and the two new dates were melted
+        melted_deaths = melt.call_args[0][0]
+        self.assertEqual(
+            processing_utils.get_jhu_date_cols(
+                melted_deaths, processing_utils.JHU_DEATHS_ID_COLS
+            ),
+            DATES[2:],
+        )
+
+        full = self.build(DATES, overwrite=True)
+        self.assert_same_table(incremental, full)
+        manifest = io_utils.read_manifest(processing_utils.JHU_CACHE_NAME)
+        self.assertEqual(manifest["extra"]["last_date"], "2020-03-05")
+
+    def test_unchanged_source_uses_cache(self):
+        first = self.build(DATES)
+
+        with mock.patch.object(processing_utils, "melt_county_df_jhu") as melt:
+            second = self.build(DATES)
+
+        melt.assert_not_called()
+        self.assert_same_table(first, second)
+
+    def test_unchanged_files_are_not_parsed(self):
+        deaths, confirmed = [
+            df.to_csv(index=False).encode("utf-8") for df in make_jhu_frames(DATES)
+        ]
+        first = processing_utils.load_county_df_jhu(deaths, confirmed)
+
+        with mock.patch.object(pd, "read_csv") as read_csv:
+            second = processing_utils.load_county_df_jhu(deaths, confirmed)
+
+        read_csv.assert_not_called()
+        self.assert_same_table(first, second)
+
+        # Other bytes are parsed, then extend the cached table
+        deaths, confirmed = [
+            df.to_csv(index=False).encode("utf-8")
+            for df in make_jhu_frames(DATES + ["3/6/20"])
+        ]
+        self.assertEqual(
+            processing_utils.load_county_df_jhu(deaths, confirmed)[
+                processing_utils.DATE_COL
+            ].max(),
+            pd.Timestamp("2020-03-06"),
+        )
+
+    def test_revised_history_is_rebuilt(self):
+        self.build(DATES[:3])
+
+        revised = self.build(DATES, deaths_offset=1)
+        full = self.build(DATES, overwrite=True, deaths_offset=1)
+        self.assert_same_table(revised, full)
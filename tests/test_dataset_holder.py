@@ -0,0 +1,140 @@
+import itertools
+import threading
+import unittest
+from unittest import mock
+
+from utils.dataset_holder import DatasetHolder
+
+
+class FakeBuild:
+    """
+    Builds fake data objects, each build blocking until it is released.
+    """
+
+    def __init__(self):
+        self.generations = itertools.count(1)
+        self.started = threading.Semaphore(0)
+        self.release = threading.Semaphore(0)
+        self.builds = 0
+        self.error = None
+        self.stale = False
+
+    def __call__(self):
+        self.builds += 1
+        self.started.release()
+        self.release.acquire()
+        if self.error is not None:
+            raise self.error
+
+        build = self
+        generation = next(self.generations)
+
+        class FakeData:
+            def __init__(self):
+                self.generation = generation
+
+            def should_update(self):
+                return build.stale
+
+        return FakeData()
+
+
+class DatasetHolderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.build = FakeBuild()
+        self.holder = DatasetHolder(build=self.build)
+
+        # Keep the refresh reports out of the test output
+        patcher = mock.patch("builtins.print")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_in_threads(self, count):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.holder.get()))
+            for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+
+        return threads, results
+
+    def wait_for_refresh(self):
+        thread = self.holder.thread
+        if thread is not None:
+            thread.join()
+
+    def test_concurrent_first_requests_share_one_build(self):
+        threads, results = self.get_in_threads(4)
+        self.build.started.acquire()
+        self.build.release.release()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.build.builds, 1)
+        self.assertEqual([data.generation for data in results], [1, 1, 1, 1])
+
+    def test_stale_data_is_served_during_refresh(self):
+        self.build.release.release()
+        first = self.holder.get()
+        self.build.started.acquire()
+
+        self.build.stale = True
+        self.assertIs(self.holder.get(), first)
+        self.build.started.acquire()
+
+        # The refresh is running: requests keep the previous generation
+        self.assertIs(self.holder.get(), first)
+        self.assertTrue(self.holder.stats()["refreshing"])
+        self.assertEqual(self.build.builds, 2)
+
+        self.build.stale = False
+        self.build.release.release()
+        self.wait_for_refresh()
+
+        self.assertEqual(self.holder.get().generation, 2)
+        stats = self.holder.stats()
+        self.assertEqual(stats["generation"], 2)
+        self.assertEqual(stats["refreshes"], 2)
+        self.assertFalse(stats["refreshing"])
+
+    def test_failed_refresh_keeps_data(self):
+        self.build.release.release()
+        first = self.holder.get()
+
+        self.build.stale = True
+        self.build.error = IOError("source down")
+        self.build.release.release()
+        self.holder.get()
+        self.wait_for_refresh()
+
+        # Not tried again before the retry delay
+        self.assertIs(self.holder.get(), first)
+        self.assertIsNone(self.holder.thread)
+        self.assertEqual(self.build.builds, 2)
+
+        stats = self.holder.stats()
+        self.assertEqual(stats["generation"], 1)
+        self.assertEqual(stats["failures"], 1)
+        self.assertIs(stats["last_error"], self.build.error)
+
+        self.holder.retry_seconds = 0
+        self.build.error = None
+        self.build.release.release()
+        self.holder.get()
+        self.wait_for_refresh()
+
+        self.assertEqual(self.holder.get().generation, 2)
+
+    def test_failed_first_build_raises(self):
+        self.build.error = IOError("source down")
+        self.build.release.release()
+
+        with self.assertRaises(IOError):
+            self.holder.get()
+
+        # The next request tries again
+        self.build.error = None
+        self.build.release.release()
+        self.assertEqual(self.holder.get().generation, 1)
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from utils import dates
+
+
+class DatesTestCase(unittest.TestCase):
+    def test_parse_formats(self):
+        cases = [
+            (pd.Series([20200302, 20200301, 20200302]), "%Y%m%d"),
+            (pd.Series(["3/2/20", "3/1/20", "3/2/20"]), "%m/%d/%y"),
+            (
+                pd.Series(
+                    [
+                        "2020-03-02T21:00:00Z",
+                        "2020-03-01T04:00:00Z",
+                        "2020-03-02T01:00:00Z",
+                    ]
+                ),
+                None,
+            ),
+            (pd.Series(["2020-03-02", "2020-03-01", "2020-03-02"]), None),
+        ]
+        expected = pd.Series(pd.to_datetime(["2020-03-02", "2020-03-01", "2020-03-02"]))
+
+        for values, date_format in cases:
+            parsed = dates.parse_dates(values, date_format)
+            self.assertEqual(parsed.dtype, np.dtype("datetime64[ns]"))
+            self.assertEqual(parsed.tolist(), expected.tolist())
+
+    def test_missing_dates(self):
+        parsed = dates.parse_dates(pd.Series(["2020-03-01", None]))
+        self.assertTrue(pd.isna(parsed[1]))
+
+        formatted = dates.format_dates(parsed)
+        self.assertEqual(formatted[0], "2020-03-01")
+        self.assertTrue(pd.isna(formatted[1]))
+
+    def test_format_keeps_index(self):
+        values = pd.Series(pd.to_datetime(["2020-03-01", "2020-03-02"]), index=[5, 3])
+        formatted = dates.format_dates(values)
+
+        self.assertEqual(formatted.to_dict(), {5: "2020-03-01", 3: "2020-03-02"})
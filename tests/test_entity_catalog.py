@@ -0,0 +1,192 @@
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from utils import data_fetcher
+from utils import processing_utils
+from utils.entity_catalog import build_entity_catalog
+
+
+class EntityCatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.frames = [
+            pd.DataFrame({processing_utils.COUNTRY_COL: ["US", "Canada", "US"]}),
+            pd.DataFrame(
+                {
+                    processing_utils.COUNTRY_COL: ["Canada", "Australia"],
+                    processing_utils.STATE_COL: [
+                        "Ontario (Canada)",
+                        "Victoria (Australia)",
+                    ],
+                }
+            ),
+            pd.DataFrame(
+                {
+                    processing_utils.STATE_COL: ["Maryland", "Ohio", "Ohio"],
+                    processing_utils.COUNTY_COL: [
+                        "Kent (Maryland)",
+                        "Adams (Ohio)",
+                        "Kent (Ohio)",
+                    ],
+                }
+            ),
+            pd.DataFrame(
+                {processing_utils.COUNTY_COL: ["Allegany (Maryland)", "Guam"]}
+            ),
+        ]
+        self.catalog = build_entity_catalog(self.frames)
+
+    def test_entities_in_display_order(self):
+        # Frames only add the entities of their finest entity column
+        self.assertEqual(
+            self.catalog.entities,
+            {
+                processing_utils.COUNTRY_COL: ["Canada", "US"],
+                processing_utils.STATE_COL: [
+                    "Victoria (Australia)",
+                    "Ontario (Canada)",
+                ],
+                processing_utils.COUNTY_COL: [
+                    "Guam",
+                    "Allegany (Maryland)",
+                    "Kent (Maryland)",
+                    "Adams (Ohio)",
+                    "Kent (Ohio)",
+                ],
+            },
+        )
+
+    def test_search(self):
+        county_col = processing_utils.COUNTY_COL
+
+        self.assertEqual(
+            self.catalog.search(county_col, "KENT"),
+            ["Kent (Maryland)", "Kent (Ohio)"],
+        )
+        self.assertEqual(
+            self.catalog.search(county_col, "an"),
+            ["Allegany (Maryland)", "Kent (Maryland)"],
+        )
+        self.assertEqual(
+            self.catalog.search(county_col, "any (mary"), ["Allegany (Maryland)"]
+        )
+        self.assertEqual(self.catalog.search(county_col, "nt (x"), [])
+        self.assertEqual(
+            self.catalog.search(county_col, "a", limit=2),
+            ["Guam", "Allegany (Maryland)"],
+        )
+
+    def test_prefix_search(self):
+        county_col = processing_utils.COUNTY_COL
+
+        self.assertEqual(
+            self.catalog.search(county_col, "a", prefix=True),
+            ["Allegany (Maryland)", "Adams (Ohio)"],
+        )
+        self.assertEqual(self.catalog.search(county_col, "an", prefix=True), [])
+        self.assertEqual(len(self.catalog.search(county_col, "", prefix=True)), 5)
+
+    def make_hierarchy_catalog(self):
+        return build_entity_catalog(
+            self.frames
+            + [
+                pd.DataFrame(
+                    {
+                        processing_utils.STATE_COL: [
+                            "Maryland (US)",
+                            "Ohio (US)",
+                            "Guam (US)",
+                            "Punjab (India)",
+                            "Punjab (Pakistan)",
+                        ]
+                    }
+                ),
+                pd.DataFrame(
+                    {
+                        processing_utils.STATE_COL: ["Punjab (India)", None],
+                        processing_utils.COUNTY_COL: [
+                            "Amritsar (Punjab)",
+                            "Lahore (Punjab)",
+                        ],
+                    }
+                ),
+            ]
+        )
+
+    def test_hierarchy(self):
+        catalog = self.make_hierarchy_catalog()
+
+        self.assertEqual(
+            catalog.get_children(processing_utils.COUNTRY_COL, "US"),
+            ["Guam (US)", "Maryland (US)", "Ohio (US)"],
+        )
+        self.assertEqual(
+            catalog.get_parent(processing_utils.STATE_COL, "Ontario (Canada)"),
+            "Canada",
+        )
+        # Linked by the frame holding both columns
+        self.assertEqual(
+            catalog.get_parent(processing_utils.COUNTY_COL, "Amritsar (Punjab)"),
+            "Punjab (India)",
+        )
+        # Linked through the labels
+        self.assertEqual(
+            catalog.get_children(processing_utils.STATE_COL, "Ohio (US)"),
+            ["Adams (Ohio)", "Kent (Ohio)"],
+        )
+        self.assertEqual(
+            catalog.get_parent(processing_utils.COUNTY_COL, "Guam"), "Guam (US)"
+        )
+        # Two states are named Punjab
+        self.assertIsNone(
+            catalog.get_parent(processing_utils.COUNTY_COL, "Lahore (Punjab)")
+        )
+
+    def test_dependent_dropdown_options(self):
+        catalog = self.make_hierarchy_catalog()
+        data = mock.Mock(entity_catalog=catalog)
+
+        entities = data_fetcher.get_dropdown_options(data)[processing_utils.ENTITY_COL]
+        self.assertEqual(entities, catalog.entities)
+
+        entities = data_fetcher.get_dropdown_options(data, countries=["US"])[
+            processing_utils.ENTITY_COL
+        ]
+        self.assertEqual(
+            entities[processing_utils.STATE_COL],
+            ["Guam (US)", "Maryland (US)", "Ohio (US)"],
+        )
+        self.assertEqual(
+            entities[processing_utils.COUNTY_COL],
+            [
+                "Guam",
+                "Allegany (Maryland)",
+                "Kent (Maryland)",
+                "Adams (Ohio)",
+                "Kent (Ohio)",
+            ],
+        )
+
+        entities = data_fetcher.get_dropdown_options(
+            data, countries=["US"], states=["Ohio (US)"]
+        )[processing_utils.ENTITY_COL]
+        self.assertEqual(
+            entities[processing_utils.COUNTY_COL], ["Adams (Ohio)", "Kent (Ohio)"]
+        )
+
+    def test_county_picker_options(self):
+        data = mock.Mock(entity_catalog=self.make_hierarchy_catalog())
+
+        self.assertEqual(
+            data_fetcher.get_county_states(data),
+            ["Punjab (India)", "Guam (US)", "Maryland (US)", "Ohio (US)"],
+        )
+        # Picked counties stay available when another state is browsed
+        self.assertEqual(
+            data_fetcher.get_county_options(
+                data, ["Ohio (US)", "(none)"], ["Kent (Maryland)", "Adams (Ohio)"]
+            ),
+            ["Kent (Maryland)", "Adams (Ohio)", "Kent (Ohio)"],
+        )
+        self.assertEqual(data_fetcher.get_county_options(data, [], []), [])
@@ -0,0 +1,150 @@
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+
+from utils import http_mirror
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves `server.body` with an ETag and a Last-Modified date, and answers
+    conditional requests with a 304 when the body has not changed.
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+
+        if server.fail_with is not None:
+            self.send_response(server.fail_with)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        etag = '"{}"'.format(server.version)
+        if (
+            self.headers.get("If-None-Match") == etag
+            or self.headers.get("If-Modified-Since") == server.last_modified
+        ):
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = server.body
+        self.send_response(200)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        if server.send_etag:
+            self.send_header("ETag", etag)
+        self.send_header("Last-Modified", server.last_modified)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpMirrorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.server.requests = []
+        self.server.body = b"date,positive\n20200301,10\n"
+        self.server.version = 1
+        self.server.last_modified = "Sun, 01 Mar 2020 00:00:00 GMT"
+        self.server.send_etag = True
+        self.server.fail_with = None
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.url = "http://127.0.0.1:{}/daily.csv".format(self.server.server_port)
+        self.mirror_dir = tempfile.mkdtemp()
+        self.mirror = http_mirror.HttpMirror(mirror_dir=self.mirror_dir)
+
+    def tearDown(self):
+        self.stop_server()
+        shutil.rmtree(self.mirror_dir)
+
+    def stop_server(self):
+        if self.thread.is_alive():
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+
+    def test_unchanged_source_is_read_from_mirror(self):
+        first = self.mirror.fetch(self.url)
+        second = self.mirror.fetch(self.url)
+
+        self.assertEqual(first, self.server.body)
+        self.assertEqual(second, self.server.body)
+        self.assertEqual(self.server.requests[1]["If-None-Match"], '"1"')
+        self.assertEqual(
+            self.mirror.read_metadata(self.url)["status"], http_mirror.NOT_MODIFIED
+        )
+
+    def test_changed_source_is_downloaded(self):
+        self.mirror.fetch(self.url)
+        old_version = self.mirror.get_version(self.url)
+
+        self.server.body = b"date,positive\n20200301,10\n20200302,12\n"
+        self.server.version = 2
+        self.server.last_modified = "Mon, 02 Mar 2020 00:00:00 GMT"
+
+        self.assertEqual(self.mirror.fetch(self.url), self.server.body)
+        self.assertNotEqual(self.mirror.get_version(self.url), old_version)
+        self.assertEqual(
+            self.mirror.read_metadata(self.url)["status"], http_mirror.DOWNLOADED
+        )
+
+    def test_revalidates_with_last_modified(self):
+        self.server.send_etag = False
+
+        self.mirror.fetch(self.url)
+        self.assertEqual(self.mirror.fetch(self.url), self.server.body)
+        self.assertEqual(
+            self.server.requests[1]["If-Modified-Since"], self.server.last_modified
+        )
+        self.assertNotIn("If-None-Match", self.server.requests[1])
+
+    def test_requests_gzip(self):
+        self.mirror.fetch(self.url)
+        self.assertIn("gzip", self.server.requests[0]["Accept-Encoding"])
+
+    def test_unreachable_source_uses_mirror(self):
+        self.mirror.fetch(self.url)
+        self.stop_server()
+
+        self.assertEqual(self.mirror.fetch(self.url), self.server.body)
+        self.assertEqual(
+            self.mirror.read_metadata(self.url)["status"], http_mirror.STALE
+        )
+
+    def test_server_error_uses_mirror(self):
+        self.mirror.fetch(self.url)
+        self.server.fail_with = 500
+
+        self.assertEqual(self.mirror.fetch(self.url), self.server.body)
+        self.assertEqual(
+            self.mirror.read_metadata(self.url)["status"], http_mirror.STALE
+        )
+
+    def test_server_error_without_mirror_raises(self):
+        self.server.fail_with = 500
+
+        with self.assertRaises(requests.HTTPError):
+            self.mirror.fetch(self.url)
+
+    def test_not_modified_without_mirror_raises(self):
+        self.server.fail_with = 304
+
+        with self.assertRaises(requests.HTTPError):
+            self.mirror.fetch(self.url)
+        self.assertIsNone(self.mirror.read_metadata(self.url))
@@ -0,0 +1,177 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from utils import ingestion
+from utils import processing_utils
+from utils import site_data_abstraction
+
+started = []
+release = threading.Event()
+
+
+def fetch_numbers():
+    started.append("fetch_numbers")
+    return pd.DataFrame({"x": [1, 2, 3]})
+
+
+def fetch_letters():
+    started.append("fetch_letters")
+    return pd.DataFrame({"y": ["a", "b", "c"]})
+
+
+def fetch_slowly():
+    started.append("fetch_slowly")
+    release.wait(5)
+    return 1
+
+
+def fetch_broken():
+    raise ValueError("source is down")
+
+
+def double(df):
+    return df * 2
+
+
+def combine(numbers, letters):
+    return pd.concat([numbers, letters], axis=1)
+
+
+def record_after_broken(value):
+    started.append("record_after_broken")
+    return value
+
+
+def fetch_country_frame():
+    return pd.DataFrame(
+        {
+            processing_utils.DATE_COL: ["2020-03-01"],
+            processing_utils.COUNTRY_COL: ["World"],
+            processing_utils.CONFIRMED_COL: [1],
+        }
+    )
+
+
+def fetch_international():
+    return None, fetch_country_frame()
+
+
+def split_international(fetched):
+    _, raw = fetched
+    return raw, raw, raw
+
+
+DATA_STAGES = [
+    ("raw_global_df", fetch_international, (), ingestion.IO_STAGE),
+    ("international_dfs", split_international, ("raw_global_df",), ingestion.CPU_STAGE),
+    ("us_testing_df", fetch_country_frame, (), ingestion.IO_STAGE),
+    ("us_states_testing_df", fetch_country_frame, (), ingestion.IO_STAGE),
+    ("us_county_df", fetch_country_frame, (), ingestion.IO_STAGE),
+]
+
+STAGES = [
+    ("numbers", fetch_numbers, (), ingestion.IO_STAGE),
+    ("letters", fetch_letters, (), ingestion.IO_STAGE),
+    ("doubled", double, ("numbers",), ingestion.CPU_STAGE),
+    ("combined", combine, ("doubled", "letters"), ingestion.CPU_STAGE),
+]
+
+
+class IngestionTestCase(unittest.TestCase):
+    def setUp(self):
+        del started[:]
+        release.clear()
+
+    def test_parallel_matches_sequential(self):
+        sequential, _ = ingestion.run_stages_sequentially(STAGES)
+        parallel, _ = ingestion.run_stages_in_parallel(STAGES, max_workers=2)
+
+        self.assertEqual(set(sequential), set(parallel))
+        for name in sequential:
+            pd.testing.assert_frame_equal(sequential[name], parallel[name])
+
+        pd.testing.assert_frame_equal(
+            parallel["combined"], pd.DataFrame({"x": [2, 4, 6], "y": ["a", "b", "c"]})
+        )
+
+    def test_timings_cover_every_stage(self):
+        for runner in (
+            ingestion.run_stages_sequentially,
+            ingestion.run_stages_in_parallel,
+        ):
+            _, timings = runner(STAGES)
+            self.assertEqual(set(timings), {stage[0] for stage in STAGES})
+
+    def test_failing_stage_stops_downstream_stages(self):
+        stages = [
+            ("slow", fetch_slowly, (), ingestion.IO_STAGE),
+            ("broken", fetch_broken, (), ingestion.IO_STAGE),
+            ("after_broken", record_after_broken, ("broken",), ingestion.IO_STAGE),
+        ]
+
+        for runner in (
+            ingestion.run_stages_sequentially,
+            ingestion.run_stages_in_parallel,
+        ):
+            del started[:]
+            # Only the parallel runner has the slow stage still in flight
+            if runner is ingestion.run_stages_sequentially:
+                release.set()
+            else:
+                release.clear()
+            start = time.time()
+
+            with self.assertRaises(ingestion.IngestionError) as context:
+                runner(stages)
+
+            elapsed = time.time() - start
+            release.set()
+            self.assertEqual(context.exception.stage, "broken")
+            self.assertIsInstance(context.exception.error, ValueError)
+            self.assertNotIn("record_after_broken", started)
+
+        # The parallel runner must not wait for the slow stage to finish
+        self.assertLess(elapsed, 2)
+
+    def test_failure_without_cancel_futures(self):
+        # Python 3.8 executors, whose shutdown() has no cancel_futures
+        def shutdown(self, wait=True):
+            original(self, wait=wait)
+
+        stages = [
+            ("slow", fetch_slowly, (), ingestion.IO_STAGE),
+            ("broken", fetch_broken, (), ingestion.IO_STAGE),
+        ]
+
+        for executor in (ingestion.ThreadPoolExecutor, ingestion.ProcessPoolExecutor):
+            release.clear()
+            original = executor.shutdown
+            with mock.patch.object(executor, "shutdown", shutdown):
+                with self.assertRaises(ingestion.IngestionError) as context:
+                    ingestion.run_stages_in_parallel(stages)
+
+            release.set()
+            self.assertEqual(context.exception.stage, "broken")
+
+    def test_unmet_dependency(self):
+        stages = [("orphan", double, ("missing",), ingestion.CPU_STAGE)]
+
+        with self.assertRaises(ValueError):
+            ingestion.run_stages_in_parallel(stages)
+
+    def test_data_records_stage_timings(self):
+        with mock.patch.object(
+            site_data_abstraction,
+            "get_ingestion_stages",
+            return_value=DATA_STAGES,
+        ):
+            data = site_data_abstraction.Data()
+
+        self.assertEqual(
+            list(data.stage_timings), [stage[0] for stage in DATA_STAGES] + ["total"]
+        )
+        self.assertEqual(len(data.CovidDf.dataframes), 6)
@@ -0,0 +1,145 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from utils import api_utils
+from utils import dates
+from utils import io_utils
+from utils import site_data_abstraction
+
+dummy_csv = """Country/Region,Province/State,Latitude,Longitude,Confirmed,Recovered,Deaths,Date
+China,Hubei,30.9,112.2,444,28,17,2020-01-22
+US,,37.0,-95.7,1,,0,2020-01-22
+"""
+
+
+class IoUtilsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patch = mock.patch.object(io_utils, "CACHE_DIR", self.tmp_dir)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def make_frame(self):
+        return pd.DataFrame(
+            {
+                "Date": ["2020-03-01", "2020-03-02", "2020-03-02"],
+                "Country/Region": ["Italy", None, "Italy"],
+                "Confirmed": [1, 2, 3],
+                "Deaths": [0.5, np.nan, 2.0],
+                "Day": dates.parse_dates(["2020-03-01", "2020-03-02", "2020-03-02"]),
+                "Level": pd.Categorical(["a", "b", "a"]),
+            }
+        )
+
+    def test_frame_round_trip(self):
+        df = self.make_frame()
+        io_utils.save_frame("frame", df, source_version="v1", schema_version=1)
+
+        loaded = io_utils.load_frame("frame", source_version="v1", schema_version=1)
+        pd.testing.assert_frame_equal(loaded, df)
+
+        manifest = io_utils.read_manifest("frame")
+        self.assertEqual(manifest["source_version"], "v1")
+        self.assertEqual(manifest["rows"], 3)
+        self.assertIn("built_at", manifest)
+
+    def test_stale_frames_are_not_loaded(self):
+        io_utils.save_frame("frame", self.make_frame(), "v1", schema_version=1)
+
+        self.assertIsNone(io_utils.load_frame("frame", "v2", schema_version=1))
+        self.assertIsNone(io_utils.load_frame("frame", "v1", schema_version=2))
+        self.assertIsNone(io_utils.load_frame("missing", "v1"))
+
+        io_utils.save_frame("frame", self.make_frame().head(1), "v2", schema_version=1)
+        self.assertEqual(len(io_utils.load_frame("frame", "v2", schema_version=1)), 1)
+
+    def test_frames_with_another_schema_are_not_loaded(self):
+        io_utils.save_frame("frame", self.make_frame(), "v1", schema_version=1)
+        schema = {
+            "Date": "object",
+            "Country/Region": "object",
+            "Confirmed": "int64",
+            "Deaths": "float64",
+            "Day": dates.DATE_DTYPE,
+            "Level": "category",
+        }
+
+        self.assertIsNotNone(io_utils.load_frame("frame", "v1", 1, schemas=[schema]))
+        # A column the frame no longer has, or a new one it lacks
+        self.assertIsNone(
+            io_utils.load_frame("frame", "v1", 1, schemas=[dict(schema, Hash="object")])
+        )
+        del schema["Level"]
+        self.assertIsNone(io_utils.load_frame("frame", "v1", 1, schemas=[schema]))
+        # A column whose dtype changed
+        schema["Level"] = "category"
+        self.assertIsNone(
+            io_utils.load_frame(
+                "frame", "v1", 1, schemas=[dict(schema, Confirmed="float64")]
+            )
+        )
+        self.assertIsNotNone(
+            io_utils.load_frame(
+                "frame",
+                "v1",
+                1,
+                schemas=[
+                    dict(schema, Confirmed="float64"),
+                    dict(schema, Confirmed=("int64", "float64"), Hash=("object", None)),
+                ],
+            )
+        )
+
+    @mock.patch.object(api_utils, "update_international_dataset")
+    @mock.patch.object(api_utils, "get_source_version", return_value="v1")
+    def test_warm_cache_skips_the_international_csv(self, *_):
+        raw = pd.read_csv(
+            io.StringIO(dummy_csv),
+            usecols=list(api_utils.INTERNATIONAL_CSV_DTYPES),
+            dtype=api_utils.INTERNATIONAL_CSV_DTYPES,
+        )
+
+        with mock.patch.object(
+            api_utils, "read_international_dataset", return_value=raw
+        ) as read:
+            built = site_data_abstraction.build_international(
+                site_data_abstraction.fetch_international()
+            )
+            fetched = site_data_abstraction.fetch_international()
+
+        self.assertEqual(read.call_count, 1)
+        self.assertIsNone(fetched[1])
+        for cached, frame in zip(fetched[0], built):
+            pd.testing.assert_frame_equal(cached, frame.reset_index(drop=True))
+
+    def test_read_csv_from_zip(self):
+        zip_path = os.path.join(self.tmp_dir, "dataset.zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("covid-19-all.csv", dummy_csv)
+
+        df = io_utils.read_csv_from_zip(
+            zip_path,
+            "covid-19-all.csv",
+            usecols=["Country/Region", "Confirmed", "Recovered", "Date"],
+            dtype={"Country/Region": object, "Confirmed": "float64"},
+        )
+
+        self.assertEqual(
+            list(df.columns), ["Country/Region", "Confirmed", "Recovered", "Date"]
+        )
+        self.assertEqual(df["Confirmed"].dtype, "float64")
+        self.assertEqual(df["Country/Region"].tolist(), ["China", "US"])
+        self.assertTrue(pd.isna(df["Recovered"].iloc[1]))
+        # Nothing was extracted next to the archive
+        self.assertEqual(os.listdir(self.tmp_dir), ["dataset.zip"])
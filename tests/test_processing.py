@@ -1,6 +1,9 @@
 import unittest
+from unittest import mock
 
 import pandas as pd
+from utils import covid_dataset
+from utils import data_fetcher
 from utils.covid_dataset import CovidData
 from utils import processing_utils
 
@@ -72,3 +75,639 @@ class ProcessingUtilsTestCase(unittest.TestCase):
             print(self.dfs[i])
             print("New: ----------")
             print(df.head())
+
+
+class BuildLabelsTestCase(unittest.TestCase):
+    def test_matches_row_wise_labels(self):
+        df = pd.DataFrame(
+            {
+                processing_utils.COUNTY_COL: ["Kings", "", "Albany", "Kings", ""],
+                processing_utils.STATE_COL: [
+                    "New York",
+                    "Guam",
+                    "New York",
+                    "New York",
+                    "Guam",
+                ],
+            },
+            index=[4, 3, 2, 1, 0],
+        )
+
+        def make_label(county, state):
+            return state if county == "" else county + " (" + state + ")"
+
+        expected = df.apply(
+            lambda row: make_label(
+                row[processing_utils.COUNTY_COL], row[processing_utils.STATE_COL]
+            ),
+            axis=1,
+        )
+        labels = processing_utils.build_labels(
+            make_label,
+            df[processing_utils.COUNTY_COL],
+            df[processing_utils.STATE_COL],
+        )
+
+        pd.testing.assert_series_equal(labels, expected.astype(object))
+
+    def test_calls_once_per_distinct_value(self):
+        calls = []
+        states = pd.Series(["MD", "AK", "MD", None, "MD"])
+
+        labels = processing_utils.build_labels(
+            lambda abbrev: calls.append(abbrev) or abbrev + " (United States)",
+            states,
+        )
+
+        self.assertEqual(sorted(calls), ["AK", "MD"])
+        self.assertEqual(labels[0], "MD (United States)")
+        self.assertTrue(pd.isna(labels[3]))
+
+
+class DerivedMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        # Two counties, interleaved and out of date order
+        self.df = pd.DataFrame(
+            {
+                processing_utils.DATE_COL: pd.to_datetime(
+                    [
+                        "2020-03-03",
+                        "2020-03-01",
+                        "2020-03-02",
+                        "2020-03-01",
+                        "2020-03-04",
+                        "2020-03-02",
+                        "2020-03-03",
+                    ]
+                ),
+                processing_utils.COUNTY_COL: ["A", "A", "A", "B", "A", "B", "B"],
+                processing_utils.CONFIRMED_COL: [15, 0, 10, 4, None, 4, 5],
+            }
+        )
+
+    def get_metrics(self):
+        return processing_utils.add_derived_metrics(
+            self.df,
+            sort_cols=[processing_utils.DATE_COL, processing_utils.COUNTY_COL],
+            diff_group_cols=[processing_utils.COUNTY_COL],
+            delta_cols=[processing_utils.CONFIRMED_COL],
+            percent_cols=[processing_utils.CONFIRMED_COL],
+        )
+
+    def test_sorts_by_sort_cols(self):
+        df = self.get_metrics()
+
+        self.assertEqual(list(df.index), [1, 3, 2, 5, 0, 6, 4])
+
+    def test_daily_increase_within_groups(self):
+        df = self.get_metrics()
+        delta = df[processing_utils.CONFIRMED_COL + processing_utils.DELTA_COL_SUFFIX]
+
+        # First rows of a group and rows after a missing value keep the value
+        self.assertEqual(delta.loc[[1, 2, 0]].tolist(), [0, 10, 5])
+        self.assertEqual(delta.loc[[3, 5, 6]].tolist(), [4, 0, 1])
+        self.assertTrue(pd.isna(delta.loc[4]))
+
+    def test_percent_change_within_groups(self):
+        df = self.get_metrics()
+        percent = df[
+            processing_utils.CONFIRMED_COL + processing_utils.DELTA_PERCENT_COL_SUFFIX
+        ]
+
+        # Growth from zero and missing values count as no change
+        self.assertEqual(percent.loc[[1, 2, 0, 4]].tolist(), [0, 0, 50, 0])
+        self.assertEqual(percent.loc[[3, 5, 6]].tolist(), [0, 0, 25])
+
+
+class CompactDataTestCase(unittest.TestCase):
+    def setUp(self):
+        dates = pd.to_datetime(["2020-03-01", "2020-03-02", "2020-03-03"] * 2)
+        countries = pd.DataFrame(
+            {
+                processing_utils.DATE_COL: dates,
+                processing_utils.COUNTRY_COL: ["US"] * 3 + ["Canada"] * 3,
+                processing_utils.CONFIRMED_COL: [1.0, 5.0, 9.0, 2.0, None, 30.0],
+                # Needs float64 to be exact
+                processing_utils.DEATHS_COL: [0.1, 0.2, 0.3, 0.0, 0.0, 1.0],
+            }
+        )
+        counties = pd.DataFrame(
+            {
+                processing_utils.DATE_COL: dates,
+                processing_utils.STATE_COL: ["Maryland"] * 6,
+                processing_utils.COUNTY_COL: ["Kent (Maryland)"] * 3
+                + ["Cecil (Maryland)"] * 3,
+                processing_utils.CONFIRMED_COL: [3, 4, 12, 0, 1, 2],
+            }
+        )
+        self.dfs = [
+            processing_utils.add_derived_metrics(
+                df,
+                sort_cols=[processing_utils.DATE_COL],
+                diff_group_cols=[entity_col],
+                delta_cols=[processing_utils.CONFIRMED_COL],
+                percent_cols=[processing_utils.CONFIRMED_COL],
+            )
+            for df, entity_col in [
+                (countries, processing_utils.COUNTRY_COL),
+                (counties, processing_utils.COUNTY_COL),
+            ]
+        ]
+
+    def test_downcasts_losslessly(self):
+        compact = processing_utils.compact_frame(self.dfs[0])
+
+        self.assertEqual(str(compact[processing_utils.COUNTRY_COL].dtype), "category")
+        self.assertEqual(compact[processing_utils.CONFIRMED_COL].dtype, "float32")
+        self.assertEqual(compact[processing_utils.DEATHS_COL].dtype, "float64")
+        self.assertEqual(
+            compact[
+                processing_utils.CONFIRMED_COL + processing_utils.DELTA_COL_SUFFIX
+            ].dtype,
+            "float32",
+        )
+        self.assertEqual(
+            processing_utils.compact_frame(self.dfs[1])[
+                processing_utils.CONFIRMED_COL
+            ].dtype,
+            "int32",
+        )
+
+    def test_query_results_are_unchanged(self):
+        requests = [
+            ([processing_utils.COUNTRY_COL], {processing_utils.COUNTRY_COL: ["ALL"]}),
+            (
+                [processing_utils.STATE_COL, processing_utils.COUNTY_COL],
+                {
+                    processing_utils.STATE_COL: ["Maryland"],
+                    processing_utils.COUNTY_COL: ["Kent (Maryland)"],
+                },
+            ),
+        ]
+        metrics = [
+            processing_utils.CONFIRMED_COL,
+            processing_utils.CONFIRMED_COL + processing_utils.DELTA_COL_SUFFIX,
+            processing_utils.DEATHS_COL,
+        ]
+
+        full = CovidData(self.dfs)
+        compact = CovidData(self.dfs, compact=True)
+
+        for entities, filter_dict in requests:
+            for threshold in [None, 4]:
+                kwargs = dict(
+                    entities=entities,
+                    measurements=metrics,
+                    filter_dict=filter_dict,
+                    threshold_value=threshold,
+                    threshold_metric=processing_utils.CONFIRMED_COL,
+                )
+                expected = full.get_displayable_data(**kwargs)
+                result = compact.get_displayable_data(**kwargs)
+
+                self.assertEqual(set(result), set(expected))
+                for metric in expected:
+                    pd.testing.assert_frame_equal(result[metric], expected[metric])
+
+
+class EntityIndexTestCase(unittest.TestCase):
+    def test_positions_follow_entity_and_date(self):
+        df = pd.DataFrame(
+            {
+                processing_utils.DATE_COL: pd.to_datetime(
+                    ["2020-03-02", "2020-03-01", "2020-03-01", "2020-03-03"]
+                ),
+                processing_utils.STATE_COL: ["Alaska", "Alaska", None, "Ohio"],
+            }
+        )
+
+        index = covid_dataset.build_entity_index(df, processing_utils.STATE_COL)
+
+        self.assertEqual(sorted(index.bounds), ["Alaska", "Ohio"])
+        self.assertEqual(
+            covid_dataset.get_entity_positions(index, ["Alaska"]).tolist(), [1, 0]
+        )
+        self.assertEqual(
+            covid_dataset.get_entity_positions(
+                index, ["Ohio", "Alaska", "Ohio", "Utah"]
+            ).tolist(),
+            [3, 1, 0],
+        )
+
+    def test_frames_are_sorted_by_finest_entity(self):
+        data = CovidData([pd.DataFrame.from_dict(dummy_confirmed_states_data)])
+        df = data.dataframes[0]
+
+        self.assertEqual(
+            df[processing_utils.STATE_COL].tolist(),
+            ["Alaska", "Alaska", "Maryland", "Maryland", "New York"],
+        )
+        self.assertEqual(
+            covid_dataset.get_entity_positions(
+                data.entity_index[0][processing_utils.STATE_COL], ["Maryland"]
+            ).tolist(),
+            [2, 3],
+        )
+
+    def test_crossing_dates(self):
+        df = pd.DataFrame(
+            {
+                processing_utils.DATE_COL: pd.to_datetime(
+                    ["2020-03-01", "2020-03-02", "2020-03-03", "2020-03-04"] * 2
+                ),
+                processing_utils.COUNTRY_COL: ["Chad"] * 4 + ["Peru"] * 4,
+                # Not monotone, and with a gap
+                processing_utils.CONFIRMED_COL: [1, 8, 3, 20, None, 2, 5, 4],
+            }
+        )
+        data = CovidData([df])
+
+        def get_crossing_date(country, threshold):
+            return data.get_crossing_date(
+                0,
+                processing_utils.COUNTRY_COL,
+                country,
+                processing_utils.CONFIRMED_COL,
+                threshold,
+            )
+
+        self.assertEqual(get_crossing_date("Chad", 5), pd.Timestamp("2020-03-02"))
+        self.assertEqual(get_crossing_date("Chad", 9), pd.Timestamp("2020-03-04"))
+        self.assertEqual(get_crossing_date("Peru", 1), pd.Timestamp("2020-03-02"))
+        self.assertEqual(get_crossing_date("Peru", 5), pd.Timestamp("2020-03-03"))
+        self.assertIsNone(get_crossing_date("Peru", 6))
+        self.assertIsNone(get_crossing_date("Fiji", 1))
+
+
+class DaysSinceThresholdTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = CovidData([pd.DataFrame.from_dict(dummy_confirmed_data)])
+        self.request = dict(
+            entities=[processing_utils.COUNTRY_COL],
+            measurements=[processing_utils.CONFIRMED_COL],
+            filter_dict={processing_utils.COUNTRY_COL: ["US", "China"]},
+            threshold_value=10,
+            threshold_metric=processing_utils.CONFIRMED_COL,
+        )
+
+    def test_shifts_dates_to_earliest_crossing(self):
+        df = self.data.get_displayable_data(**self.request)[
+            processing_utils.CONFIRMED_COL
+        ]
+
+        # US reaches 10 on 03-01, China on 03-04
+        self.assertEqual(
+            df[processing_utils.DATE_COL].dt.strftime("%Y-%m-%d").tolist(),
+            ["2020-03-01", "2020-03-01", "2020-03-02"],
+        )
+        self.assertEqual(
+            df[processing_utils.ENTITY_COL].tolist(), ["China", "US", "US"]
+        )
+
+    def test_days_since_threshold(self):
+        df = self.data.get_displayable_data(days_since_threshold=True, **self.request)[
+            processing_utils.CONFIRMED_COL
+        ]
+
+        self.assertNotIn(processing_utils.DATE_COL, df.columns)
+        self.assertEqual(
+            df[processing_utils.DAYS_SINCE_THRESHOLD_COL].tolist(), [0, 0, 1]
+        )
+        self.assertEqual(df[processing_utils.MEASUREMENT_COL].tolist(), [16, 10, 12])
+
+    def test_request_round_trip(self):
+        request = data_fetcher.generate_data_fetch_request(
+            [processing_utils.CONFIRMED_COL],
+            ["US", "China"],
+            [],
+            [],
+            True,
+            processing_utils.CONFIRMED_COL,
+            10,
+            days_since_threshold=True,
+        )
+        self.assertTrue(data_fetcher.is_valid_data_fetch_request(request))
+
+        source_df, _ = data_fetcher.process_request_dict(
+            mock.Mock(CovidDf=self.data), request
+        )
+
+        self.assertEqual(
+            source_df[processing_utils.DAYS_SINCE_THRESHOLD_COL].tolist(), [0, 0, 1]
+        )
+
+
+class RoutingCatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = CovidData(
+            [
+                pd.DataFrame.from_dict(dummy_confirmed_data),
+                pd.DataFrame.from_dict(dummy_deaths_data),
+                pd.DataFrame.from_dict(dummy_confirmed_states_data),
+            ],
+            names=["confirmed", "deaths", "states"],
+        )
+
+    def test_catalog_routes(self):
+        self.assertEqual(
+            self.data.catalog[
+                (processing_utils.COUNTRY_COL, processing_utils.CONFIRMED_COL)
+            ],
+            [0],
+        )
+        self.assertEqual(
+            covid_dataset.get_routed_frames(
+                self.data.catalog,
+                [processing_utils.COUNTRY_COL, processing_utils.STATE_COL],
+                [processing_utils.CONFIRMED_COL],
+            ),
+            [0, 2],
+        )
+        self.assertNotIn(
+            (processing_utils.STATE_COL, processing_utils.DEATHS_COL),
+            self.data.catalog,
+        )
+
+    def test_unrouted_frames_are_not_scanned(self):
+        # The deaths frame cannot answer the request, so it is never read
+        self.data.dataframes[1] = None
+
+        results = self.data.get_displayable_data(
+            entities=[processing_utils.COUNTRY_COL],
+            measurements=[processing_utils.CONFIRMED_COL],
+            filter_dict={processing_utils.COUNTRY_COL: ["US"]},
+        )
+
+        self.assertEqual(
+            results[processing_utils.CONFIRMED_COL][
+                processing_utils.MEASUREMENT_COL
+            ].tolist(),
+            [10, 12],
+        )
+
+    def test_explain(self):
+        plan = self.data.explain(
+            data_fetcher.generate_data_fetch_request(
+                [processing_utils.CONFIRMED_COL],
+                ["US", "China"],
+                ["ALL"],
+                [],
+                True,
+                processing_utils.CONFIRMED_COL,
+                10,
+            )
+        )
+
+        self.assertEqual(plan["Frame"].tolist(), ["confirmed", "states"])
+        self.assertEqual(plan["Estimated rows"].tolist(), [4, 5])
+        self.assertEqual(
+            plan["Index"].tolist(),
+            [
+                "entity index on Country/Region, running max of Confirmed",
+                "full scan, running max of Confirmed",
+            ],
+        )
+
+
+class BatchQueryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = CovidData(
+            [
+                pd.DataFrame.from_dict(dummy_confirmed_data),
+                pd.DataFrame.from_dict(dummy_deaths_data),
+                pd.DataFrame.from_dict(dummy_confirmed_states_data),
+            ]
+        )
+        self.requests = [
+            data_fetcher.generate_data_fetch_request(
+                metrics,
+                countries,
+                states,
+                [],
+                overlay,
+                processing_utils.CONFIRMED_COL,
+                9,
+            )
+            for metrics, countries, states, overlay in [
+                ([processing_utils.CONFIRMED_COL], ["US"], [], False),
+                (
+                    [processing_utils.DEATHS_COL, processing_utils.CONFIRMED_COL],
+                    ["China", "US"],
+                    ["Alaska"],
+                    True,
+                ),
+                ([processing_utils.CONFIRMED_COL], ["ALL"], ["New York"], False),
+                ([processing_utils.CONFIRMED_COL], ["US"], [], False),
+            ]
+        ]
+
+    def test_batch_matches_single_requests(self):
+        queries = [data_fetcher.get_query(request) for request in self.requests]
+
+        for workers in [None, 2]:
+            results = self.data.process_many(queries, workers=workers)
+
+            self.assertEqual(len(results), len(queries))
+            for query, result in zip(queries, results):
+                expected = self.data.get_displayable_data(**query)
+                self.assertEqual(list(result), list(expected))
+                for metric in expected:
+                    pd.testing.assert_frame_equal(result[metric], expected[metric])
+
+    def test_batch_aggregates_each_frame_once(self):
+        queries = [data_fetcher.get_query(self.requests[i]) for i in [0, 2, 3]]
+
+        with mock.patch.object(
+            processing_utils, "agg_df", wraps=processing_utils.agg_df
+        ) as agg_df:
+            self.data.process_many(queries)
+
+        # Countries and states of the three requests, one aggregation each
+        self.assertEqual(agg_df.call_count, 2)
+
+    def test_data_fetcher_batch(self):
+        results = data_fetcher.process_many(
+            mock.Mock(CovidDf=self.data, generation=None), self.requests
+        )
+
+        for request, (source_df, _) in zip(self.requests, results):
+            expected_df, _ = data_fetcher.process_request_dict(
+                mock.Mock(CovidDf=self.data, generation=None), request
+            )
+            pd.testing.assert_frame_equal(source_df, expected_df)
+
+        # Repeated requests do not share frames
+        self.assertIsNot(results[0][0], results[3][0])
+
+
+class FilterPushdownTestCase(unittest.TestCase):
+    def test_each_entity_column_uses_its_own_filter(self):
+        df = pd.DataFrame(
+            {
+                processing_utils.DATE_COL: ["2020-03-01"] * 3,
+                processing_utils.STATE_COL: ["Maryland", "Maryland", "Ohio"],
+                processing_utils.COUNTY_COL: [
+                    "Kent (Maryland)",
+                    "Cecil (Maryland)",
+                    "Adams (Ohio)",
+                ],
+                processing_utils.CONFIRMED_COL: [1, 2, 4],
+                processing_utils.DEATHS_COL: [0.5, 0.25, 1.0],
+            }
+        )
+        results = CovidData([df]).get_displayable_data(
+            entities=[processing_utils.STATE_COL, processing_utils.COUNTY_COL],
+            measurements=[processing_utils.CONFIRMED_COL, processing_utils.DEATHS_COL],
+            filter_dict={
+                processing_utils.STATE_COL: ["Maryland"],
+                processing_utils.COUNTY_COL: ["Kent (Maryland)", "Adams (Ohio)"],
+            },
+        )
+
+        # Every metric gets the whole state, whatever the county filter
+        for metric, values in [
+            (processing_utils.CONFIRMED_COL, [3, 4, 1]),
+            (processing_utils.DEATHS_COL, [0.75, 1.0, 0.5]),
+        ]:
+            self.assertEqual(
+                results[metric][processing_utils.ENTITY_COL].tolist(),
+                ["Maryland", "Adams (Ohio)", "Kent (Maryland)"],
+            )
+            self.assertEqual(
+                results[metric][processing_utils.MEASUREMENT_COL].tolist(), values
+            )
+
+
+class DataPanelTestCase(unittest.TestCase):
+    def test_entity_tables_and_statistics(self):
+        delta_col = processing_utils.CONFIRMED_COL + processing_utils.DELTA_COL_SUFFIX
+        displayable_data = {
+            processing_utils.CONFIRMED_COL: pd.DataFrame(
+                {
+                    processing_utils.ENTITY_COL: ["US", "US", "US", "China"],
+                    processing_utils.DATE_COL: [
+                        "2020-03-01",
+                        "2020-03-02",
+                        "2020-03-03",
+                        "2020-03-01",
+                    ],
+                    processing_utils.MEASUREMENT_COL: [1, 3, 6, 2],
+                }
+            ),
+            delta_col: pd.DataFrame(
+                {
+                    processing_utils.ENTITY_COL: ["US", "US", "US"],
+                    processing_utils.DATE_COL: [
+                        "2020-03-01",
+                        "2020-03-02",
+                        "2020-03-04",
+                    ],
+                    processing_utils.MEASUREMENT_COL: [1.0, 2.0, 0.0],
+                }
+            ),
+        }
+
+        tables, stats = data_fetcher.fetch_streamlit_raw_data_display(displayable_data)
+
+        self.assertEqual(list(tables), ["US", "China"])
+        self.assertEqual(
+            tables["US"].columns.tolist(),
+            [processing_utils.DATE_COL, processing_utils.CONFIRMED_COL, delta_col],
+        )
+        self.assertEqual(
+            tables["US"][processing_utils.DATE_COL].tolist(),
+            ["2020-03-04", "2020-03-03", "2020-03-02", "2020-03-01"],
+        )
+        # A day missing from one metric makes it float for that entity only
+        self.assertEqual(tables["US"][processing_utils.CONFIRMED_COL].dtype, "float64")
+        self.assertEqual(tables["China"][processing_utils.CONFIRMED_COL].dtype, "int64")
+        self.assertEqual(tables["China"].index.tolist(), [3])
+
+        self.assertEqual(list(stats), ["US"])
+        self.assertEqual(
+            stats["US"][delta_col],
+            {
+                "Historic": {"max": 2.0, "nonzero-min": 1.0, "mean": 1.0},
+                "Within the last week": {
+                    "max": 2.0,
+                    "nonzero-min": 1.0,
+                    "mean": 1.0,
+                    "number of days": 3,
+                },
+            },
+        )
+
+
+class SummaryTableTestCase(unittest.TestCase):
+    def setUp(self):
+        dates = ["2020-03-01", "2020-03-02", "2020-03-03"]
+        frames = []
+        for entity_col, entities in [
+            (processing_utils.COUNTRY_COL, ["US", "Georgia"]),
+            (processing_utils.STATE_COL, ["Maryland", "Georgia"]),
+        ]:
+            df = pd.DataFrame(
+                {
+                    processing_utils.DATE_COL: dates * 2,
+                    entity_col: [entities[0]] * 3 + [entities[1]] * 3,
+                    processing_utils.CONFIRMED_COL: [1, 4, 4, 2, 3, 7],
+                }
+            )
+            frames.append(
+                processing_utils.add_derived_metrics(
+                    df,
+                    sort_cols=[processing_utils.DATE_COL],
+                    diff_group_cols=[entity_col],
+                    delta_cols=[processing_utils.CONFIRMED_COL],
+                )
+            )
+        self.data = CovidData(frames)
+        self.delta_col = (
+            processing_utils.CONFIRMED_COL + processing_utils.DELTA_COL_SUFFIX
+        )
+
+    def test_summary_table(self):
+        summary = self.data.get_summary_table()
+
+        # Georgia is both a country and a state
+        self.assertEqual(
+            summary.index.tolist(),
+            [("Maryland", self.delta_col), ("US", self.delta_col)],
+        )
+        self.assertEqual(
+            summary.loc[("US", self.delta_col)].tolist(),
+            [3.0, 1.0, 4 / 3, 3.0, 1.0, 4 / 3, 3],
+        )
+
+    def test_panel_looks_up_summary_statistics(self):
+        summary_stats = processing_utils.get_stats_lookup(self.data.get_summary_table())
+        displayable_data = self.data.get_displayable_data(
+            entities=[processing_utils.COUNTRY_COL, processing_utils.STATE_COL],
+            measurements=[self.delta_col],
+            filter_dict={
+                processing_utils.COUNTRY_COL: ["US", "Georgia"],
+                processing_utils.STATE_COL: ["Georgia"],
+            },
+        )
+
+        _, computed = data_fetcher.fetch_streamlit_raw_data_display(displayable_data)
+        _, looked_up = data_fetcher.fetch_streamlit_raw_data_display(
+            displayable_data, summary_stats
+        )
+
+        self.assertEqual(list(looked_up), ["Georgia", "US"])
+        self.assertEqual(looked_up, computed)
+
+    def test_thresholds_do_not_use_the_summary(self):
+        summary_stats = {}
+        data_obj = mock.Mock(summary_stats=summary_stats)
+        request = data_fetcher.generate_data_fetch_request(
+            [self.delta_col], ["US"], [], [], True, processing_utils.CONFIRMED_COL, 2
+        )
+
+        self.assertIsNone(data_fetcher.get_summary_stats(data_obj, request))
+
+        request = data_fetcher.generate_data_fetch_request(
+            [self.delta_col], ["US"], [], [], False, None, None
+        )
+        self.assertIs(data_fetcher.get_summary_stats(data_obj, request), summary_stats)
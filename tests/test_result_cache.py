@@ -0,0 +1,122 @@
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from utils import data_fetcher
+from utils import processing_utils
+from utils.covid_dataset import CovidData
+from utils.result_cache import ResultCache
+
+
+def make_frame(rows):
+    return pd.DataFrame({"x": list(range(rows))})
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResultCache(max_entries=2)
+        cache.put(1, "a", make_frame(1))
+        cache.put(1, "b", make_frame(1))
+        cache.get(1, "a")
+        cache.put(1, "c", make_frame(1))
+
+        self.assertIsNotNone(cache.get(1, "a"))
+        self.assertIsNone(cache.get(1, "b"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_eviction_by_size(self):
+        one_entry = make_frame(100).memory_usage(index=True, deep=True).sum()
+        cache = ResultCache(max_bytes=int(one_entry * 1.5))
+        cache.put(1, "a", make_frame(100))
+        cache.put(1, "b", make_frame(100))
+
+        self.assertIsNone(cache.get(1, "a"))
+        self.assertIsNotNone(cache.get(1, "b"))
+        self.assertEqual(cache.stats()["bytes"], one_entry)
+
+    def test_new_generation_drops_older_entries(self):
+        cache = ResultCache()
+        cache.put(1, "a", make_frame(1))
+
+        self.assertIsNone(cache.get(2, "a"))
+
+        cache.put(2, "b", make_frame(1))
+
+        self.assertIsNone(cache.get(1, "a"))
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_older_generation_is_not_stored(self):
+        cache = ResultCache()
+        cache.put(2, "b", make_frame(1))
+        # A session still on the previous data finishing late
+        cache.put(1, "a", make_frame(1))
+
+        self.assertIsNotNone(cache.get(2, "b"))
+        self.assertIsNone(cache.get(1, "a"))
+        self.assertEqual(cache.stats()["generation"], 2)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_cached_results_cannot_be_modified(self):
+        cache = ResultCache()
+        df = make_frame(3)
+        cache.put(1, "a", (df, {"x": df}))
+        df["x"] = 0
+
+        result, displayable = cache.get(1, "a")
+        result["x"] = -1
+        displayable["x"]["x"] = -1
+
+        result, displayable = cache.get(1, "a")
+        self.assertEqual(result["x"].tolist(), [0, 1, 2])
+        self.assertEqual(displayable["x"]["x"].tolist(), [0, 1, 2])
+
+
+class ProcessRequestCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = mock.Mock(
+            CovidDf=CovidData(
+                [
+                    pd.DataFrame(
+                        {
+                            processing_utils.DATE_COL: ["2020-03-01", "2020-03-02"],
+                            processing_utils.COUNTRY_COL: ["US", "China"],
+                            processing_utils.CONFIRMED_COL: [10, 12],
+                        }
+                    )
+                ]
+            ),
+            generation=1,
+        )
+        self.cache = ResultCache()
+
+    def make_request(self, countries, threshold=10):
+        return data_fetcher.generate_data_fetch_request(
+            [processing_utils.CONFIRMED_COL], countries, [], [], False, None, threshold
+        )
+
+    def test_equivalent_requests_share_an_entry(self):
+        first, _ = data_fetcher.process_request_dict(
+            self.data, self.make_request(["US", "China"]), cache=self.cache
+        )
+        second, _ = data_fetcher.process_request_dict(
+            self.data, self.make_request(["China", "US", "US"], 20), cache=self.cache
+        )
+
+        pd.testing.assert_frame_equal(first, second)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+    def test_refresh_invalidates_results(self):
+        data_fetcher.process_request_dict(
+            self.data, self.make_request(["US"]), cache=self.cache
+        )
+        self.data.generation = 2
+        data_fetcher.process_request_dict(
+            self.data, self.make_request(["US"]), cache=self.cache
+        )
+
+        self.assertEqual(self.cache.stats()["hits"], 0)
+        self.assertEqual(self.cache.stats()["generation"], 2)
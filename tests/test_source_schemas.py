@@ -0,0 +1,129 @@
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from utils import io_utils
+from utils import processing_utils
+from utils import source_schemas
+
+
+def make_states_payload(with_date_checked=True):
+    records = []
+    for day, negative in [(20200302, 10), (20200301, 4)]:
+        for state in ["MD", "NY"]:
+            record = {
+                "date": day,
+                "state": state,
+                "negative": negative,
+                "positive": None,
+                "hash": "unused",
+            }
+            for key in [
+                "death",
+                "totalTestResults",
+                "hospitalizedCumulative",
+                "hospitalizedCurrently",
+                "inIcuCurrently",
+                "inIcuCumulative",
+                "onVentilatorCurrently",
+                "onVentilatorCumulative",
+            ]:
+                record[key] = 2
+            if with_date_checked:
+                record["dateChecked"] = "{}-{}-{}T20:00:00Z".format(
+                    str(day)[:4], str(day)[4:6], str(day)[6:]
+                )
+            records.append(record)
+
+    return json.dumps(records).encode("utf-8")
+
+
+US_TESTING_CSV = b"""date,states,negative,totalTestResults,hospitalizedCumulative,inIcuCurrently,inIcuCumulative,onVentilatorCurrently,onVentilatorCumulative,hospitalizedCurrently,hash
+20200302,56,30,40,5,1,2,0,0,3,b
+20200301,56,10,20,,1,1,0,0,2,a
+"""  # noqa
+
+US_TESTING_STABLE_CSV = b"""date,negative,totalTestResults,hospitalized,hash
+20200302,30,40,5,b
+20200301,10,20,,a
+"""
+
+
+class SourceSchemasTestCase(unittest.TestCase):
+    def test_experimental_states_parser(self):
+        df = source_schemas.parse_source("us_states_testing", make_states_payload())
+
+        self.assertNotIn("hash", df.columns)
+        self.assertEqual(
+            df[processing_utils.STATE_COL].unique().tolist(),
+            ["Maryland (United States)", "New York (United States)"],
+        )
+        self.assertEqual(
+            df[processing_utils.DATE_COL].tolist(),
+            list(pd.to_datetime(["2020-03-01"] * 2 + ["2020-03-02"] * 2)),
+        )
+        self.assertEqual(
+            df[
+                processing_utils.NEGATIVE_TEST_COL
+                + processing_utils.DELTA_PERCENT_COL_SUFFIX
+            ].tolist(),
+            [0, 0, 150, 150],
+        )
+
+    def test_falls_back_to_stable_parser_on_same_bytes(self):
+        df = source_schemas.parse_source(
+            "us_states_testing", make_states_payload(with_date_checked=False)
+        )
+
+        self.assertEqual(len(df), 4)
+        self.assertEqual(
+            df[processing_utils.DATE_COL].min(), pd.Timestamp("2020-03-01")
+        )
+
+    def test_us_testing_parsers(self):
+        df = source_schemas.parse_source("us_testing", US_TESTING_CSV)
+
+        self.assertNotIn("states", df.columns)
+        self.assertEqual(
+            df[processing_utils.COUNTRY_COL].unique().tolist(), ["United States"]
+        )
+        self.assertEqual(
+            df[
+                processing_utils.CUM_ICU_COL + processing_utils.DELTA_COL_SUFFIX
+            ].tolist(),
+            [1, 1],
+        )
+
+        df = source_schemas.parse_source("us_testing", US_TESTING_STABLE_CSV)
+
+        self.assertEqual(
+            df[processing_utils.HOSPITALIZED_COL].isna().tolist(), [True, False]
+        )
+        self.assertNotIn(processing_utils.CUM_ICU_COL, df.columns)
+
+    def test_frames_match_declared_schemas(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+
+        for source, raw, parser in [
+            ("us_states_testing", make_states_payload(), 0),
+            ("us_states_testing", make_states_payload(with_date_checked=False), 1),
+            ("us_testing", US_TESTING_CSV, 0),
+            ("us_testing", US_TESTING_STABLE_CSV, 1),
+        ]:
+            with mock.patch.object(io_utils, "CACHE_DIR", tmp_dir):
+                io_utils.save_frame(
+                    source, source_schemas.parse_source(source, raw), "v1"
+                )
+                manifest = io_utils.read_manifest(source)
+
+            schema = source_schemas.FRAME_SCHEMAS[source][parser]
+            self.assertTrue(io_utils.matches_schema(manifest, schema))
+
+    def test_last_parser_error_is_raised(self):
+        with self.assertRaises(Exception):
+            source_schemas.parse_source("us_testing", b"unrelated,columns\n1,2\n")
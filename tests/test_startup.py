@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_heavy_clients_are_not_imported(self):
+        code = (
+            "import sys\n"
+            "from utils import site_data_abstraction, data_fetcher, graphing\n"
+            "print(' '.join(m for m in ('kaggle', 'requests', 'altair') "
+            "if m in sys.modules))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=ROOT_DIR,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+
+        self.assertEqual(result.stdout.strip(), "")
@@ -0,0 +1,137 @@
+import itertools
+import unittest
+
+import pandas as pd
+
+from utils import processing_utils
+from utils import tensor_store
+from utils.covid_dataset import CovidData
+
+
+def make_frames():
+    dates = pd.to_datetime(["2020-03-01", "2020-03-02", "2020-03-04"])
+    countries = pd.DataFrame(
+        {
+            processing_utils.DATE_COL: list(dates) * 2,
+            processing_utils.COUNTRY_COL: ["US"] * 3 + ["Canada"] * 3,
+            processing_utils.CONFIRMED_COL: [1.0, 5.0, 9.0, 2.0, None, 30.0],
+        }
+    )
+    counties = pd.DataFrame(
+        {
+            processing_utils.DATE_COL: list(dates) * 3,
+            processing_utils.STATE_COL: ["Maryland"] * 6 + ["Ohio"] * 3,
+            processing_utils.COUNTY_COL: ["Kent (Maryland)"] * 3
+            + ["Cecil (Maryland)"] * 3
+            + ["Adams (Ohio)"] * 3,
+            processing_utils.CONFIRMED_COL: [3, 4, 12, 0, 1, 2, 5, 6, 7],
+            # Sums of these are not exact in floating point
+            processing_utils.DEATHS_COL: [0.1, 0.2, 0.3, 0.7, None, 0.3, 0.1, 0.6, 0.9],
+        }
+    )
+
+    return [
+        processing_utils.add_derived_metrics(
+            df,
+            sort_cols=[processing_utils.DATE_COL],
+            diff_group_cols=[entity_col],
+            delta_cols=[processing_utils.CONFIRMED_COL],
+            percent_cols=[processing_utils.CONFIRMED_COL],
+        )
+        for df, entity_col in [
+            (countries, processing_utils.COUNTRY_COL),
+            (counties, processing_utils.COUNTY_COL),
+        ]
+    ]
+
+
+class TensorStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.frames = make_frames()
+        self.pandas_data = CovidData(self.frames)
+        self.tensor_data = CovidData(self.frames, tensor=True)
+
+    def test_results_match_pandas_path(self):
+        filter_dicts = [
+            {processing_utils.COUNTRY_COL: ["ALL"]},
+            {processing_utils.COUNTRY_COL: ["US", "Canada", "Peru"]},
+            {processing_utils.STATE_COL: ["Ohio", "Maryland"]},
+            {
+                processing_utils.STATE_COL: ["Maryland"],
+                processing_utils.COUNTY_COL: ["Kent (Maryland)", "Adams (Ohio)"],
+            },
+            {processing_utils.COUNTY_COL: ["Cecil (Maryland)", "Kent (Maryland)"]},
+        ]
+        metrics = [
+            processing_utils.CONFIRMED_COL,
+            processing_utils.DEATHS_COL,
+            processing_utils.CONFIRMED_COL + processing_utils.DELTA_PERCENT_COL_SUFFIX,
+        ]
+
+        for filter_dict, threshold, days in itertools.product(
+            filter_dicts, [None, 4, 1000], [False, True]
+        ):
+            request = dict(
+                entities=[
+                    processing_utils.COUNTY_COL,
+                    processing_utils.COUNTRY_COL,
+                    processing_utils.STATE_COL,
+                ],
+                measurements=metrics,
+                filter_dict=filter_dict,
+                threshold_value=threshold,
+                threshold_metric=processing_utils.CONFIRMED_COL,
+                days_since_threshold=days,
+            )
+
+            expected = self.pandas_data.get_displayable_data(**request)
+            result = self.tensor_data.tensor_store.get_displayable_data(**request)
+
+            self.assertEqual(list(result), list(expected))
+            for metric in expected:
+                pd.testing.assert_frame_equal(
+                    result[metric], expected[metric], check_exact=True
+                )
+
+    def test_frames_with_repeated_rows_fall_back(self):
+        frames = self.frames + [pd.concat([self.frames[0]] * 2)]
+        data = CovidData(frames, tensor=True)
+        request = dict(
+            entities=[processing_utils.COUNTRY_COL],
+            measurements=[processing_utils.CONFIRMED_COL],
+            filter_dict={processing_utils.COUNTRY_COL: ["US"]},
+        )
+
+        self.assertIsNone(data.tensor_store.tensors[2])
+        self.assertIsNone(data.tensor_store.get_displayable_data(**request))
+        self.assertEqual(
+            data.get_displayable_data(**request)[processing_utils.CONFIRMED_COL][
+                processing_utils.MEASUREMENT_COL
+            ].tolist(),
+            [1.0, 5.0, 9.0, 2.0, 10.0, 18.0],
+        )
+
+    def test_frame_tensor_layout(self):
+        tensor = self.tensor_data.tensor_store.tensors[1]
+
+        self.assertEqual(tensor.n_days, 4)
+        self.assertEqual(
+            tensor.combos[processing_utils.COUNTY_COL].tolist(),
+            ["Adams (Ohio)", "Cecil (Maryland)", "Kent (Maryland)"],
+        )
+        self.assertEqual(
+            tensor.present[0].tolist(),
+            [True, True, False, True],
+        )
+        self.assertEqual(
+            tensor.values[tensor.metric_ids[processing_utils.CONFIRMED_COL], 2][
+                [0, 1, 3]
+            ].tolist(),
+            [3, 4, 12],
+        )
+        self.assertEqual(
+            tensor_store.get_sum_dtype(
+                self.frames[1][processing_utils.CONFIRMED_COL].dtype
+            ),
+            "int64",
+        )
@@ -1,49 +1,181 @@
+import hashlib
+import json
 import os
-from io import BytesIO
+import threading
 
 import pandas as pd
-import requests
-from kaggle.api.kaggle_api_extended import KaggleApi
+
+from utils import io_utils
 
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 INTERNATIONAL_CSV_FILENAME = "/data/covid-19-all.csv"
 CONFIRMED_CASES_KAGGLE_URL = "gpreda/coronavirus-2019ncov"
+KAGGLE_ZIP_PATH = DIR_PATH + "/data/coronavirus-2019ncov.zip"
+KAGGLE_VERSION_PATH = DIR_PATH + "/data/coronavirus-2019ncov.version.json"
+INTERNATIONAL_CSV_MEMBER = "covid-19-all.csv"
+# Only the columns the post processing uses, so Latitude / Longitude are
+# never materialized
+INTERNATIONAL_CSV_DTYPES = {
+    "Country/Region": object,
+    "Province/State": object,
+    "Confirmed": "float64",
+    "Recovered": "float64",
+    "Deaths": "float64",
+    "Date": object,
+}
 US_TESTING_DATA_ROOT_URL = "https://covidtracking.com/api/"
+US_STATES_TESTING_DATA_URL = "https://covidtracking.com/api/v1/states/daily.json"
 COUNTY_LEVEL_DATA_URL = "https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv"  # noqa
+JHU_DEATHS_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv"  # noqa
+JHU_CONFIRMED_URL = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv"  # noqa
+
+# Clients are created on first use, so importing this module is cheap and
+# does not need Kaggle credentials
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_kaggle_api():
+    with _clients_lock:
+        if "kaggle" not in _clients:
+            from kaggle.api.kaggle_api_extended import KaggleApi
+
+            api = KaggleApi()
+            api.authenticate()
+            _clients["kaggle"] = api
+
+        return _clients["kaggle"]
+
+
+def get_mirror():
+    """
+    Shared by every fetch below, so connections are pooled and unchanged
+    sources are served from the local mirror after a 304.
+    """
+    with _clients_lock:
+        if "mirror" not in _clients:
+            from utils.http_mirror import HttpMirror
+
+            _clients["mirror"] = HttpMirror()
+
+        return _clients["mirror"]
+
+
+def get_kaggle_dataset_version(url):
+    """
+    A fingerprint of the dataset's current version, built from the name, size
+    and creation date of each of its files.
+    """
+    files = get_kaggle_api().dataset_list_files(url).files
+    fingerprint = sorted(
+        (
+            str(getattr(f, "name", "")),
+            str(getattr(f, "size", "")),
+            str(getattr(f, "creationDate", "")),
+        )
+        for f in files
+    )
+    return hashlib.sha256(json.dumps(fingerprint).encode("utf-8")).hexdigest()
+
 
-api = KaggleApi()
-api.authenticate()
+def read_kaggle_version():
+    if not os.path.exists(KAGGLE_VERSION_PATH):
+        return None
+
+    with open(KAGGLE_VERSION_PATH) as f:
+        return json.load(f).get("version")
 
 
 def download_kaggle_dataset(url):
-    api.dataset_download_files(url, DIR_PATH + "/data/", unzip=True, force=True)
+    """
+    Downloads the dataset archive, unless the local archive already holds the
+    current version.
+    """
+    try:
+        version = get_kaggle_dataset_version(url)
+    except Exception as e:
+        print("Could not check the Kaggle dataset version")
+        print(e)
+        version = None
 
+    if os.path.exists(KAGGLE_ZIP_PATH) and (
+        version is None or version == read_kaggle_version()
+    ):
+        print("Kaggle dataset is up to date")
+        return
 
-def get_international_dataset():
     print("Downloading")
+    get_kaggle_api().dataset_download_files(
+        url, DIR_PATH + "/data/", unzip=False, force=True
+    )
+
+    if version is not None:
+        with open(KAGGLE_VERSION_PATH, "w") as f:
+            json.dump({"url": url, "version": version}, f)
+
+
+def update_international_dataset():
     try:
         download_kaggle_dataset(CONFIRMED_CASES_KAGGLE_URL)
     except Exception as e:
         print(e)
 
-    return pd.read_csv(DIR_PATH + INTERNATIONAL_CSV_FILENAME)
+
+def read_international_dataset():
+    if not os.path.exists(KAGGLE_ZIP_PATH):
+        # Copies extracted by earlier versions of this loader
+        return pd.read_csv(
+            DIR_PATH + INTERNATIONAL_CSV_FILENAME,
+            usecols=list(INTERNATIONAL_CSV_DTYPES),
+            dtype=INTERNATIONAL_CSV_DTYPES,
+        )
+
+    return io_utils.read_csv_from_zip(
+        KAGGLE_ZIP_PATH,
+        INTERNATIONAL_CSV_MEMBER,
+        usecols=list(INTERNATIONAL_CSV_DTYPES),
+        dtype=INTERNATIONAL_CSV_DTYPES,
+    )
+
+
+def get_source_version(source):
+    """
+    The version of the raw data last fetched for a source, or None when it is
+    not known. Frames built from that data are cached under this version.
+    """
+    if source == "kaggle":
+        return read_kaggle_version()
+
+    urls = {
+        "us_testing": [US_TESTING_DATA_ROOT_URL + "us/daily.csv"],
+        "us_states_testing": [US_STATES_TESTING_DATA_URL],
+    }[source]
+    versions = [get_mirror().get_version(url) for url in urls]
+
+    if any(version is None for version in versions):
+        return None
+
+    return "-".join(versions)
 
 
 def get_historical_us_testing_data():
+    """
+    The raw CSV bytes, parsed by source_schemas so a fallback parser can
+    reuse them.
+    """
     print("Getting historical US data")
     suffix = "us/daily.csv"
 
-    r = requests.get(US_TESTING_DATA_ROOT_URL + suffix)
-    csv_string = r.content
-    return pd.read_csv(BytesIO(csv_string))
+    return get_mirror().fetch(US_TESTING_DATA_ROOT_URL + suffix)
 
 
 def get_historical_states_testing_data():
-    # print("Getting states data")
-    # suffix = "states/daily.csv"
-    # r = requests.get(US_TESTING_DATA_ROOT_URL + suffix)
-    # csv_string = r.content
-    return pd.read_json("https://covidtracking.com/api/v1/states/daily.json")
+    """
+    The raw JSON bytes, parsed by source_schemas so a fallback parser can
+    reuse them.
+    """
+    print("Getting states data")
+    return get_mirror().fetch(US_STATES_TESTING_DATA_URL)
 
 
 def get_historical_county_level_data():
@@ -51,12 +183,12 @@ def get_historical_county_level_data():
 
 
 def get_johns_hopkins_county_level_data():
+    """
+    The raw CSV bytes of the deaths and confirmed files, only parsed when
+    the county table cached from them is out of date.
+    """
     print("Getting johns hopkins data")
-    deaths = pd.read_csv(
-        "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv"
-    )
-    confirmed = pd.read_csv(
-        "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv"
-    )
+    deaths = get_mirror().fetch(JHU_DEATHS_URL)
+    confirmed = get_mirror().fetch(JHU_CONFIRMED_URL)
 
     return deaths, confirmed
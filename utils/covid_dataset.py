@@ -1,6 +1,174 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import numpy as np
 import pandas as pd
 
+from utils import dates
 from utils import processing_utils
+from utils.tensor_store import TensorStore
+
+# The rows of a frame sorted by entity, then date. `order` holds their
+# positions, `codes` the entity code of each of them (-1 for rows without an
+# entity) and `bounds` maps each entity to its (start, stop) in `order`.
+EntityIndex = namedtuple("EntityIndex", ["order", "codes", "bounds"])
+
+
+def build_entity_index(df, entity_col, x_col=processing_utils.DATE_COL):
+    """
+    Indexes the rows of every entity of `entity_col`, in `x_col` order, so
+    looking up k entities costs O(k + rows returned).
+    """
+    codes, uniques = pd.factorize(df[entity_col])
+    order = np.lexsort((df[x_col].to_numpy(), codes))
+    codes = codes[order]
+
+    is_start = np.ones(len(codes), dtype=bool)
+    is_start[1:] = codes[1:] != codes[:-1]
+    starts = np.flatnonzero(is_start)
+    stops = np.r_[starts[1:], len(codes)]
+    names = list(uniques)
+
+    # Rows without an entity are never matched by a filter
+    bounds = {
+        names[code]: (start, stop)
+        for code, start, stop in zip(codes[starts], starts, stops)
+        if code != -1
+    }
+
+    return EntityIndex(order, codes, bounds)
+
+
+def get_entity_positions(index, entities):
+    """
+    The positions of the rows of any of `entities`, each entity in date order.
+    """
+    positions = [
+        index.order[slice(*index.bounds[entity])]
+        for entity in dict.fromkeys(entities)
+        if entity in index.bounds
+    ]
+
+    if len(positions) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    return np.concatenate(positions)
+
+
+def build_running_max(df, index, metric):
+    """
+    The running maximum of `metric` over the rows of each entity, laid out
+    like `index.order`. Missing values never raise it. An entity first
+    reaches a threshold at the first row where its running maximum does,
+    which np.searchsorted finds in O(log n) as the running maximum never
+    decreases.
+    """
+    values = df[metric].to_numpy(dtype=np.float64, na_value=np.nan)[index.order]
+    values[np.isnan(values)] = -np.inf
+
+    return pd.Series(values).groupby(index.codes).cummax().to_numpy()
+
+
+def build_entity_indexes(df, x_col=processing_utils.DATE_COL):
+    return {
+        col: build_entity_index(df, col, x_col)
+        for col in processing_utils.ENTITY_COLS
+        if col in df.columns
+    }
+
+
+def build_routing_catalog(dfs):
+    """
+    Maps each (entity column, metric) to the positions of the frames that
+    carry both, in frame order. Frames missing from a route never need to
+    be scanned to answer it.
+    """
+    catalog = {}
+    for i, df in enumerate(dfs):
+        entity_cols = [col for col in processing_utils.ENTITY_COLS if col in df.columns]
+        metric_cols = [
+            col
+            for col in df.columns
+            if col not in processing_utils.ENTITY_COLS
+            and col != processing_utils.DATE_COL
+            and col != processing_utils.DAYS_SINCE_THRESHOLD_COL
+        ]
+
+        for entity_col in entity_cols:
+            for metric in metric_cols:
+                catalog.setdefault((entity_col, metric), []).append(i)
+
+    return catalog
+
+
+def get_routed_frames(catalog, entities, measurements):
+    """
+    The positions of the frames that can answer any (entity, measurement)
+    pair of a request, in frame order.
+    """
+    frames = set()
+    for entity_col in entities:
+        for measurement in measurements:
+            frames.update(catalog.get((entity_col, measurement), []))
+
+    return sorted(frames)
+
+
+def split_aggregate(rows, entity_col, x_col, metrics, reads):
+    """
+    Aggregates `metrics` of the rows read by a batch of requests from one
+    (frame, entity column) by entity and `x_col`, then splits the result
+    per read. A read is (filter values, or None for all entities, metrics),
+    and gets one frame per metric. Module level so groups can be sent to
+    worker processes.
+    """
+    grouping_cols = [entity_col, x_col]
+    aggregated_df = processing_utils.agg_df(
+        rows, group_cols=grouping_cols, agg_col=metrics
+    )
+
+    # The aggregate is sorted by entity, so each entity is a block of rows
+    codes, uniques = pd.factorize(aggregated_df[entity_col])
+    is_start = np.ones(len(codes), dtype=bool)
+    is_start[1:] = codes[1:] != codes[:-1]
+    starts = np.flatnonzero(is_start)
+    stops = np.r_[starts[1:], len(codes)]
+    bounds = dict(zip(uniques[codes[starts]], zip(starts, stops)))
+
+    pieces = []
+    for filter_values, read_metrics in reads:
+        read_df = aggregated_df
+        if filter_values is not None:
+            blocks = sorted(
+                bounds[entity] for entity in set(filter_values) if entity in bounds
+            )
+            positions = np.concatenate(
+                [np.arange(start, stop) for start, stop in blocks]
+                + [np.empty(0, dtype=np.int64)]
+            )
+            read_df = aggregated_df.iloc[positions].reset_index(drop=True)
+
+        pieces.append(
+            [
+                read_df[grouping_cols + [metric]].rename(
+                    columns={
+                        entity_col: processing_utils.ENTITY_COL,
+                        metric: processing_utils.MEASUREMENT_COL,
+                    }
+                )
+                for metric in read_metrics
+            ]
+        )
+
+    return pieces
+
+
+def answer_requests(data, requests):
+    """
+    Answers a list of get_displayable_data keyword arguments.
+    """
+    return [data.get_displayable_data(**request) for request in requests]
 
 
 class CovidData:
@@ -8,112 +176,172 @@ class CovidData:
     Wrapper for all of our data sources
     """
 
-    def __init__(self, dfs):
-        self.dataframes = dfs
+    def __init__(self, dfs, compact=False, names=None, tensor=False):
+        # Frame names, only used to describe query plans
+        if names is None:
+            names = ["frame {}".format(i) for i in range(len(dfs))]
+        self.names = list(names)
+        # Dates are held as datetime64 and only formatted for display
+        self.dataframes = []
+        # The dtypes of each frame before compaction. Query results are cast
+        # back to them, so they do not depend on how the frames are stored.
+        self.dtypes = []
+        # For each frame, {entity column: EntityIndex}
+        self.entity_index = []
+        for df in dfs:
+            if (
+                processing_utils.DATE_COL in df.columns
+                and df[processing_utils.DATE_COL].dtype.kind != "M"
+            ):
+                df = df.copy()
+                df[processing_utils.DATE_COL] = dates.parse_dates(
+                    df[processing_utils.DATE_COL]
+                )
+
+            self.dtypes.append(df.dtypes)
+            if compact:
+                df = processing_utils.compact_frame(df)
+
+            entity_cols = [
+                col for col in processing_utils.ENTITY_COLS if col in df.columns
+            ]
+            if len(entity_cols) > 0:
+                # The rows of each entity of the finest kind are contiguous
+                df = df.sort_values(
+                    by=[entity_cols[-1], processing_utils.DATE_COL]
+                ).reset_index(drop=True)
+
+            self.dataframes.append(df)
+            self.entity_index.append(build_entity_indexes(df))
+
+        self.catalog = build_routing_catalog(self.dataframes)
+
+        # The dense tensor engine, used for the requests it can answer
+        self.tensor_store = None
+        if tensor:
+            self.tensor_store = TensorStore(self.dataframes, self.dtypes)
+
+        # Running maxima for threshold crossings, built on first use and
+        # keyed by (frame, entity column, metric)
+        self.running_max = {}
+
+    def get_crossing_date(self, i, entity_col, entity, metric, threshold):
+        """
+        The first date on which `entity` has a `metric` of at least
+        `threshold` in frame i, or None when it never does.
+        """
+        index = self.entity_index[i][entity_col]
+        if entity not in index.bounds:
+            return None
+
+        key = (i, entity_col, metric)
+        if key not in self.running_max:
+            self.running_max[key] = build_running_max(self.dataframes[i], index, metric)
+
+        start, stop = index.bounds[entity]
+        crossing = start + np.searchsorted(
+            self.running_max[key][start:stop], threshold, side="left"
+        )
+        if crossing == stop:
+            return None
+
+        return self.dataframes[i][processing_utils.DATE_COL].iloc[index.order[crossing]]
 
-    def get_scaled_dataframes(self, threshold_value, threshold_metric, filter_dict):
+    def get_scaled_dataframes(
+        self, threshold_value, threshold_metric, filter_dict, days_since_threshold=False
+    ):
+        """
+        The rows of the filtered entities from the day each first reached the
+        threshold, shifted so those days line up on the earliest of them.
+        With `days_since_threshold`, the Date column is replaced by the number
+        of days since the entity reached the threshold.
+        """
         entity_type_to_entity_to_min_date = {}
 
         global_min_date = None
-        date_serialized_dataframes = []
-
-        for i, df in enumerate(self.dataframes):
-            new_df = df.copy()
-            if processing_utils.DATE_COL in new_df:
-                new_df[processing_utils.DATE_COL] = pd.to_datetime(
-                    new_df[processing_utils.DATE_COL]
-                )
 
-            date_serialized_dataframes.append(new_df)
+        for entity_type, values in filter_dict.items():
+            for i in self.catalog.get((entity_type, threshold_metric), []):
+                for entity_definition in values:
+                    this_min = self.get_crossing_date(
+                        i,
+                        entity_type,
+                        entity_definition,
+                        threshold_metric,
+                        threshold_value,
+                    )
+                    if this_min is None:
+                        continue
 
-        for i, df in enumerate(date_serialized_dataframes):
-            if threshold_metric in df.columns:
-                for entity_type, values in filter_dict.items():
-                    if entity_type in df.columns:
-                        for entity_definition in values:
-                            matching_rows = df[
-                                (df[entity_type] == entity_definition)
-                                & (df[threshold_metric] >= threshold_value)
-                            ]
+                    if global_min_date is None or global_min_date > this_min:
+                        global_min_date = this_min
 
-                            if len(matching_rows) > 0:
-                                this_min = matching_rows[
-                                    processing_utils.DATE_COL
-                                ].min()
-
-                                if (
-                                    global_min_date is None
-                                    or global_min_date > this_min
-                                ):
-                                    global_min_date = this_min
-
-                                if entity_type not in entity_type_to_entity_to_min_date:
-                                    entity_type_to_entity_to_min_date[entity_type] = {}
-
-                                if (
-                                    entity_definition
-                                    not in entity_type_to_entity_to_min_date[
-                                        entity_type
-                                    ]
-                                ):
-                                    entity_type_to_entity_to_min_date[entity_type][
-                                        entity_definition
-                                    ] = this_min
-                                else:
-                                    prev_min = entity_type_to_entity_to_min_date[
-                                        entity_type
-                                    ][entity_definition]
-
-                                    if this_min < prev_min:
-                                        entity_type_to_entity_to_min_date[entity_type][
-                                            entity_definition
-                                        ] = this_min
+                    min_dates = entity_type_to_entity_to_min_date.setdefault(
+                        entity_type, {}
+                    )
+                    if (
+                        entity_definition not in min_dates
+                        or this_min < min_dates[entity_definition]
+                    ):
+                        min_dates[entity_definition] = this_min
 
         if global_min_date is None:
             return []
 
         filtered_dfs = []
-        for i, df in enumerate(date_serialized_dataframes):
-            filtered_df = df
-            filtered_df = filtered_df[
-                filtered_df[processing_utils.DATE_COL] >= global_min_date
-            ]
-
-            scaled_dfs = []
+        for i, df in enumerate(self.dataframes):
+            date_values = df[processing_utils.DATE_COL].to_numpy()
+            blocks = []
+            block_min_dates = []
 
             for entity_type, entity_defs in entity_type_to_entity_to_min_date.items():
+                if entity_type not in df.columns:
+                    continue
+
                 for entity_def, min_date in entity_defs.items():
-                    if entity_type in filtered_df.columns:
-                        scaled_df = filtered_df[filtered_df[entity_type] == entity_def]
-                        scaled_df = scaled_df[
-                            scaled_df[processing_utils.DATE_COL] >= min_date
+                    # The entity's rows are in date order, and min_date is
+                    # never before global_min_date
+                    positions = get_entity_positions(
+                        self.entity_index[i][entity_type], [entity_def]
+                    )
+                    positions = positions[
+                        np.searchsorted(
+                            date_values[positions], min_date.to_datetime64()
+                        ) :
+                    ]
+
+                    if threshold_metric in df.columns:
+                        positions = positions[
+                            df[threshold_metric].to_numpy()[positions]
+                            >= threshold_value
                         ]
 
-                        if threshold_metric in scaled_df.columns:
-                            scaled_df = scaled_df[
-                                scaled_df[threshold_metric] >= threshold_value
-                            ]
-
-                        if len(scaled_df) < 0:
-                            continue
+                    blocks.append(positions)
+                    block_min_dates.append(min_date.to_datetime64())
 
-                        days_scale = min_date - global_min_date
+            if len(blocks) == 0:
+                continue
 
-                        scaled_df[processing_utils.DATE_COL] = scaled_df[
-                            processing_utils.DATE_COL
-                        ].apply(lambda d: d - days_scale)
-                        scaled_dfs.append(scaled_df)
+            # All entities are shifted at once: each row by the alignment
+            # date of the block it came from
+            scaled_df = df.iloc[np.concatenate(blocks)].astype(self.dtypes[i])
+            row_dates = scaled_df[processing_utils.DATE_COL].to_numpy()
+            row_min_dates = np.repeat(
+                np.array(block_min_dates).astype(row_dates.dtype),
+                [len(block) for block in blocks],
+            )
 
-            if len(scaled_dfs) > 0:
-                filtered_dfs.append(pd.concat(scaled_dfs))
+            if days_since_threshold:
+                scaled_df[processing_utils.DAYS_SINCE_THRESHOLD_COL] = (
+                    row_dates - row_min_dates
+                ) // np.timedelta64(1, "D")
+                scaled_df = scaled_df.drop(columns=[processing_utils.DATE_COL])
+            else:
+                scaled_df[processing_utils.DATE_COL] = row_dates - (
+                    row_min_dates - global_min_date.to_datetime64()
+                )
 
-        for i, df in enumerate(filtered_dfs):
-            if processing_utils.DATE_COL in df.columns:
-                re_written_df = df
-                re_written_df[processing_utils.DATE_COL] = re_written_df[
-                    processing_utils.DATE_COL
-                ].apply(lambda x: x.strftime("%Y-%m-%d"))
-                filtered_dfs[i] = re_written_df
+            filtered_dfs.append(scaled_df)
 
         return filtered_dfs
 
@@ -124,6 +352,7 @@ class CovidData:
         filter_dict,
         threshold_value=None,
         threshold_metric=None,
+        days_since_threshold=False,
     ):
         """
         Process a data request to display on a graph.
@@ -135,64 +364,311 @@ class CovidData:
             measurements {[string]} -- the metrics to display
             i.e. Confirmed, Deaths, etc
 
+            filter_dict {dict} -- the values to keep for each entity column.
+            Each entity column is only filtered by its own values.
+
+            days_since_threshold {bool} -- with a threshold, index results by
+            days since each entity reached it instead of by date
+
         Returns:
             A dictionary mapping a measurement type to a dataframe.
 
             Each dataframe will have 3 columns:
-            [Date, Entity, Metric]
+            [Date, Entity, Metric], or [Days since threshold, Entity, Metric]
         """
+        if self.tensor_store is not None:
+            results = self.tensor_store.get_displayable_data(
+                entities,
+                measurements,
+                filter_dict,
+                threshold_value=threshold_value,
+                threshold_metric=threshold_metric,
+                days_since_threshold=days_since_threshold,
+            )
+            if results is not None:
+                return results
+
+        x_col = processing_utils.DATE_COL
         dfs_to_use = self.dataframes
+        dtypes_to_use = self.dtypes
+        indexes_to_use = self.entity_index
+        catalog = self.catalog
 
         if threshold_value is not None and threshold_metric is not None:
             dfs_to_use = self.get_scaled_dataframes(
                 threshold_value=threshold_value,
                 threshold_metric=threshold_metric,
                 filter_dict=filter_dict,
+                days_since_threshold=days_since_threshold,
             )
+            if days_since_threshold:
+                x_col = processing_utils.DAYS_SINCE_THRESHOLD_COL
+
+            # Scaled frames already have their original dtypes
+            dtypes_to_use = [df.dtypes for df in dfs_to_use]
+            indexes_to_use = [build_entity_indexes(df, x_col) for df in dfs_to_use]
+            catalog = build_routing_catalog(dfs_to_use)
 
         results = {col: [] for col in measurements}
 
-        for df in dfs_to_use:
+        # Frames that cannot answer any (entity, measurement) pair are skipped
+        for i in get_routed_frames(catalog, entities, measurements):
+            df = dfs_to_use[i]
+            dtypes = dtypes_to_use[i]
+            entity_index = indexes_to_use[i]
             matching_entity_cols = [col for col in entities if col in df.columns]
 
             matching_measurement_cols = [
                 col for col in measurements if col in df.columns
             ]
 
-            for measurement_col in matching_measurement_cols:
-                for entity_col in matching_entity_cols:
-                    grouping_cols = [entity_col, processing_utils.DATE_COL]
+            # Every metric is aggregated by the same group-by
+            agg_cols = list(dict.fromkeys(matching_measurement_cols))
+
+            for entity_col in matching_entity_cols:
+                grouping_cols = [entity_col, x_col]
+
+                # Each entity column is filtered once, by its own filter
+                rows = df
+                if filter_dict.get(entity_col, ["ALL"]) != ["ALL"]:
+                    rows = df.iloc[
+                        get_entity_positions(
+                            entity_index[entity_col], filter_dict[entity_col]
+                        )
+                    ]
+
+                query_cols = grouping_cols + agg_cols
+                aggregated_df = processing_utils.agg_df(
+                    rows[query_cols].astype(dtypes[query_cols]),
+                    group_cols=grouping_cols,
+                    agg_col=agg_cols,
+                )
+
+                for measurement_col in matching_measurement_cols:
+                    results[measurement_col].append(
+                        aggregated_df[grouping_cols + [measurement_col]].rename(
+                            columns={
+                                entity_col: processing_utils.ENTITY_COL,
+                                measurement_col: processing_utils.MEASUREMENT_COL,
+                            }
+                        )
+                    )
+
+        combined_results = {}
+        for measurement, dataframes in results.items():
+            if len(dataframes) > 0:
+                combined_results[measurement] = pd.concat(dataframes)
+
+        return combined_results
+
+    def get_summary_table(self):
+        """
+        The rate of change statistics of every entity and daily increase
+        metric, over all of its days and over the last week, indexed by
+        (entity, metric) with (period, statistic) columns.
 
-                    if entity_col in filter_dict:
-                        if filter_dict[entity_col] != ["ALL"]:
-                            df = df[df[entity_col].isin(filter_dict[entity_col])]
+        Names shared by entities of different columns, like a country and a
+        state, are left out: a request for both combines their rows.
+        """
+        metrics = (
+            processing_utils.METRIC_DELTA_COLS
+            + processing_utils.METRIC_PERCENT_CHANGE_COLS
+        )
+
+        tables = {}
+        entity_to_cols = {}
+        for entity_col in processing_utils.ENTITY_COLS:
+            displayable_data = self.get_displayable_data(
+                entities=[entity_col],
+                measurements=metrics,
+                filter_dict={entity_col: ["ALL"]},
+            )
+
+            for metric, df in displayable_data.items():
+                stats = processing_utils.describe_rate_of_change(
+                    df, processing_utils.DATE_COL
+                )
+                tables[(entity_col, metric)] = stats
+                for entity in stats.index:
+                    entity_to_cols.setdefault(entity, set()).add(entity_col)
+
+        if len(tables) == 0:
+            return pd.DataFrame(
+                columns=pd.MultiIndex.from_tuples(
+                    processing_utils.RATE_OF_CHANGE_STATS
+                ),
+                index=pd.MultiIndex.from_tuples(
+                    [], names=[processing_utils.ENTITY_COL, "Metric"]
+                ),
+            )
+
+        summary = pd.concat(tables, names=["Entity column", "Metric"])
+        shared = [entity for entity, cols in entity_to_cols.items() if len(cols) > 1]
+        summary = summary[
+            ~summary.index.get_level_values(processing_utils.ENTITY_COL).isin(shared)
+        ]
+
+        return (
+            summary.droplevel("Entity column")
+            .reorder_levels([processing_utils.ENTITY_COL, "Metric"])
+            .sort_index()
+        )
+
+    def explain(self, request):
+        """
+        Describes how a data request would be answered, without running it:
+        one row per frame scan, with the metrics it reads, an estimate of
+        the rows it touches and the index used to find them.
 
-                    aggregated_df = processing_utils.agg_df(
-                        df, group_cols=grouping_cols, agg_col=measurement_col
+        Arguments:
+            request {dict} -- a request as built by
+            data_fetcher.generate_data_fetch_request
+        """
+        entities = request["entities"]
+        measurements = request["metrics"]
+        filter_dict = request["filter_dict"]
+        threshold_metric = request.get("threshold_metric")
+        has_threshold = (
+            request.get("threshold_val") is not None and threshold_metric is not None
+        )
+
+        rows = []
+        for i in get_routed_frames(self.catalog, entities, measurements):
+            df = self.dataframes[i]
+            metrics = [col for col in measurements if col in df.columns]
+
+            for entity_col in [col for col in entities if col in df.columns]:
+                filter_values = filter_dict.get(entity_col, ["ALL"])
+
+                if filter_values == ["ALL"]:
+                    estimated_rows = len(df)
+                    index = "full scan"
+                else:
+                    bounds = self.entity_index[i][entity_col].bounds
+                    estimated_rows = sum(
+                        bounds[entity][1] - bounds[entity][0]
+                        for entity in set(filter_values)
+                        if entity in bounds
                     )
+                    index = "entity index on {}".format(entity_col)
+
+                if has_threshold and threshold_metric in df.columns:
+                    index += ", running max of {}".format(threshold_metric)
+
+                rows.append((self.names[i], entity_col, metrics, estimated_rows, index))
 
-                    aggregated_df = aggregated_df.rename(
-                        columns={
-                            entity_col: processing_utils.ENTITY_COL,
-                            measurement_col: processing_utils.MEASUREMENT_COL,
-                        }
+        return pd.DataFrame(
+            rows, columns=["Frame", "Entity", "Metrics", "Estimated rows", "Index"]
+        )
+
+    def process_many(self, requests, workers=None):
+        """
+        Answers a batch of requests, given as get_displayable_data keyword
+        arguments, in order, with the results each would get on its own.
+
+        The requests are grouped by the (frame, entity column) they read.
+        Each group is filtered and aggregated once, for the union of the
+        entities and metrics of its requests, and the aggregate is split per
+        request. With `workers`, the groups are spread across that many
+        worker processes. Overlays shift each entity by its own threshold
+        crossing, so they are answered one by one.
+        """
+        requests = list(requests)
+        if self.tensor_store is not None:
+            return answer_requests(self, requests)
+
+        x_col = processing_utils.DATE_COL
+        answers = [None] * len(requests)
+        # For each request, the (metric, frame) pairs of each of its reads,
+        # in the order get_displayable_data concatenates them
+        request_pieces = [[] for _ in requests]
+        # (frame, entity column) -> [(request, piece, filter values, metrics)]
+        groups = {}
+
+        for k, request in enumerate(requests):
+            if (
+                request.get("threshold_value") is not None
+                and request.get("threshold_metric") is not None
+            ):
+                answers[k] = self.get_displayable_data(**request)
+                continue
+
+            entities = request["entities"]
+            measurements = request["measurements"]
+            filter_dict = request["filter_dict"]
+            for i in get_routed_frames(self.catalog, entities, measurements):
+                df = self.dataframes[i]
+                metrics = [col for col in measurements if col in df.columns]
+
+                for entity_col in [col for col in entities if col in df.columns]:
+                    filter_values = filter_dict.get(entity_col, ["ALL"])
+                    groups.setdefault((i, entity_col), []).append(
+                        (
+                            k,
+                            len(request_pieces[k]),
+                            None if filter_values == ["ALL"] else filter_values,
+                            metrics,
+                        )
                     )
+                    request_pieces[k].append(None)
+
+        tasks = []
+        for (i, entity_col), reads in groups.items():
+            df = self.dataframes[i]
+            metrics = list(dict.fromkeys(chain.from_iterable(r[3] for r in reads)))
+
+            # Each frame is read once per entity column, for the whole batch
+            rows = df
+            if all(filter_values is not None for _, _, filter_values, _ in reads):
+                index = self.entity_index[i][entity_col]
+                rows = df.iloc[
+                    np.unique(
+                        np.concatenate(
+                            [
+                                get_entity_positions(index, filter_values)
+                                for _, _, filter_values, _ in reads
+                            ]
+                        )
+                    )
+                ]
+
+            query_cols = [entity_col, x_col] + metrics
+            tasks.append(
+                (
+                    rows[query_cols].astype(self.dtypes[i][query_cols]),
+                    entity_col,
+                    x_col,
+                    metrics,
+                    [
+                        (filter_values, read_metrics)
+                        for _, _, filter_values, read_metrics in reads
+                    ],
+                )
+            )
 
-                    results[measurement_col].append(aggregated_df)
+        if workers is None or workers <= 1 or len(tasks) <= 1:
+            group_pieces = [split_aggregate(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+                group_pieces = list(executor.map(split_aggregate, *zip(*tasks)))
 
-        combined_results = {}
-        for measurement, dataframes in results.items():
-            if len(dataframes) > 0:
-                concat_df = pd.concat(dataframes)
+        for reads, pieces in zip(groups.values(), group_pieces):
+            for (k, piece, _, metrics), metric_dfs in zip(reads, pieces):
+                request_pieces[k][piece] = zip(metrics, metric_dfs)
 
-                actual_entities = concat_df[processing_utils.ENTITY_COL].unique()
-                combined_results[measurement] = {col: [] for col in actual_entities}
+        for k, request in enumerate(requests):
+            if answers[k] is not None:
+                continue
 
-                for entity in actual_entities:
-                    relevant_rows = concat_df[
-                        concat_df[processing_utils.ENTITY_COL] == entity
-                    ][[processing_utils.DATE_COL, processing_utils.MEASUREMENT_COL]]
+            results = {col: [] for col in request["measurements"]}
+            for metric_dfs in request_pieces[k]:
+                for metric, metric_df in metric_dfs:
+                    results[metric].append(metric_df)
 
-                combined_results[measurement] = concat_df
+            answers[k] = {
+                measurement: pd.concat(dataframes)
+                for measurement, dataframes in results.items()
+                if len(dataframes) > 0
+            }
 
-        return combined_results
+        return answers
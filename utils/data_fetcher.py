@@ -1,23 +1,129 @@
+from utils import dates
 from utils import processing_utils
+from utils.result_cache import ResultCache, copy_result
 import pandas as pd
-import altair as alt
-import math
 from functools import reduce
+from itertools import chain
+
+# Results of process_request_dict, shared by every session of the process
+RESULT_CACHE = ResultCache()
+
+
+def get_canonical_request(request):
+    """
+    A hashable key for a request, equal for requests that give the same
+    results: the filtered entities are deduplicated and sorted, and the
+    threshold settings are dropped when no overlay is applied. The entity
+    and metric lists keep their order, which decides the order of the
+    results.
+    """
+    threshold = None
+    if request["threshold_val"] is not None and request["threshold_metric"] is not None:
+        threshold = (
+            request["threshold_metric"],
+            float(request["threshold_val"]),
+            bool(request.get("days_since_threshold", False)),
+        )
+
+    filters = tuple(
+        sorted(
+            (col, tuple(sorted(set(values))))
+            for col, values in request["filter_dict"].items()
+        )
+    )
+
+    return (tuple(request["entities"]), tuple(request["metrics"]), filters, threshold)
+
+
+def process_request_dict(data_obj, request, cache=RESULT_CACHE):
+    """
+    Processes a request, reusing the result of an identical request on the
+    same generation of the data. Pass cache=None to always recompute.
+    """
+    generation = getattr(data_obj, "generation", None)
+    use_cache = cache is not None and generation is not None
+
+    if use_cache:
+        key = get_canonical_request(request)
+        result = cache.get(generation, key)
+        if result is not None:
+            return result
+
+    result = build_source_df(
+        data_obj.CovidDf.get_displayable_data(**get_query(request))
+    )
+
+    if use_cache:
+        cache.put(generation, key, result)
+
+    return result
+
+
+def process_many(data_obj, requests, workers=None, cache=RESULT_CACHE):
+    """
+    Processes a batch of requests, returning their results in order, as
+    process_request_dict would. Cached and repeated requests are answered
+    once; the others are answered together by CovidData.process_many.
+    """
+    generation = getattr(data_obj, "generation", None)
+    use_cache = cache is not None and generation is not None
 
+    keys = [get_canonical_request(request) for request in requests]
+    results = {}
+    missing = {}
+    for key, request in zip(keys, requests):
+        if key in results or key in missing:
+            continue
 
-def process_request_dict(data_obj, request):
-    return process(
-        data=data_obj,
+        result = cache.get(generation, key) if use_cache else None
+        if result is None:
+            missing[key] = request
+        else:
+            results[key] = result
+
+    displayable_dicts = data_obj.CovidDf.process_many(
+        [get_query(request) for request in missing.values()], workers=workers
+    )
+    for key, displayable_data in zip(missing, displayable_dicts):
+        results[key] = build_source_df(displayable_data)
+        if use_cache:
+            cache.put(generation, key, results[key])
+
+    # Repeated requests get their own copies
+    returned = set()
+    batch_results = []
+    for key in keys:
+        if key in returned:
+            batch_results.append(copy_result(results[key]))
+        else:
+            batch_results.append(results[key])
+            returned.add(key)
+
+    return batch_results
+
+
+def get_query(request):
+    """
+    The CovidData.get_displayable_data arguments of a request.
+    """
+    return dict(
         entities=request["entities"],
-        metrics=request["metrics"],
+        measurements=request["metrics"],
         filter_dict=request["filter_dict"],
         threshold_value=request["threshold_val"],
         threshold_metric=request["threshold_metric"],
+        days_since_threshold=request.get("days_since_threshold", False),
     )
 
 
 def process(
-    data, entities, metrics, filter_dict, threshold_value=None, threshold_metric=None
+    data,
+    entities,
+    metrics,
+    filter_dict,
+    threshold_value=None,
+    threshold_metric=None,
+    days_since_threshold=False,
 ):
     displayable_data = data.CovidDf.get_displayable_data(
         entities=entities,
@@ -25,15 +131,27 @@ def process(
         filter_dict=filter_dict,
         threshold_metric=threshold_metric,
         threshold_value=threshold_value,
+        days_since_threshold=days_since_threshold,
     )
 
+    return build_source_df(displayable_data)
+
+
+def build_source_df(displayable_data):
     dfs = []
 
     for metric_type, df in displayable_data.items():
+        # This is the display boundary: from here on, dates are strings.
+        # Results indexed by days since the threshold have no dates.
+        if processing_utils.DATE_COL in df.columns:
+            df[processing_utils.DATE_COL] = dates.format_dates(
+                df[processing_utils.DATE_COL]
+            )
+
         if len(df) > 0:
-            df[processing_utils.CATEGORY_GRAPHING_COL] = df.apply(
-                lambda row: row[processing_utils.ENTITY_COL] + ": " + metric_type,
-                axis=1,
+            df[processing_utils.CATEGORY_GRAPHING_COL] = processing_utils.build_labels(
+                lambda entity: entity + ": " + metric_type,
+                df[processing_utils.ENTITY_COL],
             )
             dfs.append(df)
 
@@ -43,15 +161,29 @@ def process(
         return None, displayable_data
 
 
-def get_dropdown_options(data):
+def get_dropdown_options(data, countries=None, states=None):
+    """
+    The options of the metric and entity pickers. Once countries or states
+    are picked, the state and county pickers only offer the entities under
+    them.
+    """
     options = {}
-    all_entities = processing_utils.get_all_entities(data.CovidDf.dataframes)
-    # country_to_state = processing_utils.get_countries_to_states(
-    #     raw_global_df, us_states_testing_df
-    # )
-    # state_to_county = processing_utils.get_states_to_counties(us_county_df)
-
-    hierarchy = processing_utils.create_hierarchy(all_entities)
+    catalog = data.entity_catalog
+    hierarchy = processing_utils.create_hierarchy(catalog.entities)
+
+    if countries:
+        hierarchy[processing_utils.STATE_COL] = catalog.get_children_of(
+            processing_utils.COUNTRY_COL, countries
+        )
+
+    if states:
+        hierarchy[processing_utils.COUNTY_COL] = catalog.get_children_of(
+            processing_utils.STATE_COL, states
+        )
+    elif countries:
+        hierarchy[processing_utils.COUNTY_COL] = catalog.get_children_of(
+            processing_utils.STATE_COL, hierarchy[processing_utils.STATE_COL]
+        )
 
     options[processing_utils.MEASUREMENT_COL] = processing_utils.METRIC_COLS
     options[processing_utils.ENTITY_COL] = hierarchy
@@ -59,6 +191,37 @@ def get_dropdown_options(data):
     return options
 
 
+def get_county_states(data):
+    """
+    The states whose counties the county picker can browse, in display order.
+    """
+    catalog = data.entity_catalog
+
+    return [
+        state
+        for state in catalog.entities[processing_utils.STATE_COL]
+        if len(catalog.get_children(processing_utils.STATE_COL, state)) > 0
+    ]
+
+
+def get_county_options(data, states, selected_counties):
+    """
+    The options of the hierarchical county picker: the counties already
+    picked, then the counties of `states`. Only these are sent to the
+    browser, rather than every county.
+    """
+    counties = data.entity_catalog.get_children_of(processing_utils.STATE_COL, states)
+
+    return list(dict.fromkeys(list(selected_counties) + counties))
+
+
+def search_entities(data, entity_col, query, limit=20, prefix=False):
+    """
+    The entities of `entity_col` matching a typed query, for typeahead.
+    """
+    return data.entity_catalog.search(entity_col, query, limit=limit, prefix=prefix)
+
+
 def generate_data_fetch_request(
     metrics,
     countries,
@@ -67,11 +230,13 @@ def generate_data_fetch_request(
     overlay_applied,
     overlay_metric,
     overlay_threshold,
+    days_since_threshold=False,
 ):
     request = {}
 
     request["threshold_metric"] = overlay_metric if overlay_applied else None
     request["threshold_val"] = overlay_threshold if overlay_applied else None
+    request["days_since_threshold"] = overlay_applied and days_since_threshold
     request["filter_dict"] = {}
     request["entities"] = []
     request["metrics"] = metrics
@@ -101,7 +266,7 @@ def is_valid_data_fetch_request(request):
         or "metrics" not in request
         or "threshold_metric" not in request
         or "threshold_val" not in request
-        or len(request) > 5
+        or len(set(request) - {"days_since_threshold"}) > 5
     ):
         return False
 
@@ -112,83 +277,118 @@ def is_valid_data_fetch_request(request):
     )
 
 
-def fetch_streamlit_raw_data_display(displayable_data):
-    entities_to_metrics_to_dataframes = {}
-    for metric, df in displayable_data.items():
-        entities = df[processing_utils.ENTITY_COL].unique().tolist()
-
-        for entity in entities:
-            rows = df[df[processing_utils.ENTITY_COL] == entity]
-
-            if len(rows) > 0:
-                if entity not in entities_to_metrics_to_dataframes:
-                    entities_to_metrics_to_dataframes[entity] = {}
+def get_x_col(df):
+    if processing_utils.DAYS_SINCE_THRESHOLD_COL in df.columns:
+        return processing_utils.DAYS_SINCE_THRESHOLD_COL
 
-                if metric not in entities_to_metrics_to_dataframes[entity]:
-                    entities_to_metrics_to_dataframes[entity][metric] = []
+    return processing_utils.DATE_COL
 
-                entities_to_metrics_to_dataframes[entity][metric].append(rows)
 
-    entity_to_df = {}
-    entity_to_metric_to_boxplots = {}
+def get_summary_stats(data_obj, request):
+    """
+    The rate of change statistics precomputed at set up, or None when they
+    do not hold for the request: a threshold leaves out the days before it.
+    """
+    if request["threshold_val"] is not None and request["threshold_metric"] is not None:
+        return None
 
-    for entity, metric_dict in entities_to_metrics_to_dataframes.items():
-        entity_to_df[entity] = []
-
-        for metric, list_of_dfs in metric_dict.items():
-            df = pd.concat(list_of_dfs)
-
-            if processing_utils.DELTA_COL_SUFFIX in metric:
-                entity_to_metric_to_boxplots[entity] = {}
-                entity_to_metric_to_boxplots[entity][metric] = {}
-                last_week = df.sort_values(
-                    by=processing_utils.DATE_COL, ascending=False
-                ).head(7)
-
-                entity_to_metric_to_boxplots[entity][metric]["Historic"] = {
-                    "max": df[processing_utils.MEASUREMENT_COL].max(),
-                    "nonzero-min": df[df[processing_utils.MEASUREMENT_COL] > 0][
-                        processing_utils.MEASUREMENT_COL
-                    ].min()
-                    if not math.isnan(
-                        df[df[processing_utils.MEASUREMENT_COL] > 0][
-                            processing_utils.MEASUREMENT_COL
-                        ].min()
-                    )
-                    else 0.0,
-                    "mean": df[processing_utils.MEASUREMENT_COL].mean(),
-                }
-
-                entity_to_metric_to_boxplots[entity][metric]["Within the last week"] = {
-                    "max": last_week[processing_utils.MEASUREMENT_COL].max(),
-                    "nonzero-min": last_week[
-                        last_week[processing_utils.MEASUREMENT_COL] > 0
-                    ][processing_utils.MEASUREMENT_COL].min()
-                    if not math.isnan(
-                        last_week[last_week[processing_utils.MEASUREMENT_COL] > 0][
-                            processing_utils.MEASUREMENT_COL
-                        ].min()
-                    )
-                    else 0.0,
-                    "mean": last_week[processing_utils.MEASUREMENT_COL].mean(),
-                    "number of days": len(last_week),
-                }
+    return data_obj.summary_stats
 
-            columned = df[
-                [processing_utils.DATE_COL, processing_utils.MEASUREMENT_COL]
-            ].copy()
 
-            columned.rename(
-                columns={processing_utils.MEASUREMENT_COL: metric}, inplace=True
-            )
+def fetch_streamlit_raw_data_display(displayable_data, summary_stats=None):
+    """
+    Builds the Data panel: a table of every entity's metrics, latest first,
+    and the statistics of its rate of change metrics. The statistics are
+    looked up in `summary_stats`, keyed by (entity, metric), when given, and
+    computed from the results for the entities it does not have.
+    """
+    metric_dfs = {metric: df for metric, df in displayable_data.items() if len(df) > 0}
+    if len(metric_dfs) == 0:
+        return {}, {}
 
-            entity_to_df[entity].append(columned)
+    x_col = get_x_col(next(iter(metric_dfs.values())))
 
-        entity_to_df[entity] = reduce(
+    # metric -> entity -> positions of the entity's rows, in their order
+    metric_to_positions = {
+        metric: df.groupby(processing_utils.ENTITY_COL, sort=False).indices
+        for metric, df in metric_dfs.items()
+    }
+    entities = dict.fromkeys(
+        chain.from_iterable(metric_to_positions[metric] for metric in metric_dfs)
+    )
+    entity_to_metrics = {
+        entity: [
+            metric for metric in metric_dfs if entity in metric_to_positions[metric]
+        ]
+        for entity in entities
+    }
+
+    # All the entities are lined up by x value at once. Outer merges keep
+    # integer metrics integers, which a pivot would turn into floats
+    if any(len(metrics) > 1 for metrics in entity_to_metrics.values()):
+        merged = reduce(
             lambda left, right: pd.merge(
-                left, right, on=processing_utils.DATE_COL, how="outer"
+                left, right, on=[processing_utils.ENTITY_COL, x_col], how="outer"
             ),
-            entity_to_df[entity],
-        ).sort_values(by=processing_utils.DATE_COL, ascending=False)
+            [
+                df[
+                    [
+                        processing_utils.ENTITY_COL,
+                        x_col,
+                        processing_utils.MEASUREMENT_COL,
+                    ]
+                ].rename(columns={processing_utils.MEASUREMENT_COL: metric})
+                for metric, df in metric_dfs.items()
+            ],
+        )
+        merged_positions = merged.groupby(
+            processing_utils.ENTITY_COL, sort=False
+        ).indices
+
+    entity_to_df = {}
+    entity_to_metric_to_boxplots = {}
+    metric_to_stats = {}
+
+    for entity, metrics in entity_to_metrics.items():
+        if len(metrics) == 1:
+            metric = metrics[0]
+            df = metric_dfs[metric].iloc[metric_to_positions[metric][entity]]
+            df = df[[x_col, processing_utils.MEASUREMENT_COL]].rename(
+                columns={processing_utils.MEASUREMENT_COL: metric}
+            )
+        else:
+            df = merged.iloc[merged_positions[entity]][[x_col] + metrics]
+            df = df.reset_index(drop=True)
+
+            # Only the entity's own missing days make a column float
+            for metric in metrics:
+                dtype = metric_dfs[metric][processing_utils.MEASUREMENT_COL].dtype
+                if df[metric].dtype != dtype and not df[metric].isna().any():
+                    df[metric] = df[metric].astype(dtype)
+
+        entity_to_df[entity] = df.sort_values(by=x_col, ascending=False)
+
+        rate_metrics = [
+            metric for metric in metrics if processing_utils.DELTA_COL_SUFFIX in metric
+        ]
+        if len(rate_metrics) > 0:
+            # An entity shows the statistics of its last rate of change metric
+            metric = rate_metrics[-1]
+            stats = None
+            if summary_stats is not None:
+                stats = summary_stats.get((entity, metric))
+
+            if stats is None:
+                if metric not in metric_to_stats:
+                    metric_to_stats[metric] = processing_utils.get_stats_lookup(
+                        processing_utils.describe_rate_of_change(
+                            metric_dfs[metric], x_col
+                        )
+                    )
+                stats = metric_to_stats[metric][entity]
+
+            entity_to_metric_to_boxplots[entity] = {
+                metric: {period: dict(values) for period, values in stats.items()}
+            }
 
     return entity_to_df, entity_to_metric_to_boxplots
@@ -0,0 +1,106 @@
+import threading
+import time
+
+from utils.site_data_abstraction import Data
+
+# Refreshes kept for reporting
+MAX_REFRESHES = 20
+# Seconds before a failed refresh is tried again
+RETRY_SECONDS = 300
+
+
+class DatasetHolder:
+    """
+    The dataset shared by every session of the process.
+
+    The first request builds it and every concurrent request waits for that
+    one build. Afterwards, once the data asks to be updated, a request starts
+    a refresh in a background thread and keeps getting the previous
+    generation until the new one is ready; the new one is then swapped in at
+    once. A failed refresh keeps the previous generation, and is tried again
+    after `retry_seconds`.
+    """
+
+    def __init__(self, build=Data, retry_seconds=RETRY_SECONDS):
+        self.build = build
+        self.retry_seconds = retry_seconds
+        self.data = None
+        self.thread = None
+        # The last refreshes as (start time, seconds, error or None)
+        self.refreshes = []
+        self.refresh_count = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns the current data, waiting only when there is none yet.
+        """
+        with self.lock:
+            data = self.data
+            if self.thread is None and (data is None or self.is_due(data)):
+                self.thread = threading.Thread(target=self.refresh, daemon=True)
+                self.thread.start()
+            thread = self.thread
+
+        if data is not None:
+            return data
+
+        thread.join()
+        with self.lock:
+            if self.data is None:
+                raise self.refreshes[-1][2]
+
+            return self.data
+
+    def is_due(self, data):
+        if len(self.refreshes) > 0 and self.refreshes[-1][2] is not None:
+            start, duration, _ = self.refreshes[-1]
+            if time.time() < start + duration + self.retry_seconds:
+                return False
+
+        return data.should_update()
+
+    def refresh(self):
+        start = time.time()
+        data = None
+        error = None
+
+        try:
+            data = self.build()
+        except Exception as e:
+            error = e
+
+        duration = time.time() - start
+
+        with self.lock:
+            if error is None:
+                self.data = data
+                print("Refreshed data in {:.2f}s".format(duration))
+            else:
+                self.failures += 1
+                print(
+                    "Failed to refresh data after {:.2f}s: {!r}".format(duration, error)
+                )
+
+            self.refreshes.append((start, duration, error))
+            del self.refreshes[:-MAX_REFRESHES]
+            self.refresh_count += 1
+            self.thread = None
+
+    def stats(self):
+        with self.lock:
+            last = self.refreshes[-1] if len(self.refreshes) > 0 else None
+
+            return {
+                "generation": None if self.data is None else self.data.generation,
+                "refreshing": self.thread is not None,
+                "refreshes": self.refresh_count,
+                "failures": self.failures,
+                "last_duration": None if last is None else last[1],
+                "last_error": None if last is None else last[2],
+            }
+
+
+# One holder per process, shared by the sessions of the app
+SHARED_DATA = DatasetHolder()
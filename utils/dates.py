@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+# The format dates are displayed with
+DATE_FORMAT = "%Y-%m-%d"
+# The dtype of parsed date columns
+DATE_DTYPE = "datetime64[ns]"
+
+
+def parse_dates(values, date_format=None):
+    """
+    Converts a column of dates (strings, yyyymmdd integers or timestamps) to
+    datetime64 values at midnight. Each distinct value is parsed only once.
+    Timezone-aware timestamps are converted to UTC first.
+    """
+    values = pd.Series(values)
+
+    if values.dtype.kind == "M" and getattr(values.dt, "tz", None) is None:
+        return values.dt.normalize().astype("datetime64[ns]")
+
+    codes, uniques = pd.factorize(values)
+    parsed = pd.to_datetime(pd.Index(uniques).astype(str), format=date_format)
+
+    if parsed.tz is not None:
+        parsed = parsed.tz_convert("UTC").tz_localize(None)
+
+    parsed = np.asarray(parsed.normalize(), dtype="datetime64[ns]")
+    # Code -1 (missing) picks the trailing NaT
+    parsed = np.append(parsed, np.datetime64("NaT", "ns"))
+
+    return pd.Series(parsed.take(codes), index=values.index)
+
+
+def format_dates(values, date_format=DATE_FORMAT):
+    """
+    Converts a column of datetime64 values to display strings, formatting
+    each distinct date only once. Missing dates become NaN.
+    """
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+
+    strings = np.empty(len(uniques) + 1, dtype=object)
+    strings[:-1] = pd.DatetimeIndex(uniques).strftime(date_format)
+    strings[-1] = np.nan
+
+    return pd.Series(strings.take(codes), index=values.index, dtype=object)
@@ -0,0 +1,207 @@
+"""
+The entities offered by the selectors, with an index to search them as the
+user types.
+
+Names are matched case-insensitively. Every substring of up to three
+characters of every name maps to the sorted positions of the names that
+contain it, so a query of up to three characters is one lookup. Longer
+queries intersect the positions of their trigrams, which leaves few names to
+check for the whole query. Prefix queries bisect the sorted names instead.
+
+The catalog also links every state to its country and every county to its
+state, for pickers that only offer the children of the selected parents.
+"""
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from utils import processing_utils
+
+# The longest substrings indexed
+NGRAM = 3
+
+EMPTY_POSITIONS = np.empty(0, dtype=np.int32)
+
+
+def build_ngram_index(folded_names, n=NGRAM):
+    """
+    Maps every substring of up to `n` characters of the names to the
+    positions of the names that contain it, in increasing order.
+    """
+    index = {}
+    for position, name in enumerate(folded_names):
+        grams = {
+            name[start : start + size]
+            for size in range(1, n + 1)
+            for start in range(len(name) - size + 1)
+        }
+        for gram in grams:
+            index.setdefault(gram, []).append(position)
+
+    return {
+        gram: np.array(positions, dtype=np.int32) for gram, positions in index.items()
+    }
+
+
+def get_label_parents(names):
+    """
+    The parent named by each "Name (Parent)" label, or the name itself for
+    labels without a parent.
+    """
+    names = pd.Series(names, dtype=object)
+
+    return names.str.extract(r"\(([^)]*)\)", expand=False).fillna(names)
+
+
+def build_entity_hierarchy(dataframes, entities):
+    """
+    Maps each entity column but the coarsest to {entity: parent}, the
+    parent being an entity of the next coarser column.
+
+    Frames holding both columns link them directly, when the parent is one
+    of the entities of its column. Other entities are linked through their
+    labels: "Kent (Maryland)" is a child of the state labelled "Maryland",
+    or of the only state named "Maryland (...)". A label without a parent,
+    like "Guam", links to the parent of that name.
+    """
+    parents = {col: {} for col in processing_utils.ENTITY_COLS[1:]}
+    levels = list(zip(processing_utils.ENTITY_COLS, processing_utils.ENTITY_COLS[1:]))
+
+    for df in dataframes:
+        for parent_col, child_col in levels:
+            if parent_col in df.columns and child_col in df.columns:
+                links = df[[child_col, parent_col]].dropna().drop_duplicates()
+                links = links[links[parent_col].isin(entities[parent_col])]
+                for child, parent in zip(
+                    links[child_col].tolist(), links[parent_col].tolist()
+                ):
+                    parents[child_col].setdefault(child, parent)
+
+    for parent_col, child_col in levels:
+        parent_names = pd.Series(entities[parent_col], dtype=object)
+        base_names = parent_names.str.replace(r" \(.*$", "", regex=True)
+
+        # Names shared by several parents, like "Punjab", are ambiguous
+        unique = ~base_names.duplicated(keep=False)
+        lookup = dict(zip(base_names[unique], parent_names[unique]))
+        lookup.update(zip(parent_names, parent_names))
+
+        children = entities[child_col]
+        for child, parent in zip(
+            children, get_label_parents(children).map(lookup).tolist()
+        ):
+            if isinstance(parent, str):
+                parents[child_col].setdefault(child, parent)
+
+    return parents
+
+
+class EntityCatalog:
+    """
+    The entities of each entity column in display order, built once per data
+    generation, and searchable by substring or by prefix.
+    """
+
+    def __init__(self, entities, parents=None):
+        # {entity column: names in display order}
+        self.entities = entities
+        # {entity column: {entity: parent}} and
+        # {parent column: {parent: children in display order}}
+        self.parents = parents or {}
+        self.children = {}
+        for parent_col, child_col in zip(
+            processing_utils.ENTITY_COLS, processing_utils.ENTITY_COLS[1:]
+        ):
+            child_to_parent = self.parents.get(child_col, {})
+            self.children[parent_col] = {}
+            for child in entities.get(child_col, []):
+                if child in child_to_parent:
+                    self.children[parent_col].setdefault(
+                        child_to_parent[child], []
+                    ).append(child)
+
+        self.folded = {}
+        self.ngrams = {}
+        # {entity column: (sorted folded names, their display positions)}
+        self.prefixes = {}
+
+        for col, names in entities.items():
+            folded = [name.casefold() for name in names]
+            order = sorted(range(len(folded)), key=folded.__getitem__)
+
+            self.folded[col] = folded
+            self.ngrams[col] = build_ngram_index(folded)
+            self.prefixes[col] = (
+                [folded[i] for i in order],
+                np.array(order, dtype=np.int32),
+            )
+
+    def get_positions(self, entity_col, query, prefix=False):
+        if query == "":
+            return np.arange(len(self.entities[entity_col]))
+
+        if prefix:
+            sorted_names, order = self.prefixes[entity_col]
+            start = bisect_left(sorted_names, query)
+            end = bisect_left(sorted_names, query[:-1] + chr(ord(query[-1]) + 1))
+            return np.sort(order[start:end])
+
+        ngrams = self.ngrams[entity_col]
+        if len(query) <= NGRAM:
+            return ngrams.get(query, EMPTY_POSITIONS)
+
+        postings = sorted(
+            (
+                ngrams.get(query[start : start + NGRAM], EMPTY_POSITIONS)
+                for start in range(len(query) - NGRAM + 1)
+            ),
+            key=len,
+        )
+        candidates = postings[0]
+        for positions in postings[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, positions, assume_unique=True)
+
+        folded = self.folded[entity_col]
+        return [position for position in candidates if query in folded[position]]
+
+    def get_parent(self, entity_col, name):
+        return self.parents.get(entity_col, {}).get(name)
+
+    def get_children(self, entity_col, name):
+        """
+        The entities of the next finer column under `name`, in display order.
+        """
+        return self.children.get(entity_col, {}).get(name, [])
+
+    def get_children_of(self, entity_col, names):
+        """
+        The children of any of `names`, following the display order of the
+        parents.
+        """
+        names = set(names)
+
+        return [
+            child
+            for parent in self.entities[entity_col]
+            if parent in names
+            for child in self.get_children(entity_col, parent)
+        ]
+
+    def search(self, entity_col, query, limit=None, prefix=False):
+        """
+        The names of `entity_col` that contain `query`, or start with it when
+        `prefix` is set, in display order.
+        """
+        positions = self.get_positions(entity_col, query.casefold(), prefix=prefix)
+        names = self.entities[entity_col]
+
+        return [names[position] for position in positions[:limit]]
+
+
+def build_entity_catalog(dataframes):
+    entities = processing_utils.get_all_entities(dataframes)
+
+    return EntityCatalog(entities, build_entity_hierarchy(dataframes, entities))
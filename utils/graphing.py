@@ -1,12 +1,20 @@
 import numpy as np
-import pandas as pd
-import altair as alt
 
 from utils import processing_utils
 
 
 def build_chart(source, is_log=True):
-    x_col_str_label = processing_utils.DATE_COL + ":T"
+    # altair is only needed once a chart is drawn, so it is kept out of the
+    # app's startup imports
+    import altair as alt
+
+    # Overlays aligned on days since the threshold have an integer x-axis
+    if processing_utils.DAYS_SINCE_THRESHOLD_COL in source.columns:
+        x_col = processing_utils.DAYS_SINCE_THRESHOLD_COL
+        x_col_str_label = x_col + ":Q"
+    else:
+        x_col = processing_utils.DATE_COL
+        x_col_str_label = x_col + ":T"
 
     if is_log:
         value_col = processing_utils.MEASUREMENT_COL + " (log)"
@@ -28,7 +36,7 @@ def build_chart(source, is_log=True):
         type="single",
         nearest=True,
         on="mouseover",
-        fields=[processing_utils.DATE_COL],
+        fields=[x_col],
         empty="none",
     )
 
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+MIRROR_DIR = DIR_PATH + "/data/mirror/"
+
+# Response statuses recorded in the metadata of every mirrored url
+DOWNLOADED = "downloaded"
+NOT_MODIFIED = "not-modified"
+STALE = "stale"
+
+
+def replace_file(path, data, mode):
+    # A uniquely named temporary file, so processes sharing the mirror never
+    # write into each other's copy before it is moved into place
+    with tempfile.NamedTemporaryFile(
+        mode=mode, dir=os.path.dirname(path), suffix=".tmp", delete=False
+    ) as f:
+        f.write(data)
+    os.replace(f.name, path)
+
+
+class HttpMirror:
+    """
+    Keeps a local copy of every url fetched through it, and revalidates that
+    copy with ETag / If-Modified-Since on the next fetch. An unchanged source
+    costs a single 304 round trip and is read back from disk.
+    """
+
+    def __init__(self, mirror_dir=MIRROR_DIR, pool_size=8, timeout=60):
+        self.mirror_dir = mirror_dir
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip"
+
+    def get_paths(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return (
+            os.path.join(self.mirror_dir, key + ".body"),
+            os.path.join(self.mirror_dir, key + ".json"),
+        )
+
+    def read_metadata(self, url):
+        body_path, meta_path = self.get_paths(url)
+
+        if not os.path.exists(body_path) or not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def read_body(self, url):
+        body_path, _ = self.get_paths(url)
+
+        with open(body_path, "rb") as f:
+            return f.read()
+
+    def write(self, url, content=None, metadata=None):
+        body_path, meta_path = self.get_paths(url)
+        os.makedirs(self.mirror_dir, exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial copy
+        if content is not None:
+            replace_file(body_path, content, "wb")
+
+        if metadata is not None:
+            replace_file(meta_path, json.dumps(metadata), "w")
+
+    def update_status(self, url, metadata, status):
+        metadata["status"] = status
+        metadata["checked_at"] = time.time()
+        self.write(url, metadata=metadata)
+
+    def fetch(self, url):
+        """
+        Returns the body of the url, from the local mirror when the server
+        says it is unchanged. Falls back to the mirrored copy when the server
+        cannot be reached or answers with an error.
+        """
+        metadata = self.read_metadata(url)
+
+        headers = {}
+        if metadata is not None:
+            if metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+
+        try:
+            r = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            if metadata is None:
+                raise
+
+            print("Could not reach {}, using mirrored copy".format(url))
+            print(e)
+            self.update_status(url, metadata, STALE)
+            return self.read_body(url)
+
+        if r.status_code == 304:
+            if metadata is None:
+                raise requests.HTTPError(
+                    "{} answered 304 but there is no mirrored copy".format(url),
+                    response=r,
+                )
+
+            print("{} is unchanged".format(url))
+            self.update_status(url, metadata, NOT_MODIFIED)
+            return self.read_body(url)
+
+        try:
+            r.raise_for_status()
+        except requests.HTTPError as e:
+            if metadata is None:
+                raise
+
+            print("{} answered {}, using mirrored copy".format(url, r.status_code))
+            print(e)
+            self.update_status(url, metadata, STALE)
+            return self.read_body(url)
+
+        content = r.content
+        self.write(
+            url,
+            content,
+            {
+                "url": url,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "sha256": hashlib.sha256(content).hexdigest(),
+                "size": len(content),
+                "status": DOWNLOADED,
+                "checked_at": time.time(),
+            },
+        )
+
+        return content
+
+    def get_version(self, url):
+        """
+        An identifier of the mirrored copy of the url, which changes whenever
+        its content does.
+        """
+        metadata = self.read_metadata(url)
+
+        if metadata is None:
+            return None
+
+        return metadata["sha256"]
@@ -0,0 +1,126 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+import pandas as pd
+
+# Stages are either network bound (run on threads) or pandas bound (run in
+# worker processes so they are not serialized by the GIL).
+IO_STAGE = "io"
+CPU_STAGE = "cpu"
+
+
+class IngestionError(Exception):
+    """
+    Raised when one of the ingestion stages fails. The remaining stages are
+    cancelled, so a broken source never leaves a half-built Data object.
+    """
+
+    def __init__(self, stage, error):
+        super().__init__("Ingestion stage '{}' failed: {!r}".format(stage, error))
+        self.stage = stage
+        self.error = error
+
+
+def run_timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def copy_frames(arg):
+    if isinstance(arg, pd.DataFrame):
+        return arg.copy()
+
+    if isinstance(arg, tuple):
+        return tuple(copy_frames(a) for a in arg)
+
+    return arg
+
+
+def run_stages_sequentially(stages):
+    """
+    Runs a list of (name, function, dependencies, kind) stages in order. Every
+    stage must come after its dependencies.
+    """
+    results = {}
+    timings = OrderedDict()
+
+    for name, function, dependencies, _ in stages:
+        args = [copy_frames(results[dep]) for dep in dependencies]
+
+        try:
+            results[name], timings[name] = run_timed(function, *args)
+        except Exception as e:
+            raise IngestionError(name, e) from e
+
+        print("Finished {} in {:.2f}s".format(name, timings[name]))
+
+    return results, timings
+
+
+def run_stages_in_parallel(stages, max_workers=None):
+    """
+    Runs every stage as soon as its dependencies are available: downloads on a
+    thread pool, post-processing on a process pool. Arguments sent to a
+    worker process are pickled, so they are already copies.
+
+    On failure, the pools are shut down without waiting for stages that are
+    still running, so the error surfaces as soon as it happens.
+    """
+    results = {}
+    timings = OrderedDict()
+    pending = list(stages)
+    running = {}
+
+    io_pool = ThreadPoolExecutor(
+        max_workers=len([s for s in stages if s[3] == IO_STAGE]) or 1
+    )
+    cpu_pool = ProcessPoolExecutor(max_workers=max_workers)
+
+    try:
+        while pending or running:
+            for stage in list(pending):
+                name, function, dependencies, kind = stage
+                if all(dep in results for dep in dependencies):
+                    pool = io_pool if kind == IO_STAGE else cpu_pool
+                    args = [results[dep] for dep in dependencies]
+                    running[pool.submit(run_timed, function, *args)] = name
+                    pending.remove(stage)
+
+            if not running:
+                raise ValueError(
+                    "Stages with unmet dependencies: {}".format(
+                        [stage[0] for stage in pending]
+                    )
+                )
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+
+                try:
+                    results[name], timings[name] = future.result()
+                except Exception as e:
+                    raise IngestionError(name, e) from e
+
+                print("Finished {} in {:.2f}s".format(name, timings[name]))
+    except BaseException:
+        # shutdown() only takes cancel_futures from Python 3.9: cancel the
+        # stages that have not started ourselves
+        for future in running:
+            future.cancel()
+        io_pool.shutdown(wait=False)
+        cpu_pool.shutdown(wait=False)
+        raise
+
+    io_pool.shutdown(wait=True)
+    cpu_pool.shutdown(wait=True)
+
+    return results, timings
@@ -1,18 +1,213 @@
+import hashlib
+import json
 import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+import numpy as np
 import pandas as pd
 
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
-JHU_CSV_PATH = DIR_PATH + "/data/jhu.csv"
+CACHE_DIR = DIR_PATH + "/data/cache/"
+# Bump when the layout of the cache files changes
+CACHE_FORMAT_VERSION = 1
+
+# How each column is stored: as a raw .npy array, or as int32 codes into a
+# JSON list of strings (object and categorical columns)
+VALUES_KIND = "values"
+STRINGS_KIND = "strings"
+CATEGORY_KIND = "category"
+
+
+def get_schema_hash(columns, dtypes, schema_version=None):
+    schema = [CACHE_FORMAT_VERSION, schema_version, list(zip(columns, dtypes))]
+    return hashlib.sha256(json.dumps(schema).encode("utf-8")).hexdigest()
+
+
+def get_frame_dir(name):
+    return os.path.join(CACHE_DIR, name)
+
+
+def read_manifest(name):
+    """
+    Returns the manifest of a cached frame, or None when it is not cached.
+    """
+    path = os.path.join(get_frame_dir(name), "manifest.json")
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_frame(name, df, source_version, schema_version=None, extra=None):
+    """
+    Saves a frame as one .npy file per column, with a manifest recording the
+    source version it was built from, a hash of its schema and its build
+    time. The files are written to a fresh directory that replaces the old
+    one, so readers never mix columns from two builds.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    build_dir = tempfile.mkdtemp(dir=CACHE_DIR, prefix=name + ".")
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        entry = {"name": col, "dtype": str(series.dtype), "file": "{}.npy".format(i)}
+
+        if str(series.dtype) == "category":
+            entry["kind"] = CATEGORY_KIND
+            codes = series.cat.codes.to_numpy().astype(np.int32)
+            categories = series.cat.categories.tolist()
+        elif series.dtype.kind in "biufcmM":
+            entry["kind"] = VALUES_KIND
+            codes = series.to_numpy()
+            categories = None
+        else:
+            entry["kind"] = STRINGS_KIND
+            codes, uniques = pd.factorize(series)
+            codes = codes.astype(np.int32)
+            categories = uniques.tolist()
+
+        np.save(os.path.join(build_dir, entry["file"]), codes, allow_pickle=False)
+        if categories is not None:
+            entry["categories"] = "{}.json".format(i)
+            with open(os.path.join(build_dir, entry["categories"]), "w") as f:
+                json.dump(categories, f)
+
+        columns.append(entry)
+
+    manifest = {
+        "name": name,
+        "format_version": CACHE_FORMAT_VERSION,
+        "source_version": source_version,
+        "schema_hash": get_schema_hash(
+            [c["name"] for c in columns], [c["dtype"] for c in columns], schema_version
+        ),
+        "built_at": time.time(),
+        "rows": len(df),
+        "columns": columns,
+        "extra": extra or {},
+    }
+    with open(os.path.join(build_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+    frame_dir = get_frame_dir(name)
+    old_dir = None
+    if os.path.exists(frame_dir):
+        old_dir = tempfile.mkdtemp(dir=CACHE_DIR, prefix=name + ".old.")
+        os.rmdir(old_dir)
+        os.replace(frame_dir, old_dir)
+    os.replace(build_dir, frame_dir)
+
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def get_cached_dtype(entry):
+    # Text columns are stored the same way whatever their pandas dtype
+    return "object" if entry["kind"] == STRINGS_KIND else entry["dtype"]
+
+
+def matches_schema(manifest, schema):
+    """
+    Whether a cached frame holds the columns of `schema` and no others, a
+    {column: dtype} where text columns are "object". A column may list a
+    tuple of the dtypes it can have, None meaning it may be missing.
+    """
+    dtypes = {c["name"]: get_cached_dtype(c) for c in manifest["columns"]}
+
+    if not set(dtypes) <= set(schema):
+        return False
+
+    return all(
+        dtypes.get(col) in (dtype if isinstance(dtype, tuple) else (dtype,))
+        for col, dtype in schema.items()
+    )
+
+
+def is_stale(manifest, source_version, schema_version=None, schemas=None):
+    if manifest is None or manifest.get("format_version") != CACHE_FORMAT_VERSION:
+        return True
+
+    if source_version is not None and manifest["source_version"] != source_version:
+        return True
+
+    expected_hash = get_schema_hash(
+        [c["name"] for c in manifest["columns"]],
+        [c["dtype"] for c in manifest["columns"]],
+        schema_version,
+    )
+    if manifest["schema_hash"] != expected_hash:
+        return True
+
+    # The hash only tells the schema version apart: the columns themselves
+    # are checked against the schemas the caller expects
+    return schemas is not None and not any(
+        matches_schema(manifest, schema) for schema in schemas
+    )
+
+
+def load_frame(name, source_version=None, schema_version=None, schemas=None, mmap=True):
+    """
+    Loads a cached frame, or returns None when it is missing, was built from
+    another source version or schema version, does not match any of
+    `schemas`, or is unreadable. Numeric columns are memory mapped rather
+    than parsed.
+    """
+    manifest = read_manifest(name)
+
+    if is_stale(manifest, source_version, schema_version, schemas):
+        return None
+
+    frame_dir = get_frame_dir(name)
+    data = {}
+
+    try:
+        for entry in manifest["columns"]:
+            values = np.load(
+                os.path.join(frame_dir, entry["file"]),
+                mmap_mode="r" if mmap else None,
+                allow_pickle=False,
+            )
+
+            if entry["kind"] == VALUES_KIND:
+                data[entry["name"]] = pd.Series(values, dtype=entry["dtype"])
+                continue
+
+            with open(os.path.join(frame_dir, entry["categories"])) as f:
+                categories = json.load(f)
 
+            if entry["kind"] == CATEGORY_KIND:
+                data[entry["name"]] = pd.Series(
+                    pd.Categorical.from_codes(np.asarray(values), categories)
+                )
+            else:
+                labels = np.array(categories + [np.nan], dtype=object)
+                # Code -1 (missing) picks the trailing NaN
+                data[entry["name"]] = pd.Series(
+                    labels.take(np.asarray(values)), dtype=entry["dtype"]
+                )
+    except (OSError, ValueError, KeyError) as e:
+        print("Could not load cached {}".format(name))
+        print(e)
+        return None
 
-def read_csv(option):
-    path = ""
-    if option == "JHU":
-        path = JHU_CSV_PATH
+    df = pd.DataFrame(data, columns=[c["name"] for c in manifest["columns"]])
+    if len(df) != manifest["rows"]:
+        return None
 
-    return pd.read_csv(path)
+    return df
 
 
-def save_csv(option, df):
-    if option == "JHU":
-        df.to_csv(JHU_CSV_PATH)
+def read_csv_from_zip(zip_path, member, usecols=None, dtype=None):
+    """
+    Parses a CSV member of a zip archive while it is being decompressed, so
+    no extracted copy is ever written to disk.
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        with archive.open(member) as f:
+            return pd.read_csv(f, usecols=usecols, dtype=dtype)
@@ -1,13 +1,17 @@
-import datetime
+import hashlib
 import numpy as np
 import pandas as pd
-from functools import cmp_to_key
+from io import BytesIO
 from itertools import chain
+from utils import dates
 from utils import io_utils
-import os.path
-from os import path
 from collections import OrderedDict
 
+# Bump whenever the output of the post processing changes, so frames cached
+# by io_utils are rebuilt
+SCHEMA_VERSION = 3
+JHU_CACHE_NAME = "us_county_df"
+
 CATEGORY_GRAPHING_COL = "Data"
 
 DATE_COL = "Date"
@@ -25,6 +29,8 @@ DELTA_COL_SUFFIX = " Daily Increase"
 ENTITY_COL = "Entity"
 MEASUREMENT_COL = "Value"
 DELTA_PERCENT_COL_SUFFIX = " Daily Increase(%)"
+# The x-axis of overlays aligned on the day each entity reached the threshold
+DAYS_SINCE_THRESHOLD_COL = "Days since threshold"
 CUM_ICU_COL = "ICU (cumulative)"
 CUM_VENTILATOR_COL = "Ventilator (cumulative)"
 CURR_ICU_COL = "ICU (current)"
@@ -55,6 +61,20 @@ METRIC_COLS = sorted(MEASUREMENT_COLS + METRIC_DELTA_COLS + METRIC_PERCENT_CHANG
 
 ENTITY_COLS = [COUNTRY_COL, STATE_COL, COUNTY_COL]
 
+# The statistics of rate of change metrics, as (period, statistic)
+HISTORIC_PERIOD = "Historic"
+LAST_WEEK_PERIOD = "Within the last week"
+LAST_WEEK_DAYS = 7
+RATE_OF_CHANGE_STATS = [
+    (HISTORIC_PERIOD, "max"),
+    (HISTORIC_PERIOD, "nonzero-min"),
+    (HISTORIC_PERIOD, "mean"),
+    (LAST_WEEK_PERIOD, "max"),
+    (LAST_WEEK_PERIOD, "nonzero-min"),
+    (LAST_WEEK_PERIOD, "mean"),
+    (LAST_WEEK_PERIOD, "number of days"),
+]
+
 ENTITY_TO_PURE_METRICS = {
     COUNTRY_COL: [DEATHS_COL, CONFIRMED_COL, RECOVERED_COL],
     "International Provinces": [DEATHS_COL, CONFIRMED_COL, RECOVERED_COL],
@@ -176,6 +196,44 @@ class CovidDF:
         pass
 
 
+def build_labels(make_label, *columns):
+    """
+    Builds one label per row from the values of `columns`, calling
+    `make_label` once per distinct combination of values rather than once per
+    row. The labels are broadcast back to the rows through the combination
+    codes. Rows with a missing value in any of the columns get NaN.
+    """
+    keys = np.zeros(len(columns[0]), dtype=np.int64)
+    all_uniques = []
+
+    for column in columns:
+        # Missing values get code -1, stored as 0 in the combined key
+        codes, uniques = pd.factorize(column)
+        keys = keys * (len(uniques) + 1) + (codes + 1)
+        all_uniques.append(np.asarray(uniques, dtype=object))
+
+    distinct_keys, inverse = np.unique(keys, return_inverse=True)
+
+    value_codes = []
+    remaining = distinct_keys.copy()
+    for uniques in reversed(all_uniques):
+        value_codes.append(remaining % (len(uniques) + 1) - 1)
+        remaining //= len(uniques) + 1
+    value_codes.reverse()
+
+    labels = np.empty(len(distinct_keys), dtype=object)
+    for i in range(len(distinct_keys)):
+        codes = [c[i] for c in value_codes]
+        if min(codes) < 0:
+            labels[i] = np.nan
+        else:
+            labels[i] = make_label(*(u[c] for u, c in zip(all_uniques, codes)))
+
+    return pd.Series(
+        labels.take(inverse.reshape(-1)), index=columns[0].index, dtype=object
+    )
+
+
 def create_world_df(df, poll=False):
     col_mapping = {
         "Date": DATE_COL,
@@ -187,6 +245,7 @@ def create_world_df(df, poll=False):
     }
 
     renamed_df = df.rename(columns=col_mapping)
+    renamed_df[DATE_COL] = dates.parse_dates(renamed_df[DATE_COL])
     renamed_df[COUNTRY_COL] = "World"
 
     renamed_df = agg_df(
@@ -195,18 +254,12 @@ def create_world_df(df, poll=False):
         agg_col=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
     )
 
-    renamed_df = add_rolling_diff(
-        renamed_df,
-        sort_cols=[DATE_COL, COUNTRY_COL],
-        diff_group_cols=[COUNTRY_COL],
-        agg_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
-    )
-
-    return add_percent_change(
+    return add_derived_metrics(
         renamed_df,
         sort_cols=[DATE_COL, COUNTRY_COL],
         diff_group_cols=[COUNTRY_COL],
-        agg_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
+        delta_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
+        percent_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
     )
 
 
@@ -221,8 +274,9 @@ def post_process_international_df(df, poll=False):
     }
 
     renamed_df = df.rename(columns=col_mapping)
-    renamed_df[COUNTRY_COL] = renamed_df[COUNTRY_COL].apply(
-        lambda r: "United States" if r == "US" else r
+    renamed_df[DATE_COL] = dates.parse_dates(renamed_df[DATE_COL])
+    renamed_df[COUNTRY_COL] = build_labels(
+        lambda r: "United States" if r == "US" else r, renamed_df[COUNTRY_COL]
     )
 
     renamed_df = agg_df(
@@ -231,18 +285,12 @@ def post_process_international_df(df, poll=False):
         agg_col=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
     )
 
-    renamed_df = add_rolling_diff(
-        renamed_df,
-        sort_cols=[DATE_COL, COUNTRY_COL],
-        diff_group_cols=[COUNTRY_COL],
-        agg_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
-    )
-
-    return add_percent_change(
+    return add_derived_metrics(
         renamed_df,
         sort_cols=[DATE_COL, COUNTRY_COL],
         diff_group_cols=[COUNTRY_COL],
-        agg_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
+        delta_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
+        percent_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
     )
 
 
@@ -257,6 +305,7 @@ def post_process_international_states_df(df, international_post_processed, poll=
     }
 
     renamed_df = df.rename(columns=col_mapping)
+    renamed_df[DATE_COL] = dates.parse_dates(renamed_df[DATE_COL])
     renamed_df = renamed_df[
         (renamed_df[COUNTRY_COL] != "US")
         & (renamed_df[COUNTRY_COL] != "UK")
@@ -266,8 +315,10 @@ def post_process_international_states_df(df, international_post_processed, poll=
     renamed_df = renamed_df[~renamed_df[STATE_COL].isin(countries)]
 
     renamed_df = renamed_df.dropna(subset=[STATE_COL])
-    renamed_df[STATE_COL] = renamed_df.apply(
-        lambda row: row[STATE_COL] + " (" + row[COUNTRY_COL] + ")", axis=1
+    renamed_df[STATE_COL] = build_labels(
+        lambda state, country: state + " (" + country + ")",
+        renamed_df[STATE_COL],
+        renamed_df[COUNTRY_COL],
     )
 
     renamed_df = agg_df(
@@ -276,294 +327,103 @@ def post_process_international_states_df(df, international_post_processed, poll=
         agg_col=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
     )
 
-    renamed_df = add_rolling_diff(
+    return add_derived_metrics(
         renamed_df,
         sort_cols=[DATE_COL, STATE_COL],
         diff_group_cols=[STATE_COL],
-        agg_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
-    )
-
-    return add_percent_change(
-        renamed_df,
-        sort_cols=[DATE_COL, STATE_COL],
-        diff_group_cols=[STATE_COL],
-        agg_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
+        delta_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
+        percent_cols=[CONFIRMED_COL, RECOVERED_COL, DEATHS_COL],
     )
 
 
-def stable_post_process_us_testing_df(df, poll=False):
-    col_mapping = {
-        "date": DATE_COL,
-        "negative": NEGATIVE_TEST_COL,
-        "totalTestResults": TOTAL_TEST_COL,
-        "hospitalized": HOSPITALIZED_COL,
-        "negativeIncrease": NEGATIVE_TEST_COL + DELTA_COL_SUFFIX,
-        "totalTestResultsIncrease": TOTAL_TEST_COL + DELTA_COL_SUFFIX,
-        "hospitalizedIncrease": HOSPITALIZED_COL + DELTA_COL_SUFFIX,
-    }
-
-    df = df.rename(columns=col_mapping)
-    df[COUNTRY_COL] = "United States"
-    df[DATE_COL] = df[DATE_COL].astype(str)
-    df[DATE_COL] = df[DATE_COL].apply(
-        lambda d: datetime.datetime.strptime(d, "%Y%m%d").strftime("%Y-%m-%d")
-    )
-
-    df = add_percent_change(
-        df,
-        sort_cols=[DATE_COL],
-        diff_group_cols=[COUNTRY_COL],
-        agg_cols=[
-            NEGATIVE_TEST_COL,
-            TOTAL_TEST_COL,
-            HOSPITALIZED_COL,
-        ],
-    )
-
-    return df
-
-
-def post_process_us_testing_df(df, poll=False):
-    col_mapping = {
-        "date": DATE_COL,
-        "negative": NEGATIVE_TEST_COL,
-        "totalTestResults": TOTAL_TEST_COL,
-        "hospitalizedCumulative": HOSPITALIZED_COL,
-        "negativeIncrease": NEGATIVE_TEST_COL + DELTA_COL_SUFFIX,
-        "totalTestResultsIncrease": TOTAL_TEST_COL + DELTA_COL_SUFFIX,
-        "hospitalizedIncrease": HOSPITALIZED_COL + DELTA_COL_SUFFIX,
-        "inIcuCurrently": CURR_ICU_COL,
-        "inIcuCumulative": CUM_ICU_COL,
-        "onVentilatorCurrently": CURR_VENTILATOR_COL,
-        "onVentilatorCumulative": CUM_VENTILATOR_COL,
-        "hospitalizedCurrently": CURRENT_HOSPITALIED_COL,
-    }
-
-    df = df.rename(columns=col_mapping)
-    df[COUNTRY_COL] = "United States"
-    df[DATE_COL] = df[DATE_COL].astype(str)
-    df[DATE_COL] = df[DATE_COL].apply(
-        lambda d: datetime.datetime.strptime(d, "%Y%m%d").strftime("%Y-%m-%d")
-    )
-
-    df = add_rolling_diff(
-        df,
-        sort_cols=[DATE_COL],
-        diff_group_cols=[COUNTRY_COL],
-        agg_cols=[
-            CURR_ICU_COL,
-            CURR_VENTILATOR_COL,
-            CUM_ICU_COL,
-            CUM_VENTILATOR_COL,
-            CURRENT_HOSPITALIED_COL,
-        ],
-    )
-
-    df = add_percent_change(
-        df,
-        sort_cols=[DATE_COL],
-        diff_group_cols=[COUNTRY_COL],
-        agg_cols=[
-            NEGATIVE_TEST_COL,
-            TOTAL_TEST_COL,
-            HOSPITALIZED_COL,
-            CURR_ICU_COL,
-            CURRENT_HOSPITALIED_COL,
-            CURR_VENTILATOR_COL,
-            CUM_ICU_COL,
-            CUM_VENTILATOR_COL,
-        ],
-    )
-
-    return df
-
-
-def stable_post_process_state_testing_df(df):
-    print("Trying stable post processing")
-    print(type(df))
+def post_process_county_df(df, poll=False):
     col_mapping = {
         "date": DATE_COL,
+        "county": COUNTY_COL,
         "state": STATE_COL,
-        "negative": NEGATIVE_TEST_COL,
-        "positive": CONFIRMED_COL,
-        "death": DEATHS_COL,
-        "hospitalizedCumulative": HOSPITALIZED_COL,
-        "totalTestResults": TOTAL_TEST_COL,
-        "positiveIncrease": CONFIRMED_COL + DELTA_COL_SUFFIX,
-        "negativeIncrease": NEGATIVE_TEST_COL + DELTA_COL_SUFFIX,
-        "totalTestResultsIncrease": TOTAL_TEST_COL + DELTA_COL_SUFFIX,
-        "hospitalizedIncrease": HOSPITALIZED_COL + DELTA_COL_SUFFIX,
-        "deathIncrease": DEATHS_COL + DELTA_COL_SUFFIX,
-        "inIcuCurrently": CURR_ICU_COL,
-        "inIcuCumulative": CUM_ICU_COL,
-        "onVentilatorCurrently": CURR_VENTILATOR_COL,
-        "onVentilatorCumulative": CUM_VENTILATOR_COL,
-        "hospitalizedCurrently": CURRENT_HOSPITALIED_COL,
+        "cases": CONFIRMED_COL,
     }
 
-    df = df.rename(columns=col_mapping)
-    df[DATE_COL] = pd.to_datetime(df[DATE_COL])
-    df[DATE_COL] = df[DATE_COL].apply(lambda d: d.strftime("%Y-%m-%d"))
-
-    df[STATE_COL] = df[STATE_COL].apply(
-        lambda abbrev: STATE_MAPPING[abbrev] if abbrev in STATE_MAPPING else abbrev
+    renamed_df = df.rename(columns=col_mapping)
+    renamed_df[DATE_COL] = dates.parse_dates(renamed_df[DATE_COL])
+    renamed_df[COUNTY_COL] = build_labels(
+        lambda county, state: county + " (" + state + ")",
+        renamed_df[COUNTY_COL],
+        renamed_df[STATE_COL],
     )
+    renamed_df = renamed_df.drop([STATE_COL], inplace=False, axis=1)
+    return add_derived_metrics(
+        renamed_df,
+        sort_cols=[DATE_COL, COUNTY_COL],
+        diff_group_cols=[COUNTY_COL],
+        delta_cols=[CONFIRMED_COL],
+        percent_cols=[CONFIRMED_COL],
+    )
+
+
+JHU_CONFIRMED_ID_COLS = [
+    "UID",
+    "iso2",
+    "iso3",
+    "code3",
+    "FIPS",
+    "Admin2",
+    "Province_State",
+    "Country_Region",
+    "Lat",
+    "Long_",
+    "Combined_Key",
+]
 
-    df[STATE_COL] = df.apply(lambda row: row[STATE_COL] + " (United States)", axis=1)
+JHU_DEATHS_ID_COLS = JHU_CONFIRMED_ID_COLS + ["Population"]
 
-    df = add_rolling_diff(
-        df,
-        sort_cols=[DATE_COL, STATE_COL],
-        diff_group_cols=[STATE_COL],
-        agg_cols=[
-            CURR_ICU_COL,
-            CURR_VENTILATOR_COL,
-            CURRENT_HOSPITALIED_COL,
-            CUM_ICU_COL,
-            CUM_VENTILATOR_COL,
-        ],
-    )
+# The JHU files have one column per date, named like 3/22/20
+JHU_DATE_FORMAT = "%m/%d/%y"
 
-    return add_percent_change(
-        df,
-        sort_cols=[DATE_COL, STATE_COL],
-        diff_group_cols=[STATE_COL],
-        agg_cols=[
-            NEGATIVE_TEST_COL,
-            CONFIRMED_COL,
-            DEATHS_COL,
-            TOTAL_TEST_COL,
-            HOSPITALIZED_COL,
-            CURR_ICU_COL,
-            CURR_VENTILATOR_COL,
-            CUM_ICU_COL,
-            CUM_VENTILATOR_COL,
-            CURRENT_HOSPITALIED_COL,
-        ],
-    )
 
+def get_derived_schema(delta_cols, percent_cols):
+    schema = {col + DELTA_COL_SUFFIX: "float64" for col in delta_cols}
+    schema.update({col + DELTA_PERCENT_COL_SUFFIX: "float64" for col in percent_cols})
 
-def post_process_state_testing_df(df, poll=False):
-    col_mapping = {
-        "dateChecked": DATE_COL,
-        "state": STATE_COL,
-        "negative": NEGATIVE_TEST_COL,
-        "positive": CONFIRMED_COL,
-        "death": DEATHS_COL,
-        "hospitalizedCumulative": HOSPITALIZED_COL,
-        "totalTestResults": TOTAL_TEST_COL,
-        "positiveIncrease": CONFIRMED_COL + DELTA_COL_SUFFIX,
-        "negativeIncrease": NEGATIVE_TEST_COL + DELTA_COL_SUFFIX,
-        "totalTestResultsIncrease": TOTAL_TEST_COL + DELTA_COL_SUFFIX,
-        "hospitalizedIncrease": HOSPITALIZED_COL + DELTA_COL_SUFFIX,
-        "deathIncrease": DEATHS_COL + DELTA_COL_SUFFIX,
-        "inIcuCurrently": CURR_ICU_COL,
-        "inIcuCumulative": CUM_ICU_COL,
-        "onVentilatorCurrently": CURR_VENTILATOR_COL,
-        "onVentilatorCumulative": CUM_VENTILATOR_COL,
-        "hospitalizedCurrently": CURRENT_HOSPITALIED_COL,
-    }
+    return schema
 
-    df = df.rename(columns=col_mapping)
-    df[DATE_COL] = pd.to_datetime(df[DATE_COL])
-    df[DATE_COL] = df[DATE_COL].apply(lambda d: d.strftime("%Y-%m-%d"))
 
-    df[STATE_COL] = df[STATE_COL].apply(
-        lambda abbrev: STATE_MAPPING[abbrev] if abbrev in STATE_MAPPING else abbrev
-    )
+def get_international_schema(entity_col):
+    metrics = [CONFIRMED_COL, RECOVERED_COL, DEATHS_COL]
+    schema = {DATE_COL: dates.DATE_DTYPE, entity_col: "object"}
+    schema.update({col: "float64" for col in metrics})
+    schema.update(get_derived_schema(metrics, metrics))
 
-    df[STATE_COL] = df.apply(lambda row: row[STATE_COL] + " (United States)", axis=1)
+    return schema
 
-    df = add_rolling_diff(
-        df,
-        sort_cols=[DATE_COL, STATE_COL],
-        diff_group_cols=[STATE_COL],
-        agg_cols=[
-            CURR_ICU_COL,
-            CURR_VENTILATOR_COL,
-            CURRENT_HOSPITALIED_COL,
-            CUM_ICU_COL,
-            CUM_VENTILATOR_COL,
-        ],
-    )
 
-    return add_percent_change(
-        df,
-        sort_cols=[DATE_COL, STATE_COL],
-        diff_group_cols=[STATE_COL],
-        agg_cols=[
-            NEGATIVE_TEST_COL,
-            CONFIRMED_COL,
-            DEATHS_COL,
-            TOTAL_TEST_COL,
-            HOSPITALIZED_COL,
-            CURR_ICU_COL,
-            CURR_VENTILATOR_COL,
-            CUM_ICU_COL,
-            CUM_VENTILATOR_COL,
-            CURRENT_HOSPITALIED_COL,
-        ],
-    )
+def get_county_schema():
+    metrics = [CONFIRMED_COL, DEATHS_COL]
+    schema = {COUNTY_COL: "object", DATE_COL: dates.DATE_DTYPE}
+    # The counts are float when the two files disagree on the locations
+    schema.update({col: ("int64", "float64") for col in metrics})
+    schema.update(get_derived_schema(metrics, metrics))
 
+    return schema
 
-def post_process_county_df(df, poll=False):
-    col_mapping = {
-        "date": DATE_COL,
-        "county": COUNTY_COL,
-        "state": STATE_COL,
-        "cases": CONFIRMED_COL,
-    }
-
-    renamed_df = df.rename(columns=col_mapping)
-    renamed_df[COUNTY_COL] = renamed_df.apply(
-        lambda row: row[COUNTY_COL] + " (" + row[STATE_COL] + ")", axis=1
-    )
-    renamed_df = renamed_df.drop([STATE_COL], inplace=False, axis=1)
-    renamed_df = add_rolling_diff(
-        renamed_df,
-        sort_cols=[DATE_COL, COUNTY_COL],
-        diff_group_cols=[COUNTY_COL],
-        agg_cols=[CONFIRMED_COL],
-    )
-
-    return add_percent_change(
-        renamed_df,
-        sort_cols=[DATE_COL, COUNTY_COL],
-        diff_group_cols=[COUNTY_COL],
-        agg_cols=[CONFIRMED_COL],
-    )
 
+# The columns and dtypes of the post processed frames cached by io_utils.
+# Cached copies with any other columns are rebuilt.
+FRAME_SCHEMAS = {
+    "world_df": get_international_schema(COUNTRY_COL),
+    "international_df": get_international_schema(COUNTRY_COL),
+    "international_states_df": get_international_schema(STATE_COL),
+    JHU_CACHE_NAME: get_county_schema(),
+}
 
-def post_process_county_df_jhu(deaths, confirmed, overwrite=False):
-    if path.exists(io_utils.JHU_CSV_PATH):
-        print("Reading JHU CSV from cache")
-        return pd.read_csv(io_utils.JHU_CSV_PATH)
 
-    def reformat_date(old):
-        old_date = old.split("/")
-        yyyy = "20" + old_date[2]
-        mm = "0" + old_date[0] if len(old_date[0]) == 1 else old_date[0]
-        dd = "0" + old_date[1] if len(old_date[1]) == 1 else old_date[1]
-        return yyyy + "-" + mm + "-" + dd
+def get_jhu_date_cols(df, id_cols):
+    return [col for col in df.columns if col not in id_cols]
 
-    print("Starting to postprocess JHU")
-    death_id_cols = [
-        "UID",
-        "iso2",
-        "iso3",
-        "code3",
-        "FIPS",
-        "Admin2",
-        "Province_State",
-        "Country_Region",
-        "Lat",
-        "Long_",
-        "Combined_Key",
-        "Population",
-    ]
 
+def melt_county_df_jhu(deaths, confirmed):
     melted_deaths = pd.melt(
-        deaths, id_vars=death_id_cols, var_name=DATE_COL, value_name=DEATHS_COL
+        deaths, id_vars=JHU_DEATHS_ID_COLS, var_name=DATE_COL, value_name=DEATHS_COL
     )
     melted_deaths["Admin2"] = melted_deaths["Admin2"].fillna("")
     melted_deaths = melted_deaths[(melted_deaths["Admin2"] != "Unassigned")]
@@ -573,23 +433,9 @@ def post_process_county_df_jhu(deaths, confirmed, overwrite=False):
     )
 
     # Process confirmed df
-    confirmed_id_cols = [
-        "UID",
-        "iso2",
-        "iso3",
-        "code3",
-        "FIPS",
-        "Admin2",
-        "Province_State",
-        "Country_Region",
-        "Lat",
-        "Long_",
-        "Combined_Key",
-    ]
-
     confirmed_melted = pd.melt(
         confirmed,
-        id_vars=confirmed_id_cols,
+        id_vars=JHU_CONFIRMED_ID_COLS,
         var_name=DATE_COL,
         value_name=CONFIRMED_COL,
     )
@@ -609,203 +455,419 @@ def post_process_county_df_jhu(deaths, confirmed, overwrite=False):
     merged = merged.rename(
         columns={"Province/State_x": "Province/State", "County_x": "County"}
     )
-    merged["County"] = merged.apply(
-        lambda row: row["Province/State"]
-        if row["County"] == ""
-        else row["County"] + " (" + row["Province/State"] + ")",
-        axis=1,
+    merged["County"] = build_labels(
+        lambda county, state: state if county == "" else county + " (" + state + ")",
+        merged["County"],
+        merged["Province/State"],
     )
     merged = merged[["County", "Deaths", "Confirmed", "Date"]]
 
-    merged["Date"] = merged["Date"].apply(lambda d: reformat_date(d))
+    merged["Date"] = dates.parse_dates(merged["Date"], JHU_DATE_FORMAT)
 
-    renamed_df = add_rolling_diff(
-        merged,
-        sort_cols=[DATE_COL, COUNTY_COL],
-        diff_group_cols=[COUNTY_COL],
-        agg_cols=[CONFIRMED_COL, DEATHS_COL],
-    )
+    return merged
 
-    renamed_df = add_percent_change(
-        renamed_df,
+
+def add_county_metrics_jhu(df):
+    renamed_df = add_derived_metrics(
+        df,
         sort_cols=[DATE_COL, COUNTY_COL],
         diff_group_cols=[COUNTY_COL],
-        agg_cols=[CONFIRMED_COL, DEATHS_COL],
+        delta_cols=[CONFIRMED_COL, DEATHS_COL],
+        percent_cols=[CONFIRMED_COL, DEATHS_COL],
     )
 
-    io_utils.save_csv("JHU", renamed_df)
+    return renamed_df.reset_index(drop=True)
 
-    return renamed_df
 
+def get_jhu_source_key(deaths, confirmed):
+    """
+    Identifies the set of locations in the JHU files. A change in the set
+    means the cached long table cannot simply be extended.
+    """
+    uids = pd.concat([deaths["UID"], confirmed["UID"]]).astype(str)
+    return str(pd.util.hash_pandas_object(uids.sort_values(), index=False).sum())
 
-def add_rolling_diff(df, sort_cols, diff_group_cols, agg_cols):
-    sorted_df = df.sort_values(by=sort_cols)
-    for agg_col_name in agg_cols:
-        delta_col_name = agg_col_name + DELTA_COL_SUFFIX
-        sorted_df[delta_col_name] = (
-            sorted_df.groupby(diff_group_cols)[agg_col_name]
-            .diff()
-            .fillna(sorted_df[agg_col_name], inplace=False)
-        )
 
-    return sorted_df
+def get_jhu_raw_version(deaths_raw, confirmed_raw):
+    raw_hash = hashlib.sha256(deaths_raw)
+    raw_hash.update(confirmed_raw)
 
+    return raw_hash.hexdigest()
 
-def agg_df(df, group_cols, agg_col):
-    return df.groupby(group_cols)[agg_col].sum().reset_index()
 
+def load_county_df_jhu(deaths_raw, confirmed_raw, overwrite=False):
+    """
+    The long county table for the raw bytes of the JHU files. When it was
+    cached from these exact bytes it is read back without parsing them;
+    otherwise the files are parsed and post processed.
+    """
+    raw_version = get_jhu_raw_version(deaths_raw, confirmed_raw)
+    manifest = io_utils.read_manifest(JHU_CACHE_NAME)
 
-def add_percent_change(df, sort_cols, diff_group_cols, agg_cols):
-    sorted_df = df.sort_values(by=sort_cols)
-    for agg_col_name in agg_cols:
-        delta_col_name = agg_col_name + DELTA_PERCENT_COL_SUFFIX
+    if (
+        not overwrite
+        and manifest is not None
+        and manifest["extra"].get("raw_version") == raw_version
+    ):
+        cached = io_utils.load_frame(
+            JHU_CACHE_NAME,
+            source_version=manifest["source_version"],
+            schema_version=SCHEMA_VERSION,
+            schemas=[FRAME_SCHEMAS[JHU_CACHE_NAME]],
+        )
 
-        if len(diff_group_cols) == 0:
-            sorted_df[delta_col_name] = sorted_df[agg_col_name].pct_change()
-        else:
-            sorted_df[delta_col_name] = sorted_df.groupby(diff_group_cols)[
-                agg_col_name
-            ].pct_change()
-
-        sorted_df[delta_col_name] = (
-            sorted_df[delta_col_name]
-            .replace([np.inf, -np.inf], np.nan)
-            .fillna(0, inplace=False)
+        if cached is not None:
+            print("Reading JHU from cache")
+            return cached
+
+    return post_process_county_df_jhu(
+        pd.read_csv(BytesIO(deaths_raw)),
+        pd.read_csv(BytesIO(confirmed_raw)),
+        overwrite=overwrite,
+        raw_version=raw_version,
+    )
+
+
+def post_process_county_df_jhu(deaths, confirmed, overwrite=False, raw_version=None):
+    """
+    Melts the wide JHU files into one row per county and date.
+
+    The long table is cached with a watermark of the last date it covers. On
+    the next call, only the date columns after the watermark are melted, and
+    their daily increases are computed against the watermark date before
+    being appended. The table is rebuilt from scratch when `overwrite` is
+    set, when the set of locations changed, or when JHU revised the values
+    of the watermark date.
+    """
+    date_cols = get_jhu_date_cols(confirmed, JHU_CONFIRMED_ID_COLS)
+    source_key = get_jhu_source_key(deaths, confirmed)
+    cached = None
+
+    if not overwrite:
+        cached = io_utils.load_frame(
+            JHU_CACHE_NAME,
+            source_version=source_key,
+            schema_version=SCHEMA_VERSION,
+            schemas=[FRAME_SCHEMAS[JHU_CACHE_NAME]],
         )
-        sorted_df[delta_col_name] = (sorted_df[delta_col_name] * 100).round(1)
 
-    return sorted_df
+    if cached is not None:
+        last_date = pd.Timestamp(
+            io_utils.read_manifest(JHU_CACHE_NAME)["extra"]["last_date"]
+        )
+        col_dates = dates.parse_dates(date_cols, JHU_DATE_FORMAT).tolist()
+
+        context_cols = [
+            col for col, date in zip(date_cols, col_dates) if date == last_date
+        ]
+        new_cols = [col for col, date in zip(date_cols, col_dates) if date > last_date]
+
+        if len(context_cols) == 1 and len(new_cols) == 0:
+            print("Reading JHU from cache")
+            return cached
+
+        if len(context_cols) == 1:
+            print("Appending {} new JHU dates".format(len(new_cols)))
+            tail = add_county_metrics_jhu(
+                melt_county_df_jhu(
+                    deaths[JHU_DEATHS_ID_COLS + context_cols + new_cols],
+                    confirmed[JHU_CONFIRMED_ID_COLS + context_cols + new_cols],
+                )
+            )
 
+            if is_same_county_snapshot(
+                cached[cached[DATE_COL] == last_date], tail[tail[DATE_COL] == last_date]
+            ):
+                tail = tail[tail[DATE_COL] > last_date]
+                renamed_df = pd.concat([cached, tail], ignore_index=True)
+                save_county_df_jhu(renamed_df, source_key, raw_version)
 
-def get_countries_to_states(international_country_df, post_processed_us_states):
-    international_country_df = international_country_df[
-        international_country_df[COUNTRY_COL] != "US"
-    ]
-    countries_to_state = {}
+                return renamed_df
 
-    all_countries = international_country_df[COUNTRY_COL].unique().tolist()
+            print("JHU revised {}, rebuilding".format(last_date.date()))
 
-    for country in all_countries:
-        these_states = international_country_df[
-            international_country_df[COUNTRY_COL] == country
-        ][STATE_COL].dropna()
-        if len(these_states) == 0:
-            continue
+    print("Starting to postprocess JHU")
+    renamed_df = add_county_metrics_jhu(melt_county_df_jhu(deaths, confirmed))
+    save_county_df_jhu(renamed_df, source_key, raw_version)
 
-        these_states = these_states.unique().tolist()
-        countries_to_state[country] = these_states
+    return renamed_df
 
-    countries_to_state["US"] = post_processed_us_states[STATE_COL].unique().tolist()
 
-    return countries_to_state
+def is_same_county_snapshot(cached_rows, new_rows):
+    cols = [COUNTY_COL, CONFIRMED_COL, DEATHS_COL]
+    cached_rows = cached_rows[cols].sort_values(by=COUNTY_COL).reset_index(drop=True)
+    new_rows = new_rows[cols].sort_values(by=COUNTY_COL).reset_index(drop=True)
 
+    if len(cached_rows) != len(new_rows):
+        return False
 
-def get_states_to_counties(counties_df):
-    states_to_counties = {}
+    return (cached_rows[COUNTY_COL] == new_rows[COUNTY_COL]).all() and np.allclose(
+        cached_rows[[CONFIRMED_COL, DEATHS_COL]].astype(float),
+        new_rows[[CONFIRMED_COL, DEATHS_COL]].astype(float),
+        equal_nan=True,
+    )
 
-    all_states = counties_df[STATE_COL].unique().tolist()
 
-    for state in all_states:
-        counties = counties_df[counties_df[STATE_COL] == state][COUNTY_COL].dropna()
-        if len(counties) == 0:
-            continue
-        counties = counties.unique().tolist()
-        states_to_counties[state] = counties
+def save_county_df_jhu(df, source_key, raw_version=None):
+    io_utils.save_frame(
+        JHU_CACHE_NAME,
+        df,
+        source_version=source_key,
+        schema_version=SCHEMA_VERSION,
+        extra={
+            "last_date": df[DATE_COL].max().strftime(dates.DATE_FORMAT),
+            # The bytes of the files the table was built from
+            "raw_version": raw_version,
+        },
+    )
+
+
+def get_group_segments(df, group_cols):
+    """
+    Returns the positions that gather the rows of each group into one
+    contiguous segment, keeping their order within the group, and a mask of
+    the positions that start a segment. Rows with a missing group key are
+    segments of their own, as groupby leaves them out.
+    """
+    if len(group_cols) == 0:
+        codes = np.zeros(len(df), dtype=np.int64)
+    else:
+        codes = df.groupby(group_cols, sort=False).ngroup().to_numpy()
 
-    return states_to_counties
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
 
+    starts = np.ones(len(codes), dtype=bool)
+    starts[1:] = codes[1:] != codes[:-1]
+    starts |= codes == -1
 
-def get_all_entities(dataframes):
-    entities = {}
+    return order, starts
 
-    all_countries = []
-    all_states = []
-    all_counties = []
 
-    for df in dataframes:
-        countries = []
-        states = []
-        counties = []
+def get_segment_delta(values, starts):
+    delta = np.full(len(values), np.nan)
+    delta[1:] = values[1:] - values[:-1]
+    delta[starts] = np.nan
+
+    # The first row of each group, and rows next to a missing value, fall
+    # back to the value itself
+    return np.where(np.isnan(delta), values, delta)
 
-        if COUNTY_COL in df.columns:
-            counties = df[COUNTY_COL].unique().tolist()
 
-            all_counties = all_counties + counties
-        elif STATE_COL in df.columns:
-            has_state_col = True
-            states = df[STATE_COL].unique().tolist()
-            all_states = all_states + states
-        elif COUNTRY_COL in df.columns:
-            countries = df[COUNTRY_COL].unique().tolist()
+def get_segment_percent_change(values, starts):
+    # Missing values are padded forward within their group before the change
+    # is taken, like pct_change(fill_method="pad")
+    positions = np.arange(len(values))
+    last_valid = np.where(~np.isnan(values) | starts, positions, 0)
+    filled = values[np.maximum.accumulate(last_valid)]
 
-            all_countries = all_countries + countries
+    previous = np.full(len(values), np.nan)
+    previous[1:] = filled[:-1]
+    previous[starts] = np.nan
 
-    # sort counties by state -> county name
-    sorted_counties = list(set(all_counties))
-    sorted_counties.sort(key=cmp_to_key(compare))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = filled / previous - 1
 
-    # sort states/province by country-> state/province name
-    sorted_states = list(set(all_states))
-    sorted_states.sort(key=cmp_to_key(compare))
+    change[~np.isfinite(change)] = 0
 
-    entities[COUNTRY_COL] = sorted(set(all_countries))
-    entities[STATE_COL] = sorted_states
-    entities[COUNTY_COL] = sorted_counties
+    return np.round(change * 100, 1)
 
-    return entities
 
+def add_derived_metrics(df, sort_cols, diff_group_cols, delta_cols=(), percent_cols=()):
+    """
+    Sorts the frame by `sort_cols` and adds the daily increase of every column
+    in `delta_cols` and the daily percent change of every column in
+    `percent_cols`, within the groups of `diff_group_cols`.
 
-def compare(entity1, entity2):
-    if entity1.find("(") < entity1.find(")") and entity2.find("(") < entity2.find(")"):
-        if entity1[entity1.find("(") + 1 : entity1.find(")")] == (
-            entity2[entity2.find("(") + 1 : entity2.find(")")]
+    The frame is sorted and split into groups once; each metric is then a
+    single vectorized pass over the groups laid out as contiguous segments.
+    """
+    sorted_df = df.sort_values(by=sort_cols)
+    order, starts = get_group_segments(sorted_df, diff_group_cols)
+
+    for metric_cols, suffix, compute in [
+        (delta_cols, DELTA_COL_SUFFIX, get_segment_delta),
+        (percent_cols, DELTA_PERCENT_COL_SUFFIX, get_segment_percent_change),
+    ]:
+        for col in metric_cols:
+            values = sorted_df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            metric = np.empty(len(values))
+            metric[order] = compute(values[order], starts)
+            sorted_df[col + suffix] = metric
+
+    return sorted_df
+
+
+def describe_rate_of_change(df, x_col):
+    """
+    The statistics of a rate of change metric over every day and over the
+    last week, for each entity of a displayable frame. Returns a frame
+    indexed by entity, with (period, statistic) columns.
+    """
+    last_week = (
+        df.sort_values(by=x_col, ascending=False, kind="stable")
+        .groupby(ENTITY_COL, sort=False)
+        .head(LAST_WEEK_DAYS)
+    )
+    periods = pd.concat(
+        [
+            df[[ENTITY_COL, MEASUREMENT_COL]].assign(period=HISTORIC_PERIOD),
+            last_week[[ENTITY_COL, MEASUREMENT_COL]].assign(period=LAST_WEEK_PERIOD),
+        ]
+    )
+    values = periods[MEASUREMENT_COL]
+    periods["positive"] = values.where(values > 0)
+
+    stats = periods.groupby([ENTITY_COL, "period"]).agg(
+        **{
+            "max": (MEASUREMENT_COL, "max"),
+            "nonzero-min": ("positive", "min"),
+            "mean": (MEASUREMENT_COL, "mean"),
+            "number of days": (MEASUREMENT_COL, "size"),
+        }
+    )
+    stats["nonzero-min"] = stats["nonzero-min"].fillna(0.0)
+
+    return stats.unstack("period").swaplevel(axis=1)[RATE_OF_CHANGE_STATS]
+
+
+def get_stats_lookup(stats):
+    """
+    Maps the index of each row of a statistics frame to the nested
+    {period: {statistic: value}} dict the Data panel shows.
+    """
+    lookup = {}
+    for key, row in stats.to_dict("index").items():
+        lookup[key] = {}
+        for (period, stat), value in row.items():
+            lookup[key].setdefault(period, {})[stat] = value
+
+    return lookup
+
+
+def agg_df(df, group_cols, agg_col):
+    return df.groupby(group_cols)[agg_col].sum().reset_index()
+
+
+def get_compact_dtype(series):
+    """
+    The smallest dtype that holds every value of a numeric column exactly,
+    or None when the column cannot be made smaller without losing values.
+    """
+    if series.dtype.kind not in "iuf" or series.dtype.itemsize <= 4:
+        return None
+
+    values = series.to_numpy()
+    present = values[~np.isnan(values)] if series.dtype.kind == "f" else values
+
+    if (
+        len(present) == len(values)
+        and (len(values) == 0 or np.iinfo(np.int32).min <= present.min())
+        and (len(values) == 0 or present.max() <= np.iinfo(np.int32).max)
+        and np.array_equal(present, np.floor(present))
+    ):
+        return "int32"
+
+    # Missing values survive the cast, so only the others need checking
+    if series.dtype.kind == "f" and np.array_equal(present.astype(np.float32), present):
+        return "float32"
+
+    return None
+
+
+def compact_frame(df):
+    """
+    Returns a copy of the frame with entity columns stored as categoricals and
+    numeric columns downcast where no value changes. The original dtypes are
+    restored with `df.astype(original.dtypes)`.
+    """
+    dtypes = {}
+    for col in df.columns:
+        if (
+            col in ENTITY_COLS
+            and str(df[col].dtype) != "category"
+            and df[col].dtype.kind not in "biufcmM"
         ):
-            return -1 if entity1 < entity2 else 1
+            dtypes[col] = "category"
         else:
-            return (
-                -1
-                if entity1[entity1.find("(") + 1 : entity1.find(")")]
-                < (entity2[entity2.find("(") + 1 : entity2.find(")")])
-                else 1
-            )
-    else:
-        return -1 if entity1 < entity2 else 1
+            dtype = get_compact_dtype(df[col])
+            if dtype is not None:
+                dtypes[col] = dtype
+
+    return df.astype(dtypes)
+
+
+def get_parent_to_children(df, parent_col, child_col):
+    """
+    Maps each value of `parent_col` to the distinct values of `child_col` in
+    its rows, both in order of appearance. Parents without children are
+    left out.
+    """
+    links = df[[parent_col, child_col]].dropna().drop_duplicates()
+    children = links.groupby(parent_col, sort=False)[child_col].agg(list).to_dict()
+
+    return {
+        parent: children[parent]
+        for parent in df[parent_col].unique().tolist()
+        if parent in children
+    }
 
 
-def create_hierarchy(all_entities):
-    hierarchy = {
-        COUNTRY_COL: all_entities[COUNTRY_COL],
-        STATE_COL: all_entities[STATE_COL],
-        COUNTY_COL: all_entities[COUNTY_COL],
-    }
+def get_countries_to_states(international_country_df, post_processed_us_states):
+    international_country_df = international_country_df[
+        international_country_df[COUNTRY_COL] != "US"
+    ]
+    countries_to_state = get_parent_to_children(
+        international_country_df, COUNTRY_COL, STATE_COL
+    )
 
-    # all_states = all_entities[STATE_COL]
+    countries_to_state["US"] = post_processed_us_states[STATE_COL].unique().tolist()
 
-    # country_to_state['Unlinked'] = []
-    # for state in all_states:
-    #     contained = False
+    return countries_to_state
 
-    #     for mapped_state in country_to_state.values():
-    #         if state in mapped_state:
-    #             contained = True
-    #             break
 
-    #     if not contained:
-    #         country_to_state['Unlinked'].append(state)
+def get_states_to_counties(counties_df):
+    return get_parent_to_children(counties_df, STATE_COL, COUNTY_COL)
 
-    # state_to_county['Unlinked'] = []
-    # for county in all_entities[COUNTY_COL]:
-    #     contained = False
 
-    #     for mapped_county in state_to_county.values():
-    #         if county in mapped_county:
-    #             contained = True
-    #             break
+def get_entity_sort_key(name):
+    """
+    Labels like "Kent (Maryland)" sort by their parent, then by the whole
+    label. Labels without a parent sort as their own parent.
+    """
+    start = name.find("(")
+    end = name.find(")")
+    if start < end:
+        return (name[start + 1 : end], name)
 
-    #     if not contained:
-    #         state_to_county['Unlinked'].append(county)
+    return (name, name)
 
-    # hierarchy[STATE_COL] = list(country_to_state.values())
-    # hierarchy[COUNTY_COL] = list(state_to_county.values())
 
-    return hierarchy
+def get_all_entities(dataframes):
+    """
+    The entities of each entity column, in display order. Each frame only
+    adds the entities of its finest entity column.
+    """
+    names = {col: set() for col in ENTITY_COLS}
+
+    for df in dataframes:
+        for col in [COUNTY_COL, STATE_COL, COUNTRY_COL]:
+            if col in df.columns:
+                names[col].update(df[col].unique().tolist())
+                break
+
+    return {
+        COUNTRY_COL: sorted(names[COUNTRY_COL]),
+        # sort states/province by country -> state/province name
+        STATE_COL: sorted(names[STATE_COL], key=get_entity_sort_key),
+        # sort counties by state -> county name
+        COUNTY_COL: sorted(names[COUNTY_COL], key=get_entity_sort_key),
+    }
+
+
+def create_hierarchy(all_entities):
+    return {
+        COUNTRY_COL: all_entities[COUNTRY_COL],
+        STATE_COL: all_entities[STATE_COL],
+        COUNTY_COL: all_entities[COUNTY_COL],
+    }
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def copy_result(value):
+    """
+    Copies the frames of a result (nested in tuples, lists and dicts), so
+    the copy shares no data with the original.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=True)
+
+    if isinstance(value, tuple):
+        return tuple(copy_result(v) for v in value)
+
+    if isinstance(value, list):
+        return [copy_result(v) for v in value]
+
+    if isinstance(value, dict):
+        return {k: copy_result(v) for k, v in value.items()}
+
+    return value
+
+
+def get_result_bytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+
+    if isinstance(value, (tuple, list)):
+        return sum(get_result_bytes(v) for v in value)
+
+    if isinstance(value, dict):
+        return sum(get_result_bytes(v) for v in value.values())
+
+    return 0
+
+
+class ResultCache:
+    """
+    A least-recently-used cache of query results, bounded by its number of
+    entries and by the bytes their frames hold.
+
+    Every entry belongs to a data generation. Storing a result of a newer
+    generation drops all the older entries at once, so results computed
+    before a refresh are never served after it. Results of an older
+    generation, finished late by a session still on the previous data, are
+    not stored. Results are copied on the way in and on the way out: callers
+    get frames they can modify without corrupting the cached ones.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.generation = None
+        # key -> (result, bytes), least recently used first
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, generation, key):
+        """
+        Returns a copy of the result stored for `key`, or None on a miss.
+        """
+        with self.lock:
+            if generation != self.generation or key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            result, _ = self.entries[key]
+
+        return copy_result(result)
+
+    def put(self, generation, key, result):
+        result = copy_result(result)
+        size = get_result_bytes(result)
+
+        with self.lock:
+            if self.generation is not None and generation < self.generation:
+                return
+
+            if generation != self.generation:
+                self.entries.clear()
+                self.bytes = 0
+                self.generation = generation
+
+            # A result larger than the whole cache is not kept
+            if size > self.max_bytes:
+                return
+
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+
+            self.entries[key] = (result, size)
+            self.bytes += size
+
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.generation = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "generation": self.generation,
+            }
@@ -1,11 +1,228 @@
+import itertools
 import time
+from collections import OrderedDict
+from functools import partial
+
+import pandas as pd
+
 from utils import processing_utils
 from utils import api_utils
+from utils import io_utils
+from utils import source_schemas
 from utils.covid_dataset import CovidData
+from utils.entity_catalog import build_entity_catalog
+from utils.ingestion import (
+    CPU_STAGE,
+    IO_STAGE,
+    run_stages_in_parallel,
+    run_stages_sequentially,
+)
+
+
+# The schemas each cached frame may have
+FRAME_SCHEMAS = {
+    name: [schema] for name, schema in processing_utils.FRAME_SCHEMAS.items()
+}
+FRAME_SCHEMAS.update(
+    {
+        source + "_df": schemas
+        for source, schemas in source_schemas.FRAME_SCHEMAS.items()
+    }
+)
+
+INTERNATIONAL_FRAME_NAMES = ["world_df", "international_df", "international_states_df"]
+
+
+def load_cached(names, source):
+    """
+    Returns the frames named `names` from the processed-data cache when all
+    of them were built from the current version of `source` with their
+    current schema, otherwise None.
+    """
+    source_version = api_utils.get_source_version(source)
+
+    if source_version is None:
+        return None
+
+    frames = [
+        io_utils.load_frame(
+            name,
+            source_version=source_version,
+            schema_version=processing_utils.SCHEMA_VERSION,
+            schemas=FRAME_SCHEMAS[name],
+        )
+        for name in names
+    ]
+
+    if any(frame is None for frame in frames):
+        return None
+
+    print("Read {} from cache".format(", ".join(names)))
+    return frames
+
+
+def save_built(names, source, frames):
+    source_version = api_utils.get_source_version(source)
+
+    if source_version is not None:
+        for name, frame in zip(names, frames):
+            io_utils.save_frame(
+                name,
+                frame,
+                source_version=source_version,
+                schema_version=processing_utils.SCHEMA_VERSION,
+            )
+
+    return frames
+
+
+def load_or_build(names, source, build, *args, overwrite=False):
+    """
+    Returns the frames named `names` from the processed-data cache when they
+    were built from the current version of `source`, otherwise builds them
+    with `build(*args)` and caches them.
+    """
+    frames = None if overwrite else load_cached(names, source)
+
+    if frames is None:
+        frames = build(*args)
+        if len(names) == 1:
+            frames = [frames]
+
+        save_built(names, source, frames)
+
+    return frames
+
+
+def process_international(raw_global_df):
+    # The three international frames share one stage so the raw Kaggle frame,
+    # the largest input, is only pickled to a single worker process
+    world_df = processing_utils.create_world_df(raw_global_df.copy())
+    international_df = processing_utils.post_process_international_df(
+        raw_global_df.copy()
+    )
+    international_states_df = processing_utils.post_process_international_states_df(
+        raw_global_df.copy(), international_df.copy()
+    )
+
+    return world_df, international_df, international_states_df
+
+
+def fetch_international(overwrite=False):
+    """
+    Updates the Kaggle dataset, then returns (cached frames, None) when the
+    international frames were cached from its current version, or
+    (None, raw frame) to build them from. The CSV is only parsed when the
+    cache is out of date.
+    """
+    api_utils.update_international_dataset()
+
+    frames = None if overwrite else load_cached(INTERNATIONAL_FRAME_NAMES, "kaggle")
+    if frames is not None:
+        return frames, None
+
+    return None, api_utils.read_international_dataset()
+
+
+def build_international(fetched):
+    frames, raw_global_df = fetched
+
+    if frames is None:
+        frames = save_built(
+            INTERNATIONAL_FRAME_NAMES, "kaggle", process_international(raw_global_df)
+        )
+
+    return frames
+
+
+def build_testing(source, raw, overwrite=False):
+    return load_or_build(
+        [source + "_df"],
+        source,
+        source_schemas.parse_source,
+        source,
+        raw,
+        overwrite=overwrite,
+    )[0]
+
+
+def process_county(raw, overwrite=False):
+    deaths_raw, confirmed_raw = raw
+    return processing_utils.load_county_df_jhu(
+        deaths_raw, confirmed_raw, overwrite=overwrite
+    )
+
+
+def get_ingestion_stages(overwrite=False):
+    """
+    The ingestion pipeline as a list of (name, function, dependencies, kind),
+    in an order where every stage comes after its dependencies.
+    """
+    return [
+        # The international COVID dataset, aggregated per country and state
+        # Source: Kaggle
+        (
+            "raw_global_df",
+            partial(fetch_international, overwrite=overwrite),
+            (),
+            IO_STAGE,
+        ),
+        # US testing datasets
+        # Source: https://covidtracking.com/api/
+        ("us_testing_raw", api_utils.get_historical_us_testing_data, (), IO_STAGE),
+        (
+            "us_states_testing_raw",
+            api_utils.get_historical_states_testing_data,
+            (),
+            IO_STAGE,
+        ),
+        # Covid data per US county
+        # Source: Johns Hopkins
+        ("county_raw", api_utils.get_johns_hopkins_county_level_data, (), IO_STAGE),
+        ("international_dfs", build_international, ("raw_global_df",), CPU_STAGE),
+        (
+            "us_testing_df",
+            partial(build_testing, "us_testing", overwrite=overwrite),
+            ("us_testing_raw",),
+            CPU_STAGE,
+        ),
+        (
+            "us_states_testing_df",
+            partial(build_testing, "us_states_testing", overwrite=overwrite),
+            ("us_states_testing_raw",),
+            CPU_STAGE,
+        ),
+        (
+            "us_county_df",
+            partial(process_county, overwrite=overwrite),
+            ("county_raw",),
+            CPU_STAGE,
+        ),
+    ]
+
+
+# The frames handed to CovidData, in order
+FRAME_NAMES = [
+    "world_df",
+    "international_df",
+    "international_states_df",
+    "us_testing_df",
+    "us_states_testing_df",
+    "us_county_df",
+]
+
+
+def get_frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# Every set up of a Data object gets the next generation, so results
+# computed from older data can be told apart
+GENERATIONS = itertools.count(1)
 
 
 class Data:
-    def __init__(self):
+    def __init__(self, parallel=False, compact=False, tensor=False):
         self.world_df = None
         self.raw_global_df = None
         self.international_df = None
@@ -14,7 +231,19 @@ class Data:
         self.us_states_testing_df = None
         self.us_county_df = None
         self.CovidDf = None
+        # Rate of change statistics per (entity, metric), as a table and as
+        # the dicts the Data panel looks up
+        self.summary = None
+        self.summary_stats = {}
+        # The entities offered by the selectors
+        self.entity_catalog = None
         self.last_update = None
+        self.generation = None
+        self.parallel = parallel
+        self.compact = compact
+        self.tensor = tensor
+        self.stage_timings = OrderedDict()
+        self.bytes_before_compaction = OrderedDict()
 
         self.set_up()
 
@@ -28,81 +257,79 @@ class Data:
         return False
 
     def set_up(self, overwrite=False):
-        # The international COVID dataset, aggregated per country and state
-        # Source: Kaggle
         print("Setting up data")
-        self.last_update = time.time()
-        self.raw_global_df = api_utils.get_international_dataset()
+        start = time.time()
+        self.last_update = start
 
-        self.world_df = processing_utils.create_world_df(self.raw_global_df.copy())
+        stages = get_ingestion_stages(overwrite=overwrite)
+        if self.parallel:
+            results, timings = run_stages_in_parallel(stages)
+        else:
+            results, timings = run_stages_sequentially(stages)
 
-        print("Finished world data")
+        # None when the international frames were read from the cache
+        self.raw_global_df = results["raw_global_df"][1]
+        (
+            self.world_df,
+            self.international_df,
+            self.international_states_df,
+        ) = results["international_dfs"]
+        self.us_testing_df = results["us_testing_df"]
+        self.us_states_testing_df = results["us_states_testing_df"]
+        self.us_county_df = results["us_county_df"]
 
-        self.international_df = processing_utils.post_process_international_df(
-            self.raw_global_df.copy()
+        timings["total"] = time.time() - start
+        self.stage_timings = timings
+        print("Finished setting up data in {:.2f}s".format(timings["total"]))
+
+        # Wrapper class for all of the different data sources
+        frames = [getattr(self, name) for name in FRAME_NAMES]
+        self.CovidDf = CovidData(
+            frames, compact=self.compact, names=FRAME_NAMES, tensor=self.tensor
         )
 
-        self.international_states_df = (
-            processing_utils.post_process_international_states_df(
-                self.raw_global_df.copy(), self.international_df.copy()
+        if self.compact:
+            self.bytes_before_compaction = OrderedDict(
+                (name, get_frame_bytes(df)) for name, df in zip(FRAME_NAMES, frames)
             )
-        )
+            # Only the compact frames are kept
+            self.raw_global_df = None
+            for name, df in zip(FRAME_NAMES, self.CovidDf.dataframes):
+                setattr(self, name, df)
 
-        print("Finished international df")
+        self.entity_catalog = build_entity_catalog(self.CovidDf.dataframes)
 
-        # US testing dataset
-        # Source: https://covidtracking.com/api/
-        try:
-            self.us_testing_df = processing_utils.post_process_us_testing_df(
-                api_utils.get_historical_us_testing_data()
-            )
-        except Exception as e:
-            print("US-wide Experimental failed")
-            print(e)
+        # The statistics only change with the data, so they are computed once
+        summary_start = time.time()
+        self.summary = self.CovidDf.get_summary_table()
+        self.summary_stats = processing_utils.get_stats_lookup(self.summary)
+        print("Built the summary table in {:.2f}s".format(time.time() - summary_start))
 
-            self.us_testing_df = processing_utils.stable_post_process_us_testing_df(
-                api_utils.get_historical_us_testing_data()
-            )
+        self.generation = next(GENERATIONS)
 
-        try:
-            self.us_states_testing_df = processing_utils.post_process_state_testing_df(
-                api_utils.get_historical_states_testing_data()
-            )
-        except Exception as e:
-            print("State-wide Experimental failed")
-            print(e)
-            self.us_states_testing_df = (
-                processing_utils.stable_post_process_state_testing_df(
-                    api_utils.get_historical_states_testing_data()
-                )
-            )
+    def memory_report(self):
+        """
+        Bytes held by each frame, before and after compaction. Without
+        compaction both columns are the same.
+        """
+        rows = []
+        for name, df in zip(FRAME_NAMES, self.CovidDf.dataframes):
+            after = get_frame_bytes(df)
+            before = self.bytes_before_compaction.get(name, after)
+            rows.append((name, before, after))
 
-        print("Finished US and states DF")
+        rows.append(("total", sum(row[1] for row in rows), sum(row[2] for row in rows)))
 
-        (
-            county_deaths,
-            county_confirmed,
-        ) = api_utils.get_johns_hopkins_county_level_data()
-        self.us_county_df = processing_utils.post_process_county_df_jhu(
-            county_deaths, county_confirmed, overwrite=overwrite
+        return pd.DataFrame(rows, columns=["Frame", "Before", "After"]).set_index(
+            "Frame"
         )
 
-        # Covid data per US county
-        # Source: NY Times
-        # self.us_county_df = processing_utils.post_process_county_df(
-        #     api_utils.get_historical_county_level_data()
-        # )
+    def summary_report(self):
+        """
+        The summary table flattened for export: one row per entity and
+        metric, one column per statistic.
+        """
+        report = self.summary.copy()
+        report.columns = [" ".join(col) for col in report.columns]
 
-        print("Finished county df")
-
-        # Wrapper class for all of the different data sources
-        self.CovidDf = CovidData(
-            [
-                self.world_df,
-                self.international_df,
-                self.international_states_df,
-                self.us_testing_df,
-                self.us_states_testing_df,
-                self.us_county_df,
-            ]
-        )
+        return report.reset_index()
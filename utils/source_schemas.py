@@ -0,0 +1,308 @@
+"""
+Declarative descriptions of the covidtracking.com testing sources.
+
+Each source has a list of parsers, tried in order on the same downloaded
+bytes: the experimental one first, then the stable fallback. A parser lists
+the raw columns it keeps with their name and dtype, how its dates are
+written, and the derived metrics to add. Columns that are not listed are
+dropped while the payload is parsed.
+"""
+import json
+from collections import namedtuple
+from io import BytesIO
+from itertools import chain
+
+import pandas as pd
+
+from utils import dates
+from utils import processing_utils
+from utils.processing_utils import (
+    COUNTRY_COL,
+    CUM_ICU_COL,
+    CUM_VENTILATOR_COL,
+    CURR_ICU_COL,
+    CURR_VENTILATOR_COL,
+    CURRENT_HOSPITALIED_COL,
+    CONFIRMED_COL,
+    DATE_COL,
+    DEATHS_COL,
+    DELTA_COL_SUFFIX,
+    HOSPITALIZED_COL,
+    NEGATIVE_TEST_COL,
+    STATE_COL,
+    TOTAL_TEST_COL,
+)
+
+CSV_FORMAT = "csv"
+JSON_FORMAT = "json"
+
+ParserSchema = namedtuple(
+    "ParserSchema",
+    [
+        "name",
+        "file_format",
+        # (raw name, name, dtype) of every column that is kept
+        "columns",
+        "date_format",
+        # Columns set to the same value on every row
+        "constants",
+        # Columns rewritten with processing_utils.build_labels
+        "labels",
+        "sort_cols",
+        "group_cols",
+        "delta_cols",
+        "percent_cols",
+    ],
+)
+
+
+def get_us_state_label(abbrev):
+    return processing_utils.STATE_MAPPING.get(abbrev, abbrev) + " (United States)"
+
+
+US_TESTING_PARSERS = [
+    ParserSchema(
+        name="experimental",
+        file_format=CSV_FORMAT,
+        columns=[
+            ("date", DATE_COL, "object"),
+            ("negative", NEGATIVE_TEST_COL, "float64"),
+            ("totalTestResults", TOTAL_TEST_COL, "float64"),
+            ("hospitalizedCumulative", HOSPITALIZED_COL, "float64"),
+            ("negativeIncrease", NEGATIVE_TEST_COL + DELTA_COL_SUFFIX, "float64"),
+            ("totalTestResultsIncrease", TOTAL_TEST_COL + DELTA_COL_SUFFIX, "float64"),
+            ("hospitalizedIncrease", HOSPITALIZED_COL + DELTA_COL_SUFFIX, "float64"),
+            ("inIcuCurrently", CURR_ICU_COL, "float64"),
+            ("inIcuCumulative", CUM_ICU_COL, "float64"),
+            ("onVentilatorCurrently", CURR_VENTILATOR_COL, "float64"),
+            ("onVentilatorCumulative", CUM_VENTILATOR_COL, "float64"),
+            ("hospitalizedCurrently", CURRENT_HOSPITALIED_COL, "float64"),
+        ],
+        date_format="%Y%m%d",
+        constants={COUNTRY_COL: "United States"},
+        labels={},
+        sort_cols=[DATE_COL],
+        group_cols=[COUNTRY_COL],
+        delta_cols=[
+            CURR_ICU_COL,
+            CURR_VENTILATOR_COL,
+            CUM_ICU_COL,
+            CUM_VENTILATOR_COL,
+            CURRENT_HOSPITALIED_COL,
+        ],
+        percent_cols=[
+            NEGATIVE_TEST_COL,
+            TOTAL_TEST_COL,
+            HOSPITALIZED_COL,
+            CURR_ICU_COL,
+            CURRENT_HOSPITALIED_COL,
+            CURR_VENTILATOR_COL,
+            CUM_ICU_COL,
+            CUM_VENTILATOR_COL,
+        ],
+    ),
+    ParserSchema(
+        name="stable",
+        file_format=CSV_FORMAT,
+        columns=[
+            ("date", DATE_COL, "object"),
+            ("negative", NEGATIVE_TEST_COL, "float64"),
+            ("totalTestResults", TOTAL_TEST_COL, "float64"),
+            ("hospitalized", HOSPITALIZED_COL, "float64"),
+            ("negativeIncrease", NEGATIVE_TEST_COL + DELTA_COL_SUFFIX, "float64"),
+            ("totalTestResultsIncrease", TOTAL_TEST_COL + DELTA_COL_SUFFIX, "float64"),
+            ("hospitalizedIncrease", HOSPITALIZED_COL + DELTA_COL_SUFFIX, "float64"),
+        ],
+        date_format="%Y%m%d",
+        constants={COUNTRY_COL: "United States"},
+        labels={},
+        sort_cols=[DATE_COL],
+        group_cols=[COUNTRY_COL],
+        delta_cols=[],
+        percent_cols=[NEGATIVE_TEST_COL, TOTAL_TEST_COL, HOSPITALIZED_COL],
+    ),
+]
+
+# The state parsers only differ in the column their dates come from
+STATE_TESTING_COLUMNS = [
+    ("state", STATE_COL, "object"),
+    ("negative", NEGATIVE_TEST_COL, "float64"),
+    ("positive", CONFIRMED_COL, "float64"),
+    ("death", DEATHS_COL, "float64"),
+    ("hospitalizedCumulative", HOSPITALIZED_COL, "float64"),
+    ("totalTestResults", TOTAL_TEST_COL, "float64"),
+    ("positiveIncrease", CONFIRMED_COL + DELTA_COL_SUFFIX, "float64"),
+    ("negativeIncrease", NEGATIVE_TEST_COL + DELTA_COL_SUFFIX, "float64"),
+    ("totalTestResultsIncrease", TOTAL_TEST_COL + DELTA_COL_SUFFIX, "float64"),
+    ("hospitalizedIncrease", HOSPITALIZED_COL + DELTA_COL_SUFFIX, "float64"),
+    ("deathIncrease", DEATHS_COL + DELTA_COL_SUFFIX, "float64"),
+    ("inIcuCurrently", CURR_ICU_COL, "float64"),
+    ("inIcuCumulative", CUM_ICU_COL, "float64"),
+    ("onVentilatorCurrently", CURR_VENTILATOR_COL, "float64"),
+    ("onVentilatorCumulative", CUM_VENTILATOR_COL, "float64"),
+    ("hospitalizedCurrently", CURRENT_HOSPITALIED_COL, "float64"),
+]
+
+STATE_TESTING_DELTA_COLS = [
+    CURR_ICU_COL,
+    CURR_VENTILATOR_COL,
+    CURRENT_HOSPITALIED_COL,
+    CUM_ICU_COL,
+    CUM_VENTILATOR_COL,
+]
+
+STATE_TESTING_PERCENT_COLS = [
+    NEGATIVE_TEST_COL,
+    CONFIRMED_COL,
+    DEATHS_COL,
+    TOTAL_TEST_COL,
+    HOSPITALIZED_COL,
+    CURR_ICU_COL,
+    CURR_VENTILATOR_COL,
+    CUM_ICU_COL,
+    CUM_VENTILATOR_COL,
+    CURRENT_HOSPITALIED_COL,
+]
+
+US_STATES_TESTING_PARSERS = [
+    ParserSchema(
+        name="experimental",
+        file_format=JSON_FORMAT,
+        columns=[("dateChecked", DATE_COL, "object")] + STATE_TESTING_COLUMNS,
+        date_format=None,
+        constants={},
+        labels={STATE_COL: get_us_state_label},
+        sort_cols=[DATE_COL, STATE_COL],
+        group_cols=[STATE_COL],
+        delta_cols=STATE_TESTING_DELTA_COLS,
+        percent_cols=STATE_TESTING_PERCENT_COLS,
+    ),
+    ParserSchema(
+        name="stable",
+        file_format=JSON_FORMAT,
+        columns=[("date", DATE_COL, "object")] + STATE_TESTING_COLUMNS,
+        date_format="%Y%m%d",
+        constants={},
+        labels={STATE_COL: get_us_state_label},
+        sort_cols=[DATE_COL, STATE_COL],
+        group_cols=[STATE_COL],
+        delta_cols=STATE_TESTING_DELTA_COLS,
+        percent_cols=STATE_TESTING_PERCENT_COLS,
+    ),
+]
+
+SOURCE_PARSERS = {
+    "us_testing": US_TESTING_PARSERS,
+    "us_states_testing": US_STATES_TESTING_PARSERS,
+}
+
+
+def read_columns(raw, schema):
+    """
+    Parses only the columns listed in the schema. Listed columns that are
+    missing from the payload are left out, as a rename would.
+    """
+    dtypes = {raw_name: dtype for raw_name, _, dtype in schema.columns}
+
+    if schema.file_format == CSV_FORMAT:
+        return pd.read_csv(
+            BytesIO(raw), usecols=lambda col: col in dtypes, dtype=dtypes
+        )
+
+    records = json.loads(raw.decode("utf-8"))
+    present = set()
+    for record in records:
+        present.update(record)
+
+    usecols = [col for col in dtypes if col in present]
+    df = pd.DataFrame.from_records(records, columns=usecols)
+
+    return df.astype({col: dtypes[col] for col in usecols})
+
+
+def compile_parser(schema):
+    """
+    Returns a function turning the raw bytes of a source into its processed
+    frame, following the schema.
+    """
+    renames = {raw_name: name for raw_name, name, _ in schema.columns}
+
+    def parse(raw):
+        df = read_columns(raw, schema).rename(columns=renames)
+        df[DATE_COL] = dates.parse_dates(df[DATE_COL], schema.date_format)
+
+        for col, value in schema.constants.items():
+            df[col] = value
+
+        for col, make_label in schema.labels.items():
+            df[col] = processing_utils.build_labels(make_label, df[col])
+
+        return processing_utils.add_derived_metrics(
+            df,
+            sort_cols=schema.sort_cols,
+            diff_group_cols=schema.group_cols,
+            delta_cols=schema.delta_cols,
+            percent_cols=schema.percent_cols,
+        )
+
+    return parse
+
+
+def get_frame_schema(schema):
+    """
+    The {column: dtype} of the frames a parser builds, checked by io_utils
+    against cached copies. Raw columns that nothing is derived from may be
+    missing from the payload.
+    """
+    required = set(
+        chain(
+            [DATE_COL],
+            schema.labels,
+            schema.sort_cols,
+            schema.group_cols,
+            schema.delta_cols,
+            schema.percent_cols,
+        )
+    )
+    frame_schema = {
+        name: dtype if name in required else (dtype, None)
+        for _, name, dtype in schema.columns
+    }
+    frame_schema[DATE_COL] = dates.DATE_DTYPE
+    frame_schema.update({col: "object" for col in schema.constants})
+    frame_schema.update(
+        processing_utils.get_derived_schema(schema.delta_cols, schema.percent_cols)
+    )
+
+    return frame_schema
+
+
+# A cached frame is valid when any of the parsers of its source built it
+FRAME_SCHEMAS = {
+    source: [get_frame_schema(schema) for schema in parsers]
+    for source, parsers in SOURCE_PARSERS.items()
+}
+
+COMPILED_PARSERS = {
+    source: [(schema.name, compile_parser(schema)) for schema in parsers]
+    for source, parsers in SOURCE_PARSERS.items()
+}
+
+
+def parse_source(source, raw):
+    """
+    Runs the parsers of a source on its raw bytes, falling back to the next
+    parser when one fails. The payload is downloaded once, whichever parser
+    ends up being used.
+    """
+    parsers = COMPILED_PARSERS[source]
+
+    for i, (name, parse) in enumerate(parsers):
+        try:
+            return parse(raw)
+        except Exception as e:
+            if i == len(parsers) - 1:
+                raise
+
+            print("{} {} parser failed".format(source, name))
+            print(e)
@@ -1,8 +1,6 @@
 from utils import data_fetcher
 from utils import processing_utils
 
-import altair as alt
-
 default_metrics = [
     processing_utils.CONFIRMED_COL,
     processing_utils.DEATHS_COL,
@@ -12,6 +10,8 @@ default_metrics = [
 default_country = ["World"]
 default_states = []
 default_county = []
+# The county picker browses no state until one is chosen
+default_county_state = "(none)"
 default_overlay_metric = 0
 default_overlay_threshold = 0
 
@@ -63,6 +63,9 @@ def load_instructions(st):
     &ensp;&ensp;> for Entities=**Italy**, **New York**  
     &ensp;&ensp;> overlay on Metric=**Confirmed** at Threshold=1000    
 
+    Checking **Plot against days since the threshold** replaces the dates on the x-axis with the number of days since each Entity
+    reached the threshold.
+
 
     Note that some combinations of Metrics and Entities have no reported data. In this case, you will see a blank graph.    
 
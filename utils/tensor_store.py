@@ -0,0 +1,465 @@
+"""
+An alternative storage engine for CovidData queries.
+
+Each frame is held as one dense array indexed by metric, entity and day
+offset, with NaN for missing values. The entities of a frame are the
+distinct combinations of its entity columns, so a county row keeps its state
+and a state row its country. Filtering then selects entities, aggregating
+to an entity column adds entities up, and aligning overlays shifts the day
+axis. The pandas filters and group-bys are not needed.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from utils.processing_utils import (
+    DATE_COL,
+    DAYS_SINCE_THRESHOLD_COL,
+    ENTITY_COL,
+    ENTITY_COLS,
+    MEASUREMENT_COL,
+)
+
+# `combos` has one row per entity, with the values of the frame's entity
+# columns. `values[metric_ids[metric], entity, day]` is the value of a
+# metric on `first_date` + day, and `present[entity, day]` tells whether the
+# frame has a row for that entity and day at all.
+FrameTensor = namedtuple(
+    "FrameTensor",
+    ["combos", "first_date", "n_days", "metric_ids", "values", "present"],
+)
+
+
+def build_frame_tensor(df, dtypes):
+    """
+    Builds the tensor of a frame, or returns None for frames the engine
+    cannot hold: frames without entities or dates, with times of day, or
+    with several rows for the same entity and day.
+    """
+    entity_cols = [col for col in ENTITY_COLS if col in df.columns]
+    if len(entity_cols) == 0 or DATE_COL not in df.columns:
+        return None
+
+    dates = df[DATE_COL].to_numpy()
+    valid = ~np.isnat(dates)
+    days = dates[valid].astype("datetime64[D]")
+    if not np.array_equal(days, dates[valid]):
+        return None
+
+    if len(days) == 0:
+        first_date = np.datetime64("1970-01-01", "D")
+        offsets = days.astype(np.int64)
+    else:
+        first_date = days.min()
+        offsets = (days - first_date).astype(np.int64)
+
+    codes = np.stack(
+        [pd.factorize(df[col])[0][valid] for col in entity_cols], axis=1
+    ).reshape(-1, len(entity_cols))
+    _, first_rows, combo_ids = np.unique(
+        codes, axis=0, return_index=True, return_inverse=True
+    )
+    combo_ids = combo_ids.reshape(-1)
+
+    # Entities are numbered in the order they first appear in the frame
+    order = np.argsort(first_rows, kind="stable")
+    combo_ids = np.argsort(order)[combo_ids]
+    positions = np.flatnonzero(valid)[first_rows[order]]
+    combos = (
+        df[entity_cols]
+        .iloc[positions]
+        .astype(dtypes[entity_cols])
+        .reset_index(drop=True)
+    )
+
+    n_days = int(offsets.max()) + 1 if len(offsets) > 0 else 0
+    cells = combo_ids * n_days + offsets
+    if len(np.unique(cells)) != len(cells):
+        return None
+
+    metric_cols = [
+        col
+        for col in df.columns
+        if col not in ENTITY_COLS
+        and col != DATE_COL
+        and col != DAYS_SINCE_THRESHOLD_COL
+        and dtypes[col].kind in "biuf"
+    ]
+
+    values = np.full((len(metric_cols), len(combos), n_days), np.nan)
+    for metric_id, col in enumerate(metric_cols):
+        values[metric_id, combo_ids, offsets] = df[col].to_numpy(
+            dtype=np.float64, na_value=np.nan
+        )[valid]
+
+    present = np.zeros((len(combos), n_days), dtype=bool)
+    present[combo_ids, offsets] = True
+
+    return FrameTensor(
+        combos=combos,
+        first_date=first_date,
+        n_days=n_days,
+        metric_ids={col: metric_id for metric_id, col in enumerate(metric_cols)},
+        values=values,
+        present=present,
+    )
+
+
+def get_sum_dtype(dtype):
+    """
+    The dtype of a groupby sum of a column of `dtype`.
+    """
+    return pd.Series([0], dtype=dtype).groupby([0]).sum().dtype
+
+
+class TensorStore:
+    """
+    Answers CovidData.get_displayable_data requests from frame tensors. The
+    results are the same as the pandas path's, including the order of rows
+    and frames.
+    """
+
+    def __init__(self, dfs, dtypes):
+        self.columns = [set(df.columns) for df in dfs]
+        self.dtypes = dtypes
+        self.tensors = [build_frame_tensor(df, d) for df, d in zip(dfs, dtypes)]
+        self.sum_dtypes = [
+            {}
+            if tensor is None
+            else {col: get_sum_dtype(d[col]) for col in tensor.metric_ids}
+            for tensor, d in zip(self.tensors, dtypes)
+        ]
+        # (frame, entity column) -> group code of every entity, the sorted
+        # group values and a {value: group code} lookup
+        self.group_codes = {}
+
+    def can_answer(self, entities, measurements, filter_dict, threshold_metric):
+        """
+        Whether every frame and metric a request reads is held in a tensor.
+        """
+        for columns, tensor in zip(self.columns, self.tensors):
+            needed = []
+            if any(col in columns for col in entities):
+                needed += [col for col in measurements if col in columns]
+
+            # Overlays read the rows of every frame with a filtered column
+            read = len(needed) > 0
+            if threshold_metric is not None and any(
+                col in columns for col in filter_dict
+            ):
+                read = True
+                if threshold_metric in columns:
+                    needed.append(threshold_metric)
+
+            if not read:
+                continue
+
+            if tensor is None or any(col not in tensor.metric_ids for col in needed):
+                return False
+
+        return True
+
+    def get_group_codes(self, i, entity_col):
+        key = (i, entity_col)
+        if key not in self.group_codes:
+            codes, uniques = pd.factorize(self.tensors[i].combos[entity_col], sort=True)
+            lookup = {value: code for code, value in enumerate(uniques)}
+            self.group_codes[key] = (codes, uniques, lookup)
+
+        return self.group_codes[key]
+
+    def get_entities(self, i, entity_col, values):
+        """
+        A mask of the entities of frame i whose `entity_col` is in `values`.
+        """
+        codes, _, lookup = self.get_group_codes(i, entity_col)
+        wanted = np.zeros(len(lookup) + 1, dtype=bool)
+        wanted[[lookup[value] for value in values if value in lookup]] = True
+
+        # Code -1 (missing) picks the trailing False
+        return wanted[codes]
+
+    def get_crossing_date(self, i, entity_col, entity, metric, threshold):
+        """
+        The first date on which a row of `entity` has a `metric` of at least
+        `threshold` in frame i, or None when none does.
+        """
+        tensor = self.tensors[i]
+        rows = self.get_entities(i, entity_col, [entity])
+        reached = (tensor.values[tensor.metric_ids[metric], rows] >= threshold).any(
+            axis=0
+        )
+
+        if not reached.any():
+            return None
+
+        return tensor.first_date + np.argmax(reached)
+
+    def aggregate(self, i, entity_col, metric, blocks, length, x_col, x_start):
+        """
+        Adds up `metric` per value of `entity_col` and x position, like
+        processing_utils.agg_df does on the rows of the blocks.
+
+        Each block is (entities, rows, offset): the row of entities[k] on
+        day d is kept when rows[k, d], at x position d - offset. Values are
+        added in block order, then entity order, with the compensated
+        summation of pandas' groupby sum, so the sums are the same to the
+        last bit as when pandas reads the rows in that order.
+        """
+        tensor = self.tensors[i]
+        codes, uniques, _ = self.get_group_codes(i, entity_col)
+        values = tensor.values[tensor.metric_ids[metric]]
+
+        # Only the groups of the blocks' entities get a row, in code order
+        used = np.unique(
+            np.concatenate([codes[entities] for entities, _, _ in blocks] + [[-1]])
+        )[1:]
+        local_codes = np.full(len(uniques) + 1, -1)
+        local_codes[used] = np.arange(len(used))
+
+        sums = np.zeros((len(used), length))
+        compensation = np.zeros((len(used), length))
+        present = np.zeros((len(used), length), dtype=bool)
+
+        for entities, rows, offset in blocks:
+            has_group = codes[entities] != -1
+            entities, rows = entities[has_group], rows[has_group]
+
+            start = max(offset, 0)
+            stop = tensor.n_days
+            if len(entities) == 0 or start >= stop:
+                continue
+
+            x_slice = slice(start - offset, stop - offset)
+            group = local_codes[codes[entities]]
+
+            # Entities of the same group are added one after the other: the
+            # k-th layer holds the k-th entity of every group
+            by_group = np.argsort(group, kind="stable")
+            is_start = np.ones(len(group), dtype=bool)
+            is_start[1:] = group[by_group][1:] != group[by_group][:-1]
+            group_starts = np.maximum.accumulate(
+                np.where(is_start, np.arange(len(group)), 0)
+            )
+            layers = np.empty(len(group), dtype=np.int64)
+            layers[by_group] = np.arange(len(group)) - group_starts
+            by_layer = np.argsort(layers, kind="stable")
+            layer_stops = np.cumsum(np.bincount(layers))
+
+            for layer_start, layer_stop in zip(np.r_[0, layer_stops[:-1]], layer_stops):
+                k = by_layer[layer_start:layer_stop]
+                g = group[k]
+                layer_rows = rows[k, start:stop]
+                layer_values = values[entities[k], start:stop]
+                added = layer_rows & ~np.isnan(layer_values)
+
+                total = sums[g, x_slice]
+                y = layer_values - compensation[g, x_slice]
+                t = total + y
+                new_compensation = t - total - y
+                new_compensation[np.isnan(new_compensation)] = 0
+
+                compensation[g, x_slice] = np.where(
+                    added, new_compensation, compensation[g, x_slice]
+                )
+                sums[g, x_slice] = np.where(added, t, total)
+                present[g, x_slice] |= layer_rows
+
+        group_ids, x_ids = np.nonzero(present)
+        dtypes = self.dtypes[i]
+
+        if x_col == DATE_COL:
+            x_values = pd.Series(
+                x_start + x_ids.astype("timedelta64[D]"), dtype="datetime64[ns]"
+            ).astype(dtypes[DATE_COL])
+        else:
+            x_values = pd.Series(x_ids, dtype=np.int64)
+
+        return pd.DataFrame(
+            {
+                ENTITY_COL: pd.Series(uniques.take(used[group_ids])).astype(
+                    dtypes[entity_col]
+                ),
+                x_col: x_values,
+                MEASUREMENT_COL: sums[group_ids, x_ids].astype(
+                    self.sum_dtypes[i][metric]
+                ),
+            }
+        )
+
+    def get_blocks(
+        self, threshold_value, threshold_metric, filter_dict, days_since_threshold
+    ):
+        """
+        The blocks of entity rows of each frame for a threshold overlay, as
+        CovidData.get_scaled_dataframes selects them, with the x axis
+        length and start of each frame. Frames without blocks are None.
+        """
+        entity_type_to_entity_to_min_date = {}
+        global_min_date = None
+
+        for entity_type, values in filter_dict.items():
+            for i, columns in enumerate(self.columns):
+                if entity_type not in columns or threshold_metric not in columns:
+                    continue
+
+                for entity_definition in values:
+                    this_min = self.get_crossing_date(
+                        i,
+                        entity_type,
+                        entity_definition,
+                        threshold_metric,
+                        threshold_value,
+                    )
+                    if this_min is None:
+                        continue
+
+                    if global_min_date is None or global_min_date > this_min:
+                        global_min_date = this_min
+
+                    min_dates = entity_type_to_entity_to_min_date.setdefault(
+                        entity_type, {}
+                    )
+                    if (
+                        entity_definition not in min_dates
+                        or this_min < min_dates[entity_definition]
+                    ):
+                        min_dates[entity_definition] = this_min
+
+        if global_min_date is None:
+            return None
+
+        frame_blocks = []
+        for i, columns in enumerate(self.columns):
+            tensor = self.tensors[i]
+            blocks = []
+            length = 0
+
+            for entity_type, entity_defs in entity_type_to_entity_to_min_date.items():
+                if entity_type not in columns:
+                    continue
+
+                for entity_def, min_date in entity_defs.items():
+                    entities = np.flatnonzero(
+                        self.get_entities(i, entity_type, [entity_def])
+                    )
+                    # Rows from the alignment date on, at x positions
+                    # counted from it
+                    offset = int((min_date - tensor.first_date).astype(np.int64))
+                    rows = tensor.present[entities].copy()
+                    rows[:, : max(offset, 0)] = False
+
+                    if threshold_metric in columns:
+                        rows &= (
+                            tensor.values[tensor.metric_ids[threshold_metric]][entities]
+                            >= threshold_value
+                        )
+
+                    blocks.append((entities, rows, offset))
+                    length = max(length, tensor.n_days - offset)
+
+            if len(blocks) == 0:
+                frame_blocks.append(None)
+                continue
+
+            x_start = None if days_since_threshold else global_min_date
+            frame_blocks.append((blocks, length, x_start))
+
+        return frame_blocks
+
+    def select_blocks(self, i, blocks, entity_col, values):
+        """
+        Restricts the blocks to the entities whose `entity_col` is in
+        `values`, one value after the other.
+        """
+        selected_blocks = []
+        for value in dict.fromkeys(values):
+            is_value = self.get_entities(i, entity_col, [value])
+            selected_blocks += [
+                (entities[is_value[entities]], rows[is_value[entities]], offset)
+                for entities, rows, offset in blocks
+            ]
+
+        return selected_blocks
+
+    def get_displayable_data(
+        self,
+        entities,
+        measurements,
+        filter_dict,
+        threshold_value=None,
+        threshold_metric=None,
+        days_since_threshold=False,
+    ):
+        """
+        Same as CovidData.get_displayable_data, or None when the request
+        reads data the tensors do not hold.
+        """
+        if threshold_value is None or threshold_metric is None:
+            threshold_metric = None
+
+        if not self.can_answer(entities, measurements, filter_dict, threshold_metric):
+            return None
+
+        x_col = DATE_COL
+        if threshold_metric is None:
+            frame_blocks = [
+                None
+                if tensor is None
+                else (
+                    [(np.arange(len(tensor.combos)), tensor.present, 0)],
+                    tensor.n_days,
+                    tensor.first_date,
+                )
+                for tensor in self.tensors
+            ]
+        else:
+            frame_blocks = self.get_blocks(
+                threshold_value, threshold_metric, filter_dict, days_since_threshold
+            )
+            if frame_blocks is None:
+                return {}
+
+            if days_since_threshold:
+                x_col = DAYS_SINCE_THRESHOLD_COL
+
+        results = {col: [] for col in measurements}
+
+        for i, columns in enumerate(self.columns):
+            if frame_blocks[i] is None:
+                continue
+
+            blocks, length, x_start = frame_blocks[i]
+            matching_entity_cols = [col for col in entities if col in columns]
+            matching_measurement_cols = [col for col in measurements if col in columns]
+
+            for entity_col in matching_entity_cols:
+                # Each entity column is filtered once, by its own filter.
+                # Filtered rows are read grouped by filter value, as the
+                # entity index returns them.
+                selected_blocks = blocks
+                if filter_dict.get(entity_col, ["ALL"]) != ["ALL"]:
+                    selected_blocks = self.select_blocks(
+                        i, blocks, entity_col, filter_dict[entity_col]
+                    )
+
+                for measurement_col in matching_measurement_cols:
+                    results[measurement_col].append(
+                        self.aggregate(
+                            i,
+                            entity_col,
+                            measurement_col,
+                            selected_blocks,
+                            length,
+                            x_col,
+                            x_start,
+                        )
+                    )
+
+        combined_results = {}
+        for measurement, dataframes in results.items():
+            if len(dataframes) > 0:
+                combined_results[measurement] = pd.concat(dataframes)
+
+        return combined_results